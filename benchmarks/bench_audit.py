@@ -0,0 +1,83 @@
+"""审计日志写入基准测试
+
+对比在调用路径上逐条写入并fsync(sync)与AuditLog后台批量写入(queued)，输出每秒记录数、
+调用方耗时的p50/p99以及丢弃数。--slow-disk 给每次写入增加延迟，模拟磁盘变慢时的背压:
+调用方耗时不超过max_wait，超出队列容量的记录被丢弃。
+
+用法(在项目根目录执行):
+    python -m benchmarks.bench_audit --n 20000
+    python -m benchmarks.bench_audit --n 20000 --slow-disk 0.05 --max-pending 1000
+"""
+import argparse
+import os
+import statistics
+import tempfile
+import time
+
+from edjserver.EdjAudit import AuditLog
+from edjserver.EdjJson import dumps
+
+PARAMS = {'appkey': '61000158', 'ver': '3.4.3', 'from': '01012345', 'timestamp': '1792275034', 'sig': 'x' * 32,
+          'token': 'f' * 64, 'phone': '13800138000', 'start_latitude': 40.018682, 'start_longitude': 116.476169,
+          'end_latitude': 39.908692, 'end_longitude': 116.397477}
+RESPONSE = {'code': '0', 'message': '成功', 'data': {'fee': 68.0, 'distance': 14.2}}
+
+
+def bench_sync(n, path, slow_disk):
+    latencies = []
+    with open(path, 'ab') as f:
+        for _ in range(n):
+            start = time.perf_counter()
+            f.write((dumps({'ts': time.time(), 'params': PARAMS, 'code': RESPONSE['code']}) + '\n').encode())
+            f.flush()
+            os.fsync(f.fileno())
+            if slow_disk:
+                time.sleep(slow_disk)
+            latencies.append(time.perf_counter() - start)
+    return latencies, 0
+
+
+def bench_queued(n, directory, slow_disk, max_pending, max_wait):
+    audit = AuditLog(directory, max_pending=max_pending, max_wait=max_wait)
+    if slow_disk:
+        write = audit._write
+
+        def slow_write(lines):
+            time.sleep(slow_disk)
+            write(lines)
+        audit._write = slow_write
+    latencies = []
+    for _ in range(n):
+        start = time.perf_counter()
+        audit.record('/order/costestimateV2', PARAMS, RESPONSE, 0.02)
+        latencies.append(time.perf_counter() - start)
+    audit.close(timeout=60)
+    return latencies, audit.dropped
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--n', type=int, default=20000, help='记录数')
+    parser.add_argument('--slow-disk', type=float, default=0.0, help='每次写入附加的延迟(秒)')
+    parser.add_argument('--max-pending', type=int, default=AuditLog.DEFAULT_MAX_PENDING, help='写入队列容量')
+    parser.add_argument('--max-wait', type=float, default=AuditLog.DEFAULT_MAX_WAIT, help='队列满时最多等待(秒)')
+    args = parser.parse_args()
+
+    root = tempfile.mkdtemp(prefix='edj_bench_audit_')
+    # 逐条fsync在慢磁盘下太慢，只跑一小部分
+    sync_n = args.n if not args.slow_disk else min(args.n, 50)
+    print(f"{'writer':<8} {'records':>8} {'records/s':>10} {'p50(us)':>9} {'p99(us)':>10} {'dropped':>8}")
+    for name, n, fn in (
+            ('sync', sync_n, lambda n: bench_sync(n, os.path.join(root, 'sync.log'), args.slow_disk)),
+            ('queued', args.n, lambda n: bench_queued(n, os.path.join(root, 'audit'), args.slow_disk,
+                                                      args.max_pending, args.max_wait))):
+        start = time.perf_counter()
+        latencies, dropped = fn(n)
+        elapsed = time.perf_counter() - start
+        latencies.sort()
+        print(f"{name:<8} {n:>8} {n / elapsed:>10.0f} {statistics.median(latencies) * 1e6:>9.1f} "
+              f"{latencies[int(len(latencies) * 0.99)] * 1e6:>10.1f} {dropped:>8}")
+
+
+if __name__ == '__main__':
+    main()
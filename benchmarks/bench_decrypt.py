@@ -0,0 +1,75 @@
+"""认证token解密基准测试
+
+对比原有解密流程(每次新建AES对象)、TokenDecryptor.decrypt(共用密钥时缓存AES对象)和
+TokenDecryptor.decrypt_many(按密钥分组一次解密)，分别在所有token共用一个randomkey和
+每个请求使用各自randomkey(服务的默认做法)两种情况下，输出每秒解密的token数。
+每个请求使用各自密钥时无法复用AES对象，主要开销是密钥扩展，各方法接近。
+
+用法(在项目根目录执行):
+    python -m benchmarks.bench_decrypt --n 20000
+"""
+import argparse
+import base64
+import secrets
+import time
+
+from Crypto.Cipher import AES
+from Crypto.Util.Padding import pad, unpad
+
+from edjserver.EdjSignUtils import EdjSignUtils, TokenDecryptor
+
+
+def encrypt(token, randomkey):
+    cipher = AES.new(randomkey.encode(), AES.MODE_ECB)
+    return base64.b64encode(cipher.encrypt(pad(token.encode(), AES.block_size))).decode()
+
+
+def decrypt_baseline(encrypt_token, randomkey):
+    cipher = AES.new(randomkey.encode(), AES.MODE_ECB)
+    return unpad(cipher.decrypt(base64.b64decode(encrypt_token)), AES.block_size).decode()
+
+
+def make_items(n, shared_key):
+    """模拟认证接口返回的token(64位十六进制，与模拟服务一致)"""
+    items, tokens = [], []
+    for _ in range(n):
+        token = secrets.token_hex(32)
+        randomkey = EdjSignUtils.DEFAULT_RANDOMKEY if shared_key else EdjSignUtils.generate_randomkey()
+        items.append((encrypt(token, randomkey), randomkey))
+        tokens.append(token)
+    return items, tokens
+
+
+def run(name, fn, items, tokens):
+    start = time.perf_counter()
+    result = fn(items)
+    elapsed = time.perf_counter() - start
+    assert result == tokens, f"{name}: 解密结果不一致"
+    return len(items) / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--n', type=int, default=20000, help='token数')
+    args = parser.parse_args()
+
+    variants = [
+        ('baseline', lambda items: [decrypt_baseline(*item) for item in items]),
+        ('decrypt', lambda items: [decryptor.decrypt(encrypted, key, cache=shared_key)
+                                   for encrypted, key in items]),
+        ('decrypt_many', lambda items: decryptor.decrypt_many(items)),
+    ]
+    print(f"{'randomkey':<12} {'method':<14} {'tokens/s':>12} {'speedup':>8}")
+    for label, shared_key in (('shared', True), ('per-request', False)):
+        items, tokens = make_items(args.n, shared_key)
+        baseline = None
+        for name, fn in variants:
+            decryptor = TokenDecryptor()
+            run(name, fn, items[:100], tokens[:100])  # 预热
+            rate = run(name, fn, items, tokens)
+            baseline = baseline or rate
+            print(f"{label:<12} {name:<14} {rate:>12.0f} {rate / baseline:>7.2f}x")
+
+
+if __name__ == '__main__':
+    main()
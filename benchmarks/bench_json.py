@@ -0,0 +1,99 @@
+"""上游响应解码到MCP响应的基准测试
+
+对比原有流程(httpx的response.json()解析为dict，工具返回dict后由FastMCP序列化文本内容、
+两次to_jsonable_python生成结构化内容)与当前流程(EdjJson解析并包装为结果模型，
+工具返回JsonToolResult只序列化一次)，覆盖预估和城市价格表两种响应。
+每次调用包括: 解析上游响应、组装工具返回值、FunctionTool.run、构建CallToolResult并序列化为
+发给客户端的JSON，输出平均耗时(微秒)。
+
+用法(在项目根目录执行):
+    python -m benchmarks.bench_json --n 20000 --rules 48
+    EDJ_JSON=std python -m benchmarks.bench_json    # 不使用orjson，只比较省去的拷贝
+"""
+import argparse
+import asyncio
+import json
+import time
+
+import httpx
+from fastmcp.tools.tool import FunctionTool
+from mcp.types import CallToolResult
+
+from edjserver.EdjApi import EdjApi
+from edjserver.EdjJson import BACKEND
+from edjserver.EdjMetrics import EdjMetrics
+from edjserver.EdjMockServer import MockEdjServer
+from edjserver.EdjModels import JsonToolResult
+
+
+def estimate_body():
+    return json.dumps({'code': '0', 'message': '成功',
+                       'data': {'fee': 89.0, 'distance': 12.37}}, ensure_ascii=False).encode()
+
+
+def price_list_body(rules):
+    items = [dict(MockEdjServer.PRICE_RULES[n % 2], city_id=1, city_name='北京', channel='01003')
+             for n in range(rules)]
+    return json.dumps({'code': '0', 'message': '成功', 'data': items}, ensure_ascii=False).encode()
+
+
+def estimate_payload(result):
+    return {'start_address': '望京SOHO', 'end_address': '天安门', 'phone': '13900000000',
+            'estimate_result': result}
+
+
+def price_list_payload(result):
+    return {'city_name': '北京', 'fetched_at': 1700000000.0, 'price_result': result}
+
+
+def make_tools(api, endpoint, payload):
+    """返回(原有流程, 当前流程)两个工具，每次调用解析同一份上游响应"""
+    holder = {}
+
+    def baseline() -> dict:
+        return payload(holder['response'].json())
+
+    def current() -> dict:
+        return JsonToolResult(payload(api._decode(endpoint, holder['response'])))
+
+    return holder, FunctionTool.from_function(baseline), FunctionTool.from_function(current)
+
+
+async def measure(tool, holder, body, n):
+    start = time.perf_counter()
+    for _ in range(n):
+        holder['response'] = httpx.Response(200, content=body)
+        result = (await tool.run({})).to_mcp_result()
+        content, structured = result if isinstance(result, tuple) else (result, None)
+        CallToolResult(content=content, structuredContent=structured).model_dump_json(
+            by_alias=True, exclude_none=True)
+    return (time.perf_counter() - start) / n * 1e6
+
+
+async def main_async(args):
+    api = EdjApi(metrics=EdjMetrics())
+    cases = [
+        ('estimate', '/order/costestimateV2', estimate_payload, estimate_body()),
+        (f'price_list[{args.rules}]', '/city/price/list', price_list_payload, price_list_body(args.rules)),
+    ]
+    print(f"json backend: {BACKEND}")
+    print(f"{'response':<16} {'bytes':>7} {'baseline(us)':>13} {'current(us)':>12} {'speedup':>8}")
+    for name, endpoint, payload, body in cases:
+        holder, baseline, current = make_tools(api, endpoint, payload)
+        # 预热
+        await measure(baseline, holder, body, 100)
+        await measure(current, holder, body, 100)
+        before = await measure(baseline, holder, body, args.n)
+        after = await measure(current, holder, body, args.n)
+        print(f"{name:<16} {len(body):>7} {before:>13.1f} {after:>12.1f} {before / after:>7.2f}x")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--n', type=int, default=20000, help='每种响应的调用次数')
+    parser.add_argument('--rules', type=int, default=48, help='价格表条目数')
+    asyncio.run(main_async(parser.parse_args()))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,139 @@
+"""MCP工具负载测试
+
+启动本地模拟e代驾服务，通过FastMCP客户端(内存传输)在不同并发下调用
+estimate_cost、call_driver和refresh_token，输出延迟分位数、吞吐量以及
+每次工具调用产生的上游请求数。
+
+用法(在项目根目录执行):
+    python -m benchmarks.bench_mcp_tools --concurrency 1,8,32,128 --calls 500 --latency 0.02
+
+模拟服务默认与被测服务运行在同一进程内，高并发时两者争用GIL；需要更接近真实的
+数据时，先单独启动模拟服务再通过--mock-url指定:
+    python -m edjserver.EdjMockServer --port 18080 --latency 0.02 &
+    python -m benchmarks.bench_mcp_tools --mock-url http://127.0.0.1:18080
+"""
+import argparse
+import asyncio
+import json
+import tempfile
+import time
+
+import httpx
+from fastmcp import Client
+
+import edaijiamcp
+from edjserver.EdjAudit import AuditLog
+from edjserver.EdjMockServer import MockConfig, MockEdjServer
+from edjserver.EdjOrderJournal import OrderJournal
+from edjserver.EdjTokenCache import EdjTokenCache
+from edjserver.EdjTokenStore import KVTokenStore
+
+PHONES = [f"139{n:08d}" for n in range(200)]
+
+
+def tool_args(tool, n):
+    phone = PHONES[n % len(PHONES)]
+    if tool == 'refresh_token':
+        return {'phone': phone}
+    return {
+        'start_address': '望京SOHO', 'start_longitude': 116.476169, 'start_latitude': 40.018682,
+        'end_address': '天安门', 'end_longitude': 116.397477 + (n % 50) * 0.001, 'end_latitude': 39.908692,
+        'phone': phone
+    }
+
+
+def percentile(samples, p):
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(len(samples) * p))]
+
+
+class RemoteMock:
+    """通过/__stats读取独立进程中模拟服务的调用统计"""
+
+    def __init__(self, base_url):
+        self.base_url = base_url
+
+    @property
+    def calls(self):
+        return httpx.get(f"{self.base_url}/__stats").json()['calls']
+
+    def stop(self):
+        pass
+
+
+async def run_level(client, mock, tool, concurrency, calls):
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+    errors = 0
+
+    async def one(n):
+        nonlocal errors
+        async with semaphore:
+            start = time.perf_counter()
+            result = await client.call_tool(tool, tool_args(tool, n), raise_on_error=False)
+            latencies.append(time.perf_counter() - start)
+            if result.is_error or 'error' in json.loads(result.content[0].text):
+                errors += 1
+
+    before = {k: v for k, v in mock.calls.items() if k != '/order/polling'}
+    start = time.perf_counter()
+    await asyncio.gather(*(one(n) for n in range(calls)))
+    elapsed = time.perf_counter() - start
+    after = {k: v for k, v in mock.calls.items() if k != '/order/polling'}
+    upstream = sum(after.values()) - sum(before.values())
+    return {
+        'tool': tool, 'concurrency': concurrency, 'calls': calls, 'errors': errors,
+        'throughput': calls / elapsed,
+        'p50': percentile(latencies, 0.5), 'p95': percentile(latencies, 0.95),
+        'p99': percentile(latencies, 0.99), 'upstream_per_call': upstream / calls
+    }
+
+
+async def main_async(args):
+    if args.mock_url:
+        mock = RemoteMock(args.mock_url)
+        base_url = args.mock_url
+    else:
+        mock = MockEdjServer(MockConfig(latency=args.latency, jitter=args.jitter,
+                                        error_rate=args.error_rate, expire_rate=args.expire_rate))
+        base_url = mock.start_in_thread()
+    edaijiamcp.api.api_base_url = base_url
+    edaijiamcp.api.token_cache = EdjTokenCache(store=KVTokenStore())
+    state_dir = tempfile.mkdtemp(prefix='edj_bench_')
+    edaijiamcp.order_journal = OrderJournal(state_dir + '/orders.log')
+    edaijiamcp.api.audit_log = AuditLog(state_dir + '/audit')
+    if not args.rate_limit:
+        # 压测的是服务本身的吞吐，默认不限流(同一手机号重复下单也会被本地拒绝)
+        edaijiamcp.api.rate_limiter = None
+
+    print(f"{'tool':<14} {'conc':>5} {'calls':>6} {'err':>5} {'req/s':>9} "
+          f"{'p50(ms)':>9} {'p95(ms)':>9} {'p99(ms)':>9} {'upstream/call':>14}")
+    try:
+        async with Client(edaijiamcp.mcp) as client:
+            for tool in args.tools.split(','):
+                for concurrency in (int(c) for c in args.concurrency.split(',')):
+                    r = await run_level(client, mock, tool, concurrency, args.calls)
+                    print(f"{r['tool']:<14} {r['concurrency']:>5} {r['calls']:>6} {r['errors']:>5} "
+                          f"{r['throughput']:>9.1f} {r['p50'] * 1e3:>9.1f} {r['p95'] * 1e3:>9.1f} "
+                          f"{r['p99'] * 1e3:>9.1f} {r['upstream_per_call']:>14.2f}")
+    finally:
+        await edaijiamcp.order_tracker.stop()
+        mock.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--tools', default='estimate_cost,call_driver,refresh_token')
+    parser.add_argument('--concurrency', default='1,8,32,128', help='并发数，逗号分隔')
+    parser.add_argument('--calls', type=int, default=500, help='每个并发级别的调用次数')
+    parser.add_argument('--latency', type=float, default=0.02, help='模拟上游基础延迟(秒)')
+    parser.add_argument('--jitter', type=float, default=0.01, help='模拟上游随机附加延迟(秒)')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='模拟上游503概率')
+    parser.add_argument('--expire-rate', type=float, default=0.0, help='模拟token过期概率')
+    parser.add_argument('--rate-limit', action='store_true', help='保留限流器(按EDJ_RATE_LIMIT*配置)')
+    parser.add_argument('--mock-url', default=None, help='使用已启动的模拟服务，忽略上面的模拟参数')
+    asyncio.run(main_async(parser.parse_args()))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,53 @@
+"""请求签名基准测试
+
+对比原有签名流程(每次构建系统参数、全量排序、从头计算MD5)与预计算的Signer，
+输出每秒签名次数。
+
+用法(在项目根目录执行):
+    python -m benchmarks.bench_sign --n 200000
+"""
+import argparse
+import time
+
+from edjserver.EdjSignUtils import EdjSignUtils, Signer
+from edjserver.EdjSystemParams import EdjSystemParams
+
+
+def estimate_params():
+    return {
+        'token': '84cf38b814d945d1b23042561a94ab2f130370e659af425b86f43cd0bec3b8c0',
+        'start_latitude': 40.018682,
+        'start_longitude': 116.476169,
+        'end_latitude': 39.908692,
+        'end_longitude': 116.397477
+    }
+
+
+def sign_baseline(params):
+    params.update(EdjSystemParams.get_system_params())
+    params['sig'] = EdjSignUtils.generate_sig(params, EdjSystemParams.DEFAULT_SECRET)
+    return params
+
+
+def run(fn, n):
+    start = time.perf_counter()
+    for _ in range(n):
+        fn(estimate_params())
+    return n / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--n', type=int, default=200000, help='签名次数')
+    args = parser.parse_args()
+
+    signer = Signer(EdjSystemParams.DEFAULT_SECRET, appkey=EdjSystemParams.DEFAULT_APPKEY,
+                    ver=EdjSystemParams.DEFAULT_VER, from_channel=EdjSystemParams.DEFAULT_FROM_CHANNEL)
+    baseline = run(sign_baseline, args.n)
+    signed = run(signer.sign, args.n)
+    print(f"baseline: {baseline:>12.0f} signs/s")
+    print(f"Signer:   {signed:>12.0f} signs/s  ({signed / baseline:.2f}x)")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,119 @@
+"""服务冷启动基准测试
+
+上层进程按需以stdio方式启动服务时，冷启动时间直接计入第一次工具调用的延迟。本脚本:
+1. 用 python -X importtime 导入edaijiamcp，输出导入总耗时、耗时最多的直接依赖和
+   edjserver各模块的耗时，并检查不应在启动时导入的模块(requests、pycryptodome)
+2. 多次以stdio方式启动 main.py，记录从启动进程到完成initialize、列出工具(工具就绪)
+   以及第一次调用refresh_token返回的时间，取中位数与目标值比较，超过目标时退出码为1
+
+用法(在项目根目录执行):
+    python -m benchmarks.bench_startup --runs 5 --target 1.0
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+from fastmcp import Client
+from fastmcp.client.transports import StdioTransport
+
+from edjserver.EdjMockServer import MockEdjServer
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# 启动时不应导入的模块: requests与httpx重复，pycryptodome只在解密token时需要
+LAZY_MODULES = ('requests', 'Crypto')
+
+
+def server_env(mock_url):
+    state_dir = tempfile.mkdtemp(prefix='edj_bench_startup_')
+    return dict(os.environ, API_BASE_URL=mock_url, EDJ_LOG_LEVEL='WARNING', FASTMCP_LOG_LEVEL='WARNING',
+                EDJ_TOKEN_STORE=f"sqlite:{state_dir}/tokens.db",
+                EDJ_ORDER_JOURNAL=f"{state_dir}/orders.log", EDJ_AUDIT_LOG=f"{state_dir}/audit")
+
+
+def import_profile(env):
+    """解析 -X importtime 输出，只保留由import edaijiamcp触发的导入(不含site等解释器启动时的导入)
+    Returns:
+        list: [(层级, 模块名, 自身耗时us, 累计耗时us)]，按导入完成顺序，最后一项为edaijiamcp
+    """
+    output = subprocess.run([sys.executable, '-W', 'ignore', '-X', 'importtime', '-c', 'import edaijiamcp'],
+                            cwd=ROOT, env=env, capture_output=True, text=True, check=True).stderr
+    entries = []
+    for line in output.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, cumulative, name = line[len('import time:'):].split('|')
+        level = (len(name) - len(name.lstrip())) // 2
+        entries.append((level, name.strip(), int(self_us), int(cumulative)))
+    # 输出按导入完成顺序排列，edaijiamcp的子树是它之前、上一个顶层导入之后的连续各项
+    end = next(i for i, entry in enumerate(entries) if entry[0] == 0 and entry[1] == 'edaijiamcp')
+    start = end
+    while start > 0 and entries[start - 1][0] > 0:
+        start -= 1
+    return entries[start:end + 1]
+
+
+def report_imports(entries, top):
+    total = entries[-1][3]
+    print(f"import edaijiamcp: {total / 1e3:.1f} ms")
+    # edaijiamcp的直接依赖(层级1)，被其他依赖先导入的模块计入先导入者
+    direct = sorted((e for e in entries if e[0] == 1), key=lambda e: -e[3])
+    print(f"\n{'direct import':<36} {'cumulative(ms)':>14}")
+    for _, name, _, cumulative in direct[:top]:
+        print(f"{name:<36} {cumulative / 1e3:>14.1f}")
+    print(f"\n{'edjserver module':<36} {'self(ms)':>14}")
+    for _, name, self_us, _ in entries:
+        if name.startswith('edjserver.'):
+            print(f"{name:<36} {self_us / 1e3:>14.1f}")
+    loaded = {name.split('.')[0] for _, name, _, _ in entries}
+    for module in LAZY_MODULES:
+        print(f"{module} imported at startup: {'YES' if module in loaded else 'no'}")
+
+
+async def cold_start(env):
+    """启动一次stdio服务
+    Returns:
+        tuple: (工具就绪耗时, 第一次工具调用完成耗时)，单位秒
+    """
+    start = time.perf_counter()
+    transport = StdioTransport(sys.executable, ['-W', 'ignore', 'main.py', '--transport', 'stdio'],
+                               env=env, cwd=ROOT)
+    async with Client(transport) as client:
+        await client.list_tools()
+        ready = time.perf_counter() - start
+        await client.call_tool('refresh_token', {'phone': '13900000000'})
+        first_call = time.perf_counter() - start
+    return ready, first_call
+
+
+async def main_async(args):
+    mock = MockEdjServer()
+    mock_url = mock.start_in_thread()
+    try:
+        env = server_env(mock_url)
+        report_imports(import_profile(env), args.top)
+        samples = [await cold_start(env) for _ in range(args.runs)]
+    finally:
+        mock.stop()
+    ready = statistics.median(s[0] for s in samples)
+    first_call = statistics.median(s[1] for s in samples)
+    print(f"\nstdio cold start ({args.runs} runs, median)")
+    print(f"tool ready:      {ready * 1e3:>8.0f} ms  (target {args.target * 1e3:.0f} ms)")
+    print(f"first tool call: {first_call * 1e3:>8.0f} ms")
+    return 0 if ready <= args.target else 1
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--runs', type=int, default=5, help='冷启动次数')
+    parser.add_argument('--top', type=int, default=10, help='输出耗时最多的直接依赖数')
+    parser.add_argument('--target', type=float, default=1.0, help='工具就绪时间目标(秒)')
+    sys.exit(asyncio.run(main_async(parser.parse_args())))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,73 @@
+"""token存储后端基准测试
+
+比较各TokenStore实现在不同用户规模下的写入吞吐和随机查询延迟。
+
+用法(在项目根目录执行):
+    python -m benchmarks.bench_token_store --sizes 10000,100000,1000000
+"""
+import argparse
+import random
+import shutil
+import tempfile
+import time
+
+from edjserver.EdjTokenStore import (FlatFileTokenStore, KVTokenStore, ShardedFileTokenStore,
+                                     SqliteTokenStore)
+
+TOKEN = 'x' * 64
+
+
+def make_stores(root):
+    return {
+        'file': FlatFileTokenStore(f"{root}/flat"),
+        'sharded': ShardedFileTokenStore(f"{root}/sharded"),
+        'sqlite': SqliteTokenStore(f"{root}/tokens.db", batch_size=1000),
+        'kv': KVTokenStore(),
+    }
+
+
+def percentile(samples, p):
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(len(samples) * p))]
+
+
+def bench(store, size, lookups):
+    phones = [f"1{n:010d}" for n in range(size)]
+
+    start = time.perf_counter()
+    for phone in phones:
+        store.put(phone, TOKEN)
+    store.flush()
+    write_rate = size / (time.perf_counter() - start)
+
+    samples = []
+    for phone in random.sample(phones, min(lookups, size)):
+        t0 = time.perf_counter()
+        store.get(phone)
+        samples.append(time.perf_counter() - t0)
+    return write_rate, percentile(samples, 0.5), percentile(samples, 0.99)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', default='10000,100000,1000000', help='手机号数量，逗号分隔')
+    parser.add_argument('--lookups', type=int, default=10000, help='每轮随机查询次数')
+    parser.add_argument('--stores', default='file,sharded,sqlite,kv', help='参与测试的存储，逗号分隔')
+    args = parser.parse_args()
+
+    print(f"{'store':<8} {'size':>9} {'writes/s':>12} {'get p50(us)':>12} {'get p99(us)':>12}")
+    for size in (int(s) for s in args.sizes.split(',')):
+        root = tempfile.mkdtemp(prefix='edj_token_bench_')
+        try:
+            stores = make_stores(root)
+            for name in args.stores.split(','):
+                store = stores[name]
+                write_rate, p50, p99 = bench(store, size, args.lookups)
+                store.close()
+                print(f"{name:<8} {size:>9} {write_rate:>12.0f} {p50 * 1e6:>12.1f} {p99 * 1e6:>12.1f}")
+        finally:
+            shutil.rmtree(root, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
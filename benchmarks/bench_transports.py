@@ -0,0 +1,150 @@
+"""MCP传输方式延迟对比
+
+启动独立进程的模拟e代驾服务，分别以stdio、SSE、streamable HTTP方式运行MCP服务
+(均通过main.py启动)，按顺序逐个调用estimate_cost、call_driver、refresh_token，
+输出每种传输方式下单次工具调用的延迟分位数。memory为进程内直接调用的基准，
+与其他传输方式的差值即传输本身的开销。
+
+用法(在项目根目录执行):
+    python -m benchmarks.bench_transports --transports memory,stdio,sse,streamable-http --calls 200
+"""
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+import httpx
+from fastmcp import Client
+from fastmcp.client.transports import StdioTransport
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+TOOLS = ('estimate_cost', 'call_driver', 'refresh_token')
+PHONES = [f"136{n:08d}" for n in range(20)]
+
+
+def tool_args(tool, n):
+    phone = PHONES[n % len(PHONES)]
+    if tool == 'refresh_token':
+        return {'phone': phone}
+    return {
+        'start_address': '望京SOHO', 'start_longitude': 116.476169, 'start_latitude': 40.018682,
+        'end_address': '天安门', 'end_longitude': 116.397477 + (n % 50) * 0.001, 'end_latitude': 39.908692,
+        'phone': phone
+    }
+
+
+def percentile(samples, p):
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(len(samples) * p))]
+
+
+def wait_ready(url, timeout=30.0):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            if httpx.get(url, timeout=1.0).status_code == 200:
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.2)
+    raise RuntimeError(f"服务未就绪: {url}")
+
+
+def server_env(mock_url):
+    """被测服务的环境变量: 指向模拟服务，状态写临时目录，不限流"""
+    state_dir = tempfile.mkdtemp(prefix='edj_bench_transport_')
+    return dict(os.environ, API_BASE_URL=mock_url, EDJ_RATE_LIMIT='0', EDJ_LOG_LEVEL='WARNING',
+                EDJ_TOKEN_STORE=f"sqlite:{state_dir}/tokens.db",
+                EDJ_ORDER_JOURNAL=f"{state_dir}/orders.log", EDJ_AUDIT_LOG=f"{state_dir}/audit")
+
+
+async def measure(client, calls):
+    """预热每个手机号的token后，逐个调用各工具并记录延迟"""
+    for n in range(len(PHONES)):
+        await client.call_tool('refresh_token', tool_args('refresh_token', n), raise_on_error=False)
+    results = {}
+    for tool in TOOLS:
+        latencies, errors = [], 0
+        for n in range(calls):
+            start = time.perf_counter()
+            result = await client.call_tool(tool, tool_args(tool, n), raise_on_error=False)
+            latencies.append(time.perf_counter() - start)
+            if result.is_error or 'error' in json.loads(result.content[0].text):
+                errors += 1
+        results[tool] = (latencies, errors)
+    return results
+
+
+async def run_memory(mock_url, calls):
+    os.environ.update(server_env(mock_url))
+    import edaijiamcp
+    try:
+        async with Client(edaijiamcp.mcp) as client:
+            return await measure(client, calls)
+    finally:
+        await edaijiamcp.order_tracker.stop()
+
+
+async def run_stdio(mock_url, calls):
+    transport = StdioTransport(sys.executable, ['-W', 'ignore', 'main.py', '--transport', 'stdio'],
+                               env=server_env(mock_url), cwd=ROOT)
+    async with Client(transport) as client:
+        return await measure(client, calls)
+
+
+async def run_http(transport, mock_url, calls, port, verbose):
+    output = None if verbose else subprocess.DEVNULL
+    server = subprocess.Popen([sys.executable, '-W', 'ignore', 'main.py', '--transport', transport,
+                               '--port', str(port)], cwd=ROOT, env=server_env(mock_url),
+                              stdout=output, stderr=output)
+    try:
+        await asyncio.to_thread(wait_ready, f"http://127.0.0.1:{port}/metrics")
+        path = '/sse' if transport == 'sse' else '/mcp'
+        async with Client(f"http://127.0.0.1:{port}{path}") as client:
+            return await measure(client, calls)
+    finally:
+        server.terminate()
+        server.wait(timeout=30)
+
+
+async def main_async(args):
+    mock_url = f"http://127.0.0.1:{args.port + 1}"
+    mock = subprocess.Popen([sys.executable, '-W', 'ignore', '-m', 'edjserver.EdjMockServer',
+                             '--port', str(args.port + 1), '--latency', str(args.latency)], cwd=ROOT,
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        await asyncio.to_thread(wait_ready, f"{mock_url}/__stats")
+        print(f"{'transport':<16} {'tool':<14} {'calls':>6} {'err':>5} {'mean(ms)':>9} "
+              f"{'p50(ms)':>9} {'p95(ms)':>9} {'p99(ms)':>9}")
+        for transport in args.transports.split(','):
+            if transport == 'memory':
+                results = await run_memory(mock_url, args.calls)
+            elif transport == 'stdio':
+                results = await run_stdio(mock_url, args.calls)
+            else:
+                results = await run_http(transport, mock_url, args.calls, args.port, args.verbose)
+            for tool, (latencies, errors) in results.items():
+                print(f"{transport:<16} {tool:<14} {len(latencies):>6} {errors:>5} "
+                      f"{sum(latencies) / len(latencies) * 1e3:>9.2f} {percentile(latencies, 0.5) * 1e3:>9.2f} "
+                      f"{percentile(latencies, 0.95) * 1e3:>9.2f} {percentile(latencies, 0.99) * 1e3:>9.2f}")
+    finally:
+        mock.terminate()
+        mock.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--transports', default='memory,stdio,sse,streamable-http', help='逗号分隔')
+    parser.add_argument('--calls', type=int, default=200, help='每个工具的调用次数')
+    parser.add_argument('--latency', type=float, default=0.0, help='模拟上游延迟(秒)，默认0以突出传输开销')
+    parser.add_argument('--port', type=int, default=18650, help='HTTP服务端口，模拟服务使用port+1')
+    parser.add_argument('--verbose', action='store_true', help='输出MCP服务的日志')
+    asyncio.run(main_async(parser.parse_args()))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,135 @@
+"""多worker部署吞吐测试
+
+启动独立进程的模拟e代驾服务，分别以1..N个worker运行MCP服务(共享SQLite状态)，
+由多个客户端进程通过SSE会话并发调用estimate_cost，输出各worker数下的吞吐量和延迟。
+客户端与服务端在同一台机器上运行时会争用CPU，需在核数足够的机器上观察扩展效果。
+
+用法(在项目根目录执行):
+    python -m benchmarks.bench_workers --workers 1,2,4 --clients 4 --sessions 8 --duration 10
+"""
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import signal
+import subprocess
+import sys
+import tempfile
+import time
+
+import httpx
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def percentile(samples, p):
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(len(samples) * p))] if samples else 0.0
+
+
+def wait_ready(url, timeout=30.0):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            if httpx.get(url, timeout=1.0).status_code == 200:
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.2)
+    raise RuntimeError(f"服务未就绪: {url}")
+
+
+def client_main(url, sessions, duration, client_index, queue):
+    """客户端进程: 建立多个SSE会话，在duration秒内循环调用estimate_cost"""
+    from fastmcp import Client
+
+    async def session(n):
+        latencies, errors = [], 0
+        phone = f"137{client_index:03d}{n:05d}"
+        async with Client(url) as client:
+            deadline = time.perf_counter() + duration
+            while time.perf_counter() < deadline:
+                start = time.perf_counter()
+                result = await client.call_tool('estimate_cost', {
+                    'start_address': '望京SOHO', 'start_longitude': 116.476169, 'start_latitude': 40.018682,
+                    'end_address': '天安门', 'end_longitude': 116.397477, 'end_latitude': 39.908692,
+                    'phone': phone}, raise_on_error=False)
+                latencies.append(time.perf_counter() - start)
+                if result.is_error or 'error' in json.loads(result.content[0].text):
+                    errors += 1
+        return latencies, errors
+
+    async def run():
+        return await asyncio.gather(*(session(n) for n in range(sessions)))
+
+    results = asyncio.run(run())
+    queue.put(([l for r in results for l in r[0]], sum(r[1] for r in results)))
+
+
+def run_level(args, workers, mock_url, port):
+    env = dict(os.environ, EDJ_WORKERS=str(workers), EDJ_PORT=str(port), API_BASE_URL=mock_url,
+               EDJ_STATE_DIR=tempfile.mkdtemp(prefix='edj_bench_state_'), EDJ_RATE_LIMIT='0',
+               EDJ_LOG_LEVEL='WARNING')
+    env['EDJ_AUDIT_LOG'] = os.path.join(env['EDJ_STATE_DIR'], 'audit')
+    if workers == 1:
+        # 单进程模式同样使用SQLite共享状态，结果可比
+        env.update(EDJ_TOKEN_STORE=f"sqlite:{env['EDJ_STATE_DIR']}/tokens.db",
+                   EDJ_ORDER_JOURNAL=f"sqlite:{env['EDJ_STATE_DIR']}/orders.db")
+    output = None if args.verbose else subprocess.DEVNULL
+    server = subprocess.Popen([sys.executable, '-W', 'ignore', 'edaijiamcp.py'], cwd=ROOT, env=env,
+                              stdout=output, stderr=output)
+    try:
+        wait_ready(f"http://127.0.0.1:{port}/metrics")
+        queue = multiprocessing.Queue()
+        clients = [multiprocessing.Process(target=client_main, args=(
+            f"http://127.0.0.1:{port}/sse", args.sessions, args.duration, i, queue))
+            for i in range(args.clients)]
+        start = time.perf_counter()
+        for client in clients:
+            client.start()
+        latencies, errors = [], 0
+        for _ in clients:
+            l, e = queue.get()
+            latencies.extend(l)
+            errors += e
+        elapsed = time.perf_counter() - start
+        for client in clients:
+            client.join()
+    finally:
+        server.send_signal(signal.SIGTERM)
+        server.wait(timeout=60)
+    return {'workers': workers, 'calls': len(latencies), 'errors': errors,
+            'throughput': len(latencies) / elapsed, 'p50': percentile(latencies, 0.5),
+            'p95': percentile(latencies, 0.95), 'p99': percentile(latencies, 0.99)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--workers', default='1,2,4', help='worker数，逗号分隔')
+    parser.add_argument('--clients', type=int, default=4, help='客户端进程数')
+    parser.add_argument('--sessions', type=int, default=8, help='每个客户端进程的SSE会话数')
+    parser.add_argument('--duration', type=float, default=10.0, help='每个级别的压测时长(秒)')
+    parser.add_argument('--latency', type=float, default=0.02, help='模拟上游延迟(秒)')
+    parser.add_argument('--port', type=int, default=18600, help='MCP服务端口，模拟服务使用port+1')
+    parser.add_argument('--verbose', action='store_true', help='输出MCP服务的日志')
+    args = parser.parse_args()
+
+    mock_url = f"http://127.0.0.1:{args.port + 1}"
+    mock = subprocess.Popen([sys.executable, '-W', 'ignore', '-m', 'edjserver.EdjMockServer',
+                             '--port', str(args.port + 1), '--latency', str(args.latency)], cwd=ROOT,
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        wait_ready(f"{mock_url}/__stats")
+        print(f"{'workers':>7} {'calls':>7} {'err':>5} {'req/s':>9} {'p50(ms)':>9} {'p95(ms)':>9} {'p99(ms)':>9}")
+        for workers in (int(w) for w in args.workers.split(',')):
+            r = run_level(args, workers, mock_url, args.port)
+            print(f"{r['workers']:>7} {r['calls']:>7} {r['errors']:>5} {r['throughput']:>9.1f} "
+                  f"{r['p50'] * 1e3:>9.1f} {r['p95'] * 1e3:>9.1f} {r['p99'] * 1e3:>9.1f}")
+    finally:
+        mock.terminate()
+        mock.wait()
+
+
+if __name__ == '__main__':
+    main()
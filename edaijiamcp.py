@@ -1,26 +1,204 @@
-from typing import Any, Dict, Optional
-import httpx
+from typing import Any, Dict, List, Optional
+import asyncio
 import hashlib
 import time
-import json
+import logging
 import os
 import uuid
-from fastmcp import FastMCP
+from fastmcp import Context, FastMCP
+from fastmcp.server.dependencies import get_http_headers
+from pydantic import AnyUrl
 from dotenv import load_dotenv
-from edjserver.EdjApi import EdjApi
+from starlette.requests import Request
+from starlette.responses import PlainTextResponse
+from edjserver.EdjApi import AsyncEdjApi
+from edjserver.EdjLog import configure_logging, log_event
+from edjserver.EdjMatrix import SOURCE_FAILED, EstimateMatrix
+from edjserver.EdjMetrics import metrics
+from edjserver.EdjModels import JsonToolResult
+from edjserver.EdjOrderJournal import create_order_journal
+from edjserver.EdjStatus import ACTIVE_STATUS, PENDING_STATUS, get_order_status_desc
+from edjserver.EdjTenant import Tenant, TenantRegistry
+from edjserver.EdjTokenStore import state_directory
 
 # 加载环境变量
 load_dotenv()
 
+# 结构化日志输出到stderr，级别和格式由EDJ_LOG_LEVEL、EDJ_LOG_FORMAT控制
+configure_logging()
+logger = logging.getLogger("edaijiamcp")
+
 # Initialize FastMCP server
 mcp = FastMCP("edaijiamcp")
 
-# 初始化EdjApi实例
-api = EdjApi()
+# 租户注册表: 每个合作方渠道的签名器、连接池(AsyncEdjApi)、token缓存、城市价格表索引和
+# 订单状态跟踪在启动时构建一次，工具按tenant参数或X-Edj-Tenant请求头选择
+tenants = TenantRegistry.from_env()
+
+# 默认租户的组件，未指定租户时使用
+api = tenants.get().api
+price_index = tenants.get().price_index
+order_tracker = tenants.get().order_tracker
+
+# 下单幂等日志(各租户共用，键带租户前缀)
+order_journal = create_order_journal()
+
+TENANT_HEADER = "x-edj-tenant"
+
+
+def _tenant(name: Optional[str] = None) -> Tenant:
+    """按工具参数或HTTP请求头选择租户，都未指定时使用默认租户"""
+    tenant = tenants.get(name or get_http_headers().get(TENANT_HEADER))
+    # 后台提前刷新token，首次使用时在当前事件循环中启动
+    tenant.token_refresher.start()
+    return tenant
+
+
+async def _progress(ctx: Optional[Context], progress: float, total: Optional[float], message: str,
+                    data: Any = None, logger_name: Optional[str] = None) -> None:
+    """向当前调用的客户端报告进度(客户端未请求进度时忽略)，data不为None时同时以日志通知发送，
+    客户端可以先展示已完成的部分；发送失败(如客户端已断开)不影响工具执行
+    """
+    if ctx is None:
+        return
+    try:
+        if data is not None:
+            await ctx.session.send_log_message(level="info", data=data, logger=logger_name,
+                                               related_request_id=ctx.request_id)
+        await ctx.report_progress(progress, total, message)
+    except Exception as e:
+        log_event(logger, logging.DEBUG, "progress_failed", message=message, error=str(e))
+
+
+async def _notify_order_update(order, old_status, new_status):
+    """订单状态变化时通知关注该订单的会话，发送失败的会话不再通知"""
+    snapshot = order.snapshot()
+    for session in list(order.watchers):
+        try:
+            await session.send_resource_updated(AnyUrl(f"order://{order.third_order_id}"))
+            await session.send_log_message(level="info", data=snapshot, logger="order_tracker")
+        except Exception:
+            order.watchers.remove(session)
+
+
+# 下单成功后短暂标记手机号有进行中的订单，订单跟踪每次查询到派单中/服务中时续期，订单结束、
+# 连续查询失败或服务退出时清除；进程异常退出时标记最多保留ORDER_HOLD_TTL。上游提示已有订单时短暂标记
+ORDER_HOLD_TTL = 300
+BUSY_HOLD_TTL = 60
+HOLD_MAX_POLL_ERRORS = 3
+
+
+async def _update_order_hold(api: AsyncEdjApi, phone: str, result: Dict[str, Any]) -> None:
+    if api.rate_limiter is None:
+        return
+    if result.get('code') == '0':
+        await api.rate_limiter.hold(phone, ORDER_HOLD_TTL)
+    elif result.get('code') in ('2', '20'):
+        await api.rate_limiter.hold(phone, BUSY_HOLD_TTL)
+
+
+async def _refresh_order_hold(order, ok):
+    """订单仍在派单中/服务中时续期占用标记；订单结束、进入其他状态(如501司机报单)、
+    连续查询失败或停止跟踪时清除，允许该手机号再次下单"""
+    if tenants.rate_limiter is None:
+        return
+    if ok and order.status in PENDING_STATUS + ACTIVE_STATUS:
+        await tenants.rate_limiter.hold(order.phone, ORDER_HOLD_TTL)
+    elif ok or order.evicted or order.errors >= HOLD_MAX_POLL_ERRORS:
+        await tenants.rate_limiter.release(order.phone)
+
+
+for _t in tenants:
+    _t.order_tracker.add_listener(_notify_order_update)
+    _t.order_tracker.add_poll_listener(_refresh_order_hold)
+
+# 各组件的统计在导出指标时读取，按租户独立的组件汇总导出
+metrics.add_stats("edj_tenants", lambda: {"configured": len(tenants)})
+metrics.add_stats("edj_token_cache", lambda: tenants.sum_stats(lambda t: t.api.token_cache.stats()),
+                  counters=("hits", "misses", "refreshes", "coalesced_refreshes", "observed_expiries"))
+metrics.add_stats("edj_token_refresher",
+                  lambda: tenants.sum_stats(lambda t: t.token_refresher.stats()),
+                  counters=("scans", "refreshed", "failed"))
+metrics.add_stats("edj_estimate_cache",
+                  lambda: tenants.sum_stats(lambda t: t.api.estimate_cache.stats() if t.api.estimate_cache else {},
+                                            component=lambda t: t.api.estimate_cache),
+                  counters=("hits", "misses"))
+metrics.add_stats("edj_circuit_breakers", lambda: tenants.sum_stats(lambda t: {
+    "open": sum(1 for b in t.api.resilience.stats()["breakers"].values() if b["state"] != "closed")
+}))
+metrics.add_stats("edj_price_index", lambda: tenants.sum_stats(lambda t: t.price_index.stats()),
+                  counters=("loads", "hits"))
+metrics.add_stats("edj_order_tracker", lambda: tenants.sum_stats(lambda t: t.order_tracker.stats()),
+                  counters=("polls", "transitions", "evicted"))
+metrics.add_stats("edj_order_journal", lambda: order_journal.stats(), counters=("replays",))
+metrics.add_stats("edj_service_area",
+                  lambda: tenants.service_area.stats() if tenants.service_area else {},
+                  counters=("checks", "rejected"))
+metrics.add_stats("edj_audit_log",
+                  lambda: tenants.audit_log.stats() if tenants.audit_log else {},
+                  counters=("written", "dropped", "backpressured"))
+metrics.add_stats("edj_rate_limiter",
+                  lambda: tenants.rate_limiter.stats() if tenants.rate_limiter else {},
+                  counters=("admitted", "queued", "rejected"))
+
+
+@mcp.custom_route("/metrics", methods=["GET"])
+async def metrics_endpoint(request: Request) -> PlainTextResponse:
+    """Prometheus指标，与SSE服务共用端口"""
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+class TokenError(Exception):
+    """获取或刷新token失败"""
+
+
+async def _ensure_token(api: AsyncEdjApi, phone: str) -> str:
+    """获取手机号对应的token，本地没有时向上游获取"""
+    token = api.get_token_by_phone(phone)
+    if not token:
+        log_event(logger, logging.INFO, "token_missing", phone=phone)
+        token_response = await api.refresh_authen_token(phone)
+        if token_response['code'] != '0':
+            raise TokenError(f"获取token失败: {token_response['message']}")
+        token = api.get_token_by_phone(phone)
+    return token
+
+
+async def _estimate(api: AsyncEdjApi, phone: str, token: str, start_longitude: float,
+                    start_latitude: float, end_longitude: float, end_latitude: float) -> Dict[str, Any]:
+    """调用预估费用接口，token过期时刷新后重试一次；按手机号计入用户级限额(token刷新后不变)"""
+    result = await api.get_cost_estimate_v2(
+        token=token,
+        start_latitude=start_latitude,
+        start_longitude=start_longitude,
+        end_latitude=end_latitude,
+        end_longitude=end_longitude,
+        subject=phone
+    )
+
+    # 如果token过期，重新获取token并重试
+    if result['code'] == '10':  # token过期
+        log_event(logger, logging.INFO, "token_expired", phone=phone, endpoint="/order/costestimateV2")
+        token_response = await api.refresh_authen_token(phone, stale_token=token)
+        if token_response['code'] != '0':
+            raise TokenError(f"刷新token失败: {token_response['message']}")
+        token = api.get_token_by_phone(phone)
+
+        # 重新调用预估费用接口
+        result = await api.get_cost_estimate_v2(
+            token=token,
+            start_latitude=start_latitude,
+            start_longitude=start_longitude,
+            end_latitude=end_latitude,
+            end_longitude=end_longitude,
+            subject=phone
+        )
+    return result
+
 
 @mcp.tool()
-def estimate_cost(start_address: str, start_longitude: float, start_latitude: float,
-                 end_address: str, end_longitude: float, end_latitude: float, phone: str) -> Dict[str, Any]:
+async def estimate_cost(start_address: str, start_longitude: float, start_latitude: float,
+                 end_address: str, end_longitude: float, end_latitude: float, phone: str,
+                 tenant: Optional[str] = None) -> Dict[str, Any]:
     """预估代驾费用
     
     Args:
@@ -31,6 +209,7 @@ def estimate_cost(start_address: str, start_longitude: float, start_latitude: fl
         end_longitude: 目的地经度
         end_latitude: 目的地纬度
         phone: 用户手机号(11位)
+        tenant: 合作方渠道(可选)，不传则使用默认渠道
     
     Returns:
         预估费用信息
@@ -40,56 +219,283 @@ def estimate_cost(start_address: str, start_longitude: float, start_latitude: fl
         if not phone or len(phone) != 11:
             return {"error": "手机号必须是11位数字"}
         
-        # 获取或刷新token
-        token = api.get_token_by_phone(phone)
-        if not token:
-            print(f"本地未找到手机号 {phone} 的token，正在获取新token...")
-            token_response = api.get_authen_token(phone)
-            if token_response['code'] != '0':
-                return {"error": f"获取token失败: {token_response['message']}"}
-            token = api.get_token_by_phone(phone)
+        # 坐标不合法或起点在已知未开通区域时在本地返回，不获取token也不请求上游
+        api = _tenant(tenant).api
+        result = api.precheck_route(start_latitude, start_longitude, end_latitude, end_longitude)
+        if result is None:
+            # 获取token并调用预估费用接口
+            token = await _ensure_token(api, phone)
+            result = await _estimate(api, phone, token, start_longitude, start_latitude,
+                                     end_longitude, end_latitude)
         
-        # 调用预估费用接口
-        result = api.get_cost_estimate_v2(
-            token=token,
-            start_latitude=start_latitude,
-            start_longitude=start_longitude,
-            end_latitude=end_latitude,
-            end_longitude=end_longitude
-        )
-        
-        # 如果token过期，重新获取token并重试
-        if result['code'] == '10':  # token过期
-            print(f"Token已过期，正在刷新token...")
-            token_response = api.get_authen_token(phone)
-            if token_response['code'] != '0':
-                return {"error": f"刷新token失败: {token_response['message']}"}
-            token = api.get_token_by_phone(phone)
-            
-            # 重新调用预估费用接口
-            result = api.get_cost_estimate_v2(
-                token=token,
-                start_latitude=start_latitude,
-                start_longitude=start_longitude,
-                end_latitude=end_latitude,
-                end_longitude=end_longitude
-            )
-        
-        return {
+        return JsonToolResult({
             "start_address": start_address,
             "end_address": end_address,
             "phone": phone,
             "estimate_result": result
-        }
+        })
         
+    except TokenError as e:
+        return {"error": str(e)}
     except Exception as e:
         return {"error": f"预估费用失败: {str(e)}"}
 
+# 批量预估的上限
+MAX_BATCH_ROUTES = 200
+MAX_BATCH_CONCURRENCY = 50
+
+ROUTE_FIELDS = ('start_longitude', 'start_latitude', 'end_longitude', 'end_latitude', 'phone')
+
+@mcp.tool()
+async def estimate_cost_batch(routes: List[Dict[str, Any]], max_concurrency: int = 10,
+                              timeout: float = 15.0, tenant: Optional[str] = None,
+                              ctx: Context = None) -> Dict[str, Any]:
+    """批量预估代驾费用，多条路线并发查询，每条路线完成时通过日志通知发送该项结果并报告进度
+
+    Args:
+        routes: 路线列表，每项包含 start_longitude、start_latitude、end_longitude、
+            end_latitude、phone，可选 start_address、end_address
+        max_concurrency: 同时进行的上游请求数(1-50)
+        timeout: 整批的截止时间(秒)，超时未完成的路线返回超时错误
+        tenant: 合作方渠道(可选)，不传则使用默认渠道
+
+    Returns:
+        按输入顺序排列的结果列表，每项为预估结果或该项的错误信息
+    """
+    if not routes:
+        return {"error": "routes不能为空"}
+    if len(routes) > MAX_BATCH_ROUTES:
+        return {"error": f"单次最多预估{MAX_BATCH_ROUTES}条路线"}
+    try:
+        api = _tenant(tenant).api
+    except ValueError as e:
+        return {"error": str(e)}
+
+    semaphore = asyncio.Semaphore(max(1, min(max_concurrency, MAX_BATCH_CONCURRENCY)))
+    # 同一手机号的token只获取一次
+    token_tasks = {}
+
+    async def run_route(route):
+        phone = str(route['phone'])
+        if phone not in token_tasks:
+            token_tasks[phone] = asyncio.ensure_future(_ensure_token(api, phone))
+        token = await asyncio.shield(token_tasks[phone])
+        async with semaphore:
+            return await _estimate(api, phone, token, route['start_longitude'],
+                                   route['start_latitude'], route['end_longitude'], route['end_latitude'])
+
+    def estimate_item(index, route, result):
+        return {
+            "index": index,
+            "start_address": route.get('start_address'),
+            "end_address": route.get('end_address'),
+            "phone": str(route['phone']),
+            "estimate_result": result
+        }
+
+    results = [None] * len(routes)
+    accepted = []
+    for index, route in enumerate(routes):
+        missing = [f for f in ROUTE_FIELDS if route.get(f) in (None, '')]
+        if missing:
+            results[index] = {"index": index, "error": f"缺少参数: {', '.join(missing)}"}
+        elif len(str(route['phone'])) != 11:
+            results[index] = {"index": index, "error": "手机号必须是11位数字"}
+        else:
+            accepted.append(index)
+
+    # 所有路线一次完成本地预校验，不通过的直接返回，不请求上游
+    tasks = {}
+    prechecked = api.precheck_routes([(routes[i]['start_latitude'], routes[i]['start_longitude'],
+                                       routes[i]['end_latitude'], routes[i]['end_longitude'])
+                                      for i in accepted])
+    for index, rejected in zip(accepted, prechecked):
+        if rejected is not None:
+            results[index] = estimate_item(index, routes[index], rejected)
+        else:
+            tasks[asyncio.ensure_future(run_route(routes[index]))] = index
+
+    def route_result(index, task):
+        error = task.exception()
+        if error is not None:
+            message = str(error) if isinstance(error, TokenError) else f"预估费用失败: {error}"
+            return {"index": index, "error": message}
+        return estimate_item(index, routes[index], task.result())
+
+    if tasks:
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        finished = len(routes) - len(tasks)
+        pending = set(tasks)
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, timeout=max(0.0, deadline - loop.time()),
+                                                   return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    break
+                for task in done:
+                    index = tasks[task]
+                    results[index] = route_result(index, task)
+                    finished += 1
+                    await _progress(ctx, finished, len(routes), f"已完成{finished}/{len(routes)}条路线",
+                                    results[index], "estimate_cost_batch")
+        finally:
+            # 超时或调用被取消时中止未完成的上游请求
+            for task in list(tasks) + list(token_tasks.values()):
+                task.cancel()
+        for task in pending:
+            results[tasks[task]] = {"index": tasks[task], "error": "预估超时"}
+
+    failed = sum(1 for r in results if 'error' in r or r['estimate_result'].get('code') != '0')
+    return JsonToolResult({
+        "total": len(routes),
+        "succeeded": len(routes) - failed,
+        "failed": failed,
+        "results": results
+    })
+
+# 预估矩阵的上限
+MAX_MATRIX_CELLS = 400
+MATRIX_ENDPOINT = '/order/costestimateV2'
+
+
+def _matrix_points(points: List[Dict[str, Any]], name: str):
+    """把[{longitude, latitude}]转换为[(latitude, longitude)]，缺少坐标时抛出ValueError"""
+    result = []
+    for index, point in enumerate(points):
+        if point.get('longitude') in (None, '') or point.get('latitude') in (None, ''):
+            raise ValueError(f"{name}[{index}]缺少longitude或latitude")
+        result.append((point['latitude'], point['longitude']))
+    return result
+
+
+@mcp.tool()
+async def estimate_matrix(origins: List[Dict[str, Any]], destinations: List[Dict[str, Any]], phone: str,
+                          symmetric: bool = False, max_rate: Optional[float] = None,
+                          max_concurrency: int = 10, timeout: float = 20.0,
+                          city_name: Optional[str] = None, tenant: Optional[str] = None,
+                          ctx: Context = None) -> Dict[str, Any]:
+    """预估M个起点到N个终点的费用矩阵，用于调度规划
+
+    Args:
+        origins: 起点列表，每项包含 longitude、latitude
+        destinations: 终点列表，每项包含 longitude、latitude
+        phone: 用户手机号(11位)
+        symmetric: 是否认为A->B与B->A费用相同(共用一次请求)
+        max_rate: 每秒最多发出的预估请求数(可选)，默认按该用户的预估限额
+        max_concurrency: 同时进行的上游请求数(1-50)
+        timeout: 截止时间(秒)，未完成的单元格用缓存的城市价格表本地估算
+        city_name: 城市名(可选)，传入时同时加载该城市价格表用于本地估算，
+            不传则按已拉取过价格表的城市区域匹配
+        tenant: 合作方渠道(可选)，不传则使用默认渠道
+
+    Returns:
+        shape为[M, N]，fees为行优先的一维费用列表(第i行第j列为fees[i * N + j])，
+        sources中u为上游结果、a为本地估算、x为失败，errors为失败单元格的[行, 列, 返回码, 信息]。
+        每行完成时通过日志通知发送该行费用，并报告已完成行数
+    """
+    if not phone or len(phone) != 11:
+        return {"error": "手机号必须是11位数字"}
+    if not origins or not destinations:
+        return {"error": "origins和destinations不能为空"}
+    if len(origins) * len(destinations) > MAX_MATRIX_CELLS:
+        return {"error": f"单次最多预估{MAX_MATRIX_CELLS}个单元格"}
+    try:
+        starts = _matrix_points(origins, 'origins')
+        matrix = EstimateMatrix(starts, _matrix_points(destinations, 'destinations'), symmetric)
+        selected = _tenant(tenant)
+    except (TypeError, ValueError) as e:
+        return {"error": str(e)}
+    api = selected.api
+    price_index = selected.price_index
+
+    # 各请求完成的回调并发执行，按顺序发送以保证进度值递增
+    report_lock = asyncio.Lock()
+    reported = 0
+
+    async def on_rows(rows):
+        """行完成时把该行费用发给客户端"""
+        nonlocal reported
+        async with report_lock:
+            for row in rows:
+                reported += 1
+                await _progress(ctx, reported, matrix.shape[0], f"已完成{reported}/{matrix.shape[0]}行",
+                                {"row": row, "fees": matrix.row(row)}, "estimate_matrix")
+
+    # 坐标不合法、起终点重合或起点在已知未开通区域的单元格不请求上游
+    pending = matrix.pending()
+    rows = []
+    for key, rejected in zip(pending, api.precheck_routes([(*start, *end) for start, end in pending])):
+        if rejected is not None:
+            rows += matrix.fill(key, None, SOURCE_FAILED, {"code": rejected['code'], "message": rejected['message']})
+    if rows:
+        await on_rows(rows)
+
+    # 速率预算: 不超过该用户的预估限额，避免请求在限流器中排队或被拒绝
+    rate, burst = None, max_concurrency
+    if api.rate_limiter is not None and MATRIX_ENDPOINT in api.rate_limiter.subject_limits:
+        rate, burst = api.rate_limiter.subject_limits[MATRIX_ENDPOINT]
+    if max_rate:
+        rate = min(rate, max_rate) if rate else max_rate
+
+    def approximate(start_latitude, start_longitude, end_latitude, end_longitude):
+        name = city_name or (api.service_area.city_at(start_latitude, start_longitude)
+                             if api.service_area is not None else None)
+        table = price_index.cached(name) if name else None
+        result = table.estimate(start_latitude, start_longitude, end_latitude, end_longitude) if table else None
+        return result['fee'] if result else None
+
+    # 与上游请求并行加载价格表，截止时可用于本地估算
+    preload = None
+    if city_name and price_index.cached(city_name) is None:
+        preload = asyncio.ensure_future(price_index.get(city_name, starts[0][1], starts[0][0]))
+    try:
+        if matrix.pending():
+            token = await _ensure_token(api, phone)
+            await matrix.run(
+                # token过期后由_estimate刷新，后续请求直接使用缓存中的新token
+                lambda start_lat, start_lon, end_lat, end_lon: _estimate(
+                    api, phone, api.get_token_by_phone(phone) or token, start_lon, start_lat, end_lon, end_lat),
+                rate=rate, burst=burst, max_concurrency=max(1, min(max_concurrency, MAX_BATCH_CONCURRENCY)),
+                timeout=timeout, approximate=approximate, on_rows=on_rows)
+    except TokenError as e:
+        return {"error": str(e)}
+    finally:
+        if preload is not None and not preload.done():
+            preload.cancel()
+
+    return JsonToolResult(dict(matrix.to_dict(), phone=phone))
+
+# call_driver在本次调用内跟踪订单状态的最长时间(秒)
+MAX_ORDER_WAIT = 300
+
+
+async def _wait_order(selected: Tenant, third_order_id: str, wait_seconds: float,
+                      ctx: Optional[Context]) -> Optional[Dict[str, Any]]:
+    """跟踪订单状态直到离开派单阶段或超时，每次状态变化报告进度
+    Returns:
+        订单状态快照，订单未跟踪时返回None
+    """
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + wait_seconds
+    order = selected.order_tracker.get(third_order_id)
+    step = 2
+    while order is not None and order.status in PENDING_STATUS:
+        status = await selected.order_tracker.wait_change(third_order_id, deadline - loop.time())
+        if status is None:
+            break
+        step += 1
+        await _progress(ctx, step, None, get_order_status_desc(status), order.snapshot(), "call_driver")
+    return order.snapshot() if order is not None else None
+
+
 @mcp.tool()
-def call_driver(start_address: str, start_longitude: float, start_latitude: float,
+async def call_driver(start_address: str, start_longitude: float, start_latitude: float,
                end_address: str, end_longitude: float, end_latitude: float, phone: str,
-               contact_phone: Optional[str] = None) -> Dict[str, Any]:
-    """叫代驾下单
+               contact_phone: Optional[str] = None, idempotency_key: Optional[str] = None,
+               wait_seconds: float = 0, tenant: Optional[str] = None,
+               ctx: Context = None) -> Dict[str, Any]:
+    """叫代驾下单，获取token、下单完成和订单状态变化时报告进度
     
     Args:
         start_address: 起始地址
@@ -100,51 +506,63 @@ def call_driver(start_address: str, start_longitude: float, start_latitude: floa
         end_latitude: 目的地纬度
         phone: 用户手机号(11位)
         contact_phone: 联系电话(代叫订单必传)
+        idempotency_key: 幂等键(可选)，同一手机号使用相同幂等键重复调用时只下单一次，
+            后续调用直接返回首次下单结果
+        wait_seconds: 下单成功后在本次调用内跟踪订单状态的秒数(可选，最多300)，期间每次状态变化
+            报告进度，司机接单或订单结束时提前返回；取消调用只停止等待，不影响订单
+        tenant: 合作方渠道(可选)，不传则使用默认渠道
     
     Returns:
-        下单结果信息
+        下单结果信息，等待了订单状态时包含order_status
     """
     try:
         # 验证手机号格式
         if not phone or len(phone) != 11:
             return {"error": "手机号必须是11位数字"}
         
+        selected = _tenant(tenant)
+        api = selected.api
+        # 坐标不合法、起点在已知未开通区域或附近刚返回过无空闲司机时在本地拒绝，
+        # 不获取token、不写幂等日志也不请求上游
+        rejected = api.precheck_route(start_latitude, start_longitude, end_latitude, end_longitude, order=True)
+        if rejected is not None:
+            return JsonToolResult({
+                "start_address": start_address,
+                "end_address": end_address,
+                "phone": phone,
+                "third_order_id": None,
+                "contact_phone": contact_phone,
+                "order_result": rejected,
+                "status_resource": None,
+                "replayed": False,
+                "order_status": None
+            })
+
         # 获取或刷新token
-        token = api.get_token_by_phone(phone)
-        if not token:
-            print(f"本地未找到手机号 {phone} 的token，正在获取新token...")
-            token_response = api.get_authen_token(phone)
-            if token_response['code'] != '0':
-                return {"error": f"获取token失败: {token_response['message']}"}
-            token = api.get_token_by_phone(phone)
-        
-        # 生成唯一订单号
-        third_order_id = f"MCP_ORDER_{int(time.time())}_{str(uuid.uuid4())[:8]}"
-        
-        # 调用下单接口
-        result = api.commit_order(
-            phone=phone,
-            token=token,
-            start_address=start_address,
-            start_longitude=start_longitude,
-            start_latitude=start_latitude,
-            end_address=end_address,
-            end_longitude=end_longitude,
-            end_latitude=end_latitude,
-            third_order_id=third_order_id,
-            contact_phone=contact_phone
-        )
+        token = await _ensure_token(api, phone)
+        total_steps = None if wait_seconds > 0 else 2
+        await _progress(ctx, 1, total_steps, "已获取token")
         
-        # 如果token过期，重新获取token并重试
-        if result['code'] == '1' and 'token' in result.get('message', '').lower():
-            print(f"Token校验失败，正在刷新token...")
-            token_response = api.get_authen_token(phone)
-            if token_response['code'] != '0':
-                return {"error": f"刷新token失败: {token_response['message']}"}
-            token = api.get_token_by_phone(phone)
-            
-            # 重新调用下单接口
-            result = api.commit_order(
+        # 生成订单号；带幂等键时订单号由键和尝试序号确定，重放时保持不变，
+        # 上次下单失败后重新下单时使用新的订单号(上游可能拒绝重复的订单号)
+        journal_key = selected.scoped(f"{phone}:{idempotency_key}")
+        attempt = 1
+        if idempotency_key:
+            digest = hashlib.sha256(journal_key.encode()).hexdigest()[:16]
+            attempt = await order_journal.next_attempt(journal_key)
+            third_order_id = f"MCP_ORDER_{digest}" if attempt == 1 else f"MCP_ORDER_{digest}_{attempt}"
+        else:
+            third_order_id = f"MCP_ORDER_{int(time.time())}_{str(uuid.uuid4())[:8]}"
+
+        async def submit():
+            nonlocal token
+            # 已有进行中订单的手机号在本地直接拒绝，避免上游返回20/2并计入滥用
+            if api.rate_limiter is not None and await api.rate_limiter.held(phone):
+                return third_order_id, {'code': '20', 'data': None,
+                                        'message': '该手机号已有进行中的订单，请等待订单结束后再下单'}
+
+            # 调用下单接口
+            result = await api.commit_order(
                 phone=phone,
                 token=token,
                 start_address=start_address,
@@ -154,27 +572,119 @@ def call_driver(start_address: str, start_longitude: float, start_latitude: floa
                 end_longitude=end_longitude,
                 end_latitude=end_latitude,
                 third_order_id=third_order_id,
-                contact_phone=contact_phone
+                contact_phone=contact_phone,
+                idempotent=bool(idempotency_key)
             )
-        
-        return {
+            
+            # 如果token过期，重新获取token并重试
+            if result['code'] == '1' and 'token' in result.get('message', '').lower():
+                log_event(logger, logging.INFO, "token_expired", phone=phone, endpoint="/order/commit")
+                token_response = await api.refresh_authen_token(phone, stale_token=token)
+                if token_response['code'] != '0':
+                    # 订单未创建，作为上游拒绝处理
+                    return third_order_id, {'code': '10', 'data': None, 'token_error': True,
+                                            'message': f"刷新token失败: {token_response['message']}"}
+                token = api.get_token_by_phone(phone)
+                
+                # 重新调用下单接口
+                result = await api.commit_order(
+                    phone=phone,
+                    token=token,
+                    start_address=start_address,
+                    start_longitude=start_longitude,
+                    start_latitude=start_latitude,
+                    end_address=end_address,
+                    end_longitude=end_longitude,
+                    end_latitude=end_latitude,
+                    third_order_id=third_order_id,
+                    contact_phone=contact_phone,
+                    idempotent=bool(idempotency_key)
+                )
+            await _update_order_hold(api, phone, result)
+            # 下单成功后开始跟踪订单状态，状态变化时通知当前会话
+            if result['code'] == '0':
+                selected.order_tracker.register(third_order_id, phone, watcher=ctx.session if ctx else None)
+            return third_order_id, result
+
+        replayed = False
+        if idempotency_key:
+            # 同一幂等键只会向上游提交一次，重复调用返回记录的结果
+            record, replayed = await order_journal.run(journal_key, submit, third_order_id, attempt)
+            if record['state'] in ('inflight', 'unknown'):
+                return {
+                    "error": "该幂等键的下单结果未知，请通过get_order_status或e代驾客服确认订单",
+                    "third_order_id": record.get('third_order_id'),
+                    "idempotency_key": idempotency_key
+                }
+            result = record['result']
+            third_order_id = record.get('third_order_id') or third_order_id
+        else:
+            # 下单请求发出后不随调用取消而中止(幂等日志同样如此)，避免订单已创建却未登记跟踪
+            _, result = await asyncio.shield(asyncio.ensure_future(submit()))
+
+        if result.get('token_error'):
+            return {"error": result['message']}
+        await _progress(ctx, 2, total_steps, "下单成功" if result['code'] == '0' else "下单失败",
+                        {"third_order_id": third_order_id, "order_result": result}, "call_driver")
+
+        order_status = None
+        if result['code'] == '0' and wait_seconds > 0:
+            order_status = await _wait_order(selected, third_order_id, min(wait_seconds, MAX_ORDER_WAIT), ctx)
+
+        return JsonToolResult({
             "start_address": start_address,
             "end_address": end_address,
             "phone": phone,
             "third_order_id": third_order_id,
             "contact_phone": contact_phone,
-            "order_result": result
-        }
+            "order_result": result,
+            "status_resource": f"order://{third_order_id}",
+            "replayed": replayed,
+            "order_status": order_status
+        })
         
+    except TokenError as e:
+        return {"error": str(e)}
     except Exception as e:
         return {"error": f"下单失败: {str(e)}"}
 
 @mcp.tool()
-def refresh_token(phone: str) -> Dict[str, Any]:
+async def get_order_status(third_order_id: str, tenant: Optional[str] = None) -> Dict[str, Any]:
+    """查询已跟踪订单的最新状态
+
+    Args:
+        third_order_id: 下单时返回的第三方订单号
+        tenant: 合作方渠道(可选)，不传则使用默认渠道
+
+    Returns:
+        订单当前状态及状态变化记录
+    """
+    try:
+        trackers = [_tenant(tenant).order_tracker]
+    except ValueError as e:
+        return {"error": str(e)}
+    return _order_snapshot(third_order_id, trackers)
+
+@mcp.resource("order://{third_order_id}", mime_type="application/json")
+async def order_status_resource(third_order_id: str) -> Dict[str, Any]:
+    """订单状态资源，状态变化时向下单会话发送resources/updated通知"""
+    return _order_snapshot(third_order_id, [t.order_tracker for t in tenants])
+
+
+def _order_snapshot(third_order_id: str, trackers) -> Dict[str, Any]:
+    for tracker in trackers:
+        order = tracker.get(third_order_id)
+        if order is not None:
+            return order.snapshot()
+    return {"error": f"订单 {third_order_id} 未在跟踪中"}
+
+@mcp.tool()
+async def refresh_token(phone: str, tenant: Optional[str] = None) -> Dict[str, Any]:
     """刷新用户token
     
     Args:
         phone: 用户手机号(11位)
+        tenant: 合作方渠道(可选)，不传则使用默认渠道
     
     Returns:
         token刷新结果
@@ -184,17 +694,18 @@ def refresh_token(phone: str) -> Dict[str, Any]:
         if not phone or len(phone) != 11:
             return {"error": "手机号必须是11位数字"}
         
-        # 获取新token
-        result = api.get_authen_token(phone)
+        # 获取新token(与并发中的刷新合并)
+        api = _tenant(tenant).api
+        result = await api.refresh_authen_token(phone)
         
         if result['code'] == '0':
             token = api.get_token_by_phone(phone)
-            return {
+            return JsonToolResult({
                 "phone": phone,
                 "status": "success",
                 "message": "Token刷新成功",
                 "token_length": len(token) if token else 0
-            }
+            })
         else:
             return {
                 "phone": phone,
@@ -205,6 +716,170 @@ def refresh_token(phone: str) -> Dict[str, Any]:
     except Exception as e:
         return {"error": f"刷新token失败: {str(e)}"}
 
+@mcp.tool()
+async def get_city_prices(city_name: str, longitude: float, latitude: float,
+                          refresh: bool = False, tenant: Optional[str] = None) -> Dict[str, Any]:
+    """获取城市代驾价格表
+
+    Args:
+        city_name: 城市名，例如: 北京
+        longitude: 所在位置经度
+        latitude: 所在位置纬度
+        refresh: 是否忽略本地缓存重新获取
+        tenant: 合作方渠道(可选)，不传则使用默认渠道
+
+    Returns:
+        城市价格表信息
+    """
+    try:
+        price_index = _tenant(tenant).price_index
+        price_index.start_refresh()
+        table, result = await price_index.get(city_name, longitude, latitude, force=refresh)
+        if table is None:
+            return {"error": f"获取价格表失败: {result.get('message')}", "price_result": result}
+        return JsonToolResult({
+            "city_name": city_name,
+            "fetched_at": table.fetched_at,
+            "rules": [rule.to_dict() for rule in table.rules],
+            "price_result": result
+        })
+
+    except Exception as e:
+        return {"error": f"获取价格表失败: {str(e)}"}
+
+@mcp.tool()
+async def preview_fare(city_name: str, start_longitude: float, start_latitude: float,
+                       end_longitude: float, end_latitude: float,
+                       estimate_distance: Optional[int] = None,
+                       tenant: Optional[str] = None) -> Dict[str, Any]:
+    """根据缓存的城市价格表本地估算费用(用于界面预览，结果为粗略值)
+
+    Args:
+        city_name: 城市名
+        start_longitude: 起始经度
+        start_latitude: 起始纬度
+        end_longitude: 目的地经度
+        end_latitude: 目的地纬度
+        estimate_distance: 预估行驶距离(米)，不传则按直线距离估算
+        tenant: 合作方渠道(可选)，不传则使用默认渠道
+
+    Returns:
+        本地估算的费用，以下单前estimate_cost的结果为准
+    """
+    try:
+        price_index = _tenant(tenant).price_index
+        price_index.start_refresh()
+        table = price_index.cached(city_name)
+        if table is None:
+            # 价格表未缓存时加载一次，之后的预览不再请求上游
+            table, result = await price_index.get(city_name, start_longitude, start_latitude)
+            if table is None:
+                return {"error": f"获取价格表失败: {result.get('message')}"}
+        preview = table.estimate(start_latitude, start_longitude, end_latitude, end_longitude,
+                                 estimate_distance=estimate_distance)
+        if preview is None:
+            return {"error": "价格表中没有可用的计价规则"}
+        return JsonToolResult(preview)
+
+    except Exception as e:
+        return {"error": f"本地估算失败: {str(e)}"}
+
+# 支持的传输方式
+TRANSPORTS = ("stdio", "sse", "streamable-http")
+
+
+def create_app():
+    """创建HTTP应用，传输方式由EDJ_TRANSPORT指定，多worker模式下在每个worker进程中调用
+
+    streamable HTTP的会话只存在于单个worker中，且响应以流的形式返回，无法像SSE消息那样
+    在worker间转发；多worker时以无状态模式运行，每个请求可由任意worker处理，
+    此时不会向客户端推送订单状态变化通知，需通过get_order_status查询。
+    """
+    if os.getenv("EDJ_TRANSPORT", "sse") == "streamable-http":
+        stateless = int(os.getenv("EDJ_WORKERS", "1")) > 1
+        return mcp.http_app(transport="streamable-http", stateless_http=stateless or None)
+    return mcp.http_app(transport="sse")
+
+
+async def shutdown() -> None:
+    """worker退出前释放资源: 停止订单跟踪，关闭各租户的上游连接池，落盘token存储、幂等日志和审计日志"""
+    if tenants.rate_limiter is not None:
+        # 停止跟踪后无法续期，清除跟踪中订单的占用标记
+        for tenant in tenants:
+            for order in tenant.order_tracker.active_orders():
+                await tenants.rate_limiter.release(order.phone)
+    await tenants.aclose()
+    tenants.token_store.close()
+    order_journal.close()
+    if tenants.audit_log is not None:
+        tenants.audit_log.close()
+    if tenants.rate_limiter is not None:
+        tenants.rate_limiter.close()
+
+
+def configure_shared_state(workers: int) -> None:
+    """多worker模式下，把token存储、幂等日志和限流计数默认放到共享的SQLite中
+
+    数据目录由EDJ_STATE_DIR指定(默认为用户数据目录下的edaijiamcp，见state_directory)。
+    已显式配置为单进程后端时报错。
+    """
+    if workers <= 1:
+        return
+    state_dir = state_directory()
+    defaults = {
+        "EDJ_TOKEN_STORE": f"sqlite:{os.path.join(state_dir, 'tokens.db')}",
+        "EDJ_ORDER_JOURNAL": f"sqlite:{os.path.join(state_dir, 'orders.db')}",
+        "EDJ_RATE_LIMIT_STORE": f"sqlite:{os.path.join(state_dir, 'ratelimit.db')}",
+    }
+    for name, value in defaults.items():
+        # .env中留空的配置项同样视为未设置
+        if not os.getenv(name):
+            os.environ[name] = value
+    if os.environ["EDJ_TOKEN_STORE"] == "kv":
+        raise ValueError("多worker模式不能使用进程内的kv token存储")
+    if not os.environ["EDJ_ORDER_JOURNAL"].startswith("sqlite:"):
+        raise ValueError("多worker模式的幂等日志需要共享存储，请设置 EDJ_ORDER_JOURNAL=sqlite:路径")
+    rate_limited = os.getenv("EDJ_RATE_LIMIT", "1") not in ("0", "false", "False")
+    if rate_limited and not os.environ["EDJ_RATE_LIMIT_STORE"].startswith("sqlite:"):
+        raise ValueError("多worker模式的限流计数需要共享存储，请设置 EDJ_RATE_LIMIT_STORE=sqlite:路径")
+
+
+def run(transport: Optional[str] = None, host: Optional[str] = None, port: Optional[int] = None,
+        workers: Optional[int] = None) -> None:
+    """启动服务，未传的参数读取环境变量
+
+    Args:
+        transport: 传输方式 stdio/sse/streamable-http，默认EDJ_TRANSPORT，未设置为sse
+        host: 监听地址，默认EDJ_HOST，未设置为127.0.0.1
+        port: 监听端口，默认EDJ_PORT，未设置为8000
+        workers: worker进程数，默认EDJ_WORKERS，未设置为1
+    """
+    transport = transport or os.getenv("EDJ_TRANSPORT") or "sse"
+    host = host or os.getenv("EDJ_HOST") or "127.0.0.1"
+    port = port or int(os.getenv("EDJ_PORT") or "8000")
+    workers = workers or int(os.getenv("EDJ_WORKERS") or "1")
+    if transport not in TRANSPORTS:
+        raise ValueError(f"不支持的传输方式: {transport}，可选 {', '.join(TRANSPORTS)}")
+
+    if transport == "stdio":
+        if workers > 1:
+            raise ValueError("stdio传输只能以单进程运行")
+        # stdout用于协议消息，日志输出到stderr；按需启动的子进程不输出启动横幅，缩短冷启动时间
+        mcp.run(transport="stdio", show_banner=False)
+    elif workers > 1:
+        from edjserver.EdjWorkers import run_workers
+        # 环境变量由worker进程继承，worker中重新导入本模块时按共享存储和传输方式初始化
+        os.environ["EDJ_TRANSPORT"] = transport
+        os.environ["EDJ_WORKERS"] = str(workers)
+        configure_shared_state(workers)
+        run_workers("edaijiamcp:create_app", host=host, port=port, workers=workers,
+                    drain_timeout=float(os.getenv("EDJ_DRAIN_TIMEOUT", "30")),
+                    on_shutdown="edaijiamcp:shutdown",
+                    private_port_base=int(os.getenv("EDJ_WORKER_PORT_BASE", "0")) or None)
+    else:
+        mcp.run(transport=transport, host=host, port=port)
+
+
 if __name__ == "__main__":
-    # Initialize and run the server
-    mcp.run(transport='sse')
+    # 命令行参数见main.py
+    run()
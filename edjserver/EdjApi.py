@@ -1,29 +1,74 @@
-import json
+import asyncio
+import logging
 import os
-import requests
+import time
+import httpx
 
 from .EdjSystemParams import EdjSystemParams
-from .EdjSignUtils import EdjSignUtils
+from .EdjSignUtils import EdjSignUtils, Signer, token_decryptor
+from .EdjTokenCache import token_cache as default_token_cache
+from .EdjEstimateCache import EdjEstimateCache
+from .EdjResilience import EdjResilience
+from .EdjMetrics import metrics as default_metrics
+from .EdjRateLimit import RateLimiter
+from .EdjLog import log_event
+from .EdjJson import JSONDecodeError, loads
+from .EdjModels import ApiResult, wrap_result
+from .EdjGeo import ServiceArea
+
+logger = logging.getLogger(__name__)
 
 
 class EdjApi:
-    def __init__(self, appkey=None, secret=None, api_base_url=None):
+    # HTTP连接池默认配置
+    DEFAULT_TIMEOUT = 30
+    DEFAULT_MAX_CONNECTIONS = 200
+    DEFAULT_MAX_KEEPALIVE = 50
+    DEFAULT_KEEPALIVE_EXPIRY = 30.0
+
+    def __init__(self, appkey=None, secret=None, api_base_url=None, token_cache=None,
+                 estimate_cache=None, resilience=None, metrics=None, ver=None, from_channel=None,
+                 service_area=None, audit_log=None):
         """初始化API服务
         Args:
             appkey: str, 合作方标识，不传则使用默认值
             secret: str, e代驾分配的SECRET，不传则使用默认值
             api_base_url: str, API基础URL，不传则使用默认值
+            token_cache: EdjTokenCache, token缓存，不传则使用进程级共享缓存
+            estimate_cache: EdjEstimateCache, 预估费用缓存，不传则按环境变量
+                EDJ_ESTIMATE_CACHE_TTL决定是否启用(仅作用于预估接口)
+            resilience: EdjResilience, 各接口的超时、重试和熔断策略，不传则使用默认策略
+            metrics: EdjMetrics, 上游调用指标，不传则使用进程级共享注册表
+            ver: str, 接口版本号(系统参数ver)，不传则使用默认值
+            from_channel: str, 业务渠道(系统参数from)，不传则使用默认值
+            service_area: ServiceArea, 预估和下单前的坐标预校验和服务区域索引，不传则按环境变量
+                EDJ_GEO_CHECK决定是否启用(默认启用)
+            audit_log: AuditLog, 上游调用审计日志，不传则不记录(服务由TenantRegistry按环境变量创建)
         """
-        self.appkey = appkey
-        self.secret = secret
+        self.appkey = appkey or EdjSystemParams.DEFAULT_APPKEY
+        self.secret = secret or EdjSystemParams.DEFAULT_SECRET
         self.api_base_url = api_base_url
-        
-    def get_authen_token(self, phone=None, third_user_id=None, user_os=None, mac=None):
+        self.token_cache = token_cache or default_token_cache
+        self.estimate_cache = estimate_cache or EdjEstimateCache.from_env()
+        self.resilience = resilience or EdjResilience()
+        self.metrics = metrics or default_metrics
+        self.service_area = service_area or ServiceArea.from_env()
+        self.audit_log = audit_log
+        # 签名上下文只构建一次，每次请求复用
+        self.signer = Signer(
+            self.secret,
+            appkey=self.appkey,
+            ver=ver or EdjSystemParams.DEFAULT_VER,
+            from_channel=from_channel or EdjSystemParams.DEFAULT_FROM_CHANNEL
+        )
+        self._client = None
+
+    def get_authen_token(self, phone=None, third_user_id=None, user_os=None, mac=None, randomkey=None):
         """获取用户认证token
         Args:
             phone: str, 11位真实用户手机号(非虚拟号必传)
             third_user_id: str, 合作方用户id(虚拟号必传)
-            randomkey: str, 16位AES对称密钥,用于解密返回token
+            randomkey: str, 16位AES对称密钥,用于解密返回token(可选，不传则每次请求随机生成)
             user_os: str, 用户手机系统(可选)
             mac: str, 用户mac地址(可选)
         Returns:
@@ -35,6 +80,19 @@ class EdjApi:
                 }
             }
         """
+        path, params = self._prepare_authen_token(phone, third_user_id, user_os, mac, randomkey)
+        response = self._post(path, params)
+        self._store_authen_token(phone, response, params['randomkey'], reused_key=randomkey is not None)
+        return response
+
+    def _prepare_authen_token(self, phone=None, third_user_id=None, user_os=None, mac=None,
+                              randomkey=None):
+        """校验参数并构建获取认证token的请求
+        Args:
+            同get_authen_token
+        Returns:
+            tuple: (path, params) 接口路径和已签名的请求参数
+        """
         if not (phone or third_user_id):
             raise ValueError("phone或third_user_id必须传一个")
             
@@ -42,7 +100,7 @@ class EdjApi:
             raise ValueError("phone必须是11位手机号")
             
         params = {
-            "randomkey": "1234567890abcdef"
+            "randomkey": randomkey or EdjSignUtils.generate_randomkey()
         }
         
         if phone:
@@ -54,33 +112,32 @@ class EdjApi:
         if mac:
             params['mac'] = mac
         
-        params = self._add_system_params_and_sign(params)
-        
-        # 调用接口获取token
-        base_url = EdjSystemParams.get_api_base_url(self.api_base_url)
-        url = f"{base_url}/customer/getAuthenToken"
-        response = self._post(url, params)
-        
-        # 打印响应结果
-        print(f"API响应: {response}")
+        params = self._add_system_params_and_sign(params, "/customer/getAuthenToken")
         
+        return "/customer/getAuthenToken", params
+
+    def _store_authen_token(self, phone, response, randomkey, reused_key=False):
+        """解密认证接口返回的token并写入token存储
+        Args:
+            phone: str, 11位手机号
+            response: dict, getAuthenToken接口返回结果
+            randomkey: str, 请求时使用的randomkey
+            reused_key: bool, randomkey由调用方指定(可能重复使用)时缓存其解密对象
+        """
+        if response['code'] != '0':
+            log_event(logger, logging.WARNING, 'authen_token_failed', phone=phone,
+                      code=response['code'], message=response.get('message'))
+            return
+
         # 存储加密token到本地文件
-        if response['code'] == '0' and phone:
+        if phone:
             encrypt_authentoken = response['data']['encrypt_authentoken']
             # 解密token
-            authentoken = EdjSignUtils.decrypt_token(encrypt_authentoken)
-            # 打印解密后的token
-            print(f"解密后的token: {authentoken}")
-            
-            # 将加密token存储到本地文件中
-            token_dir = os.path.join(os.path.dirname(__file__), 'tokens')
-            if not os.path.exists(token_dir):
-                os.makedirs(token_dir)
-            token_file = os.path.join(token_dir, f"{phone}.token")
-            with open(token_file, 'w') as f:
-                f.write(authentoken)
-            print(f"Token已保存到: {token_file}")
-        return response
+            authentoken = EdjSignUtils.decrypt_token(encrypt_authentoken, randomkey, cache=reused_key)
+
+            # 将token写入存储并更新内存缓存
+            self.token_cache.save(phone, authentoken)
+            log_event(logger, logging.INFO, 'token_saved', phone=phone)
 
     def get_city_price_list(self, longitude, latitude, city_name):
         """获取城市价格列表
@@ -104,18 +161,14 @@ class EdjApi:
             'city_name': city_name
         }
 
-        params = self._add_system_params_and_sign(params)
+        params = self._add_system_params_and_sign(params, "/city/price/list")
         
         # 调用接口获取城市价格列表
-        base_url = EdjSystemParams.get_api_base_url(self.api_base_url)
-        url = f"{base_url}/city/price/list"
-        response = self._post(url, params)
-        
-        return response
+        return self._post("/city/price/list", params)
     
     def get_cost_estimate_v2(self, token, start_latitude, start_longitude, end_latitude, end_longitude, 
                          channel=None, long_distance_adjust_fee=None, bonus_sn=None, strategyId=None,
-                         is_use_bonus=None, estimate_distance=None, estimate_duration=None):
+                         is_use_bonus=None, estimate_distance=None, estimate_duration=None, subject=None):
         """获取预估费用V2
         Args:
             token: str, 用户凭证
@@ -130,6 +183,7 @@ class EdjApi:
             is_use_bonus: int, 是否使用优惠券(1:使用 0:不使用,默认0)(可选)
             estimate_distance: int, 合作方预估距离,单位米(可选)
             estimate_duration: int, 合作方预估时长,单位秒(可选)
+            subject: str, 用户级限流的主体(如手机号)，预估参数中没有手机号，不传则按token限流(可选)
         Returns:
             dict: 接口返回结果
         """
@@ -162,14 +216,13 @@ class EdjApi:
         if estimate_duration is not None:
             params['estimate_duration'] = estimate_duration
 
-        params = self._add_system_params_and_sign(params)
+        # 启用预估缓存时，以量化后的业务参数作为缓存键(签名前计算)
+        cache_key = self.estimate_cache.make_key(params) if self.estimate_cache else None
+
+        params = self._add_system_params_and_sign(params, "/order/costestimateV2")
         
         # 调用预估费用接口
-        base_url = EdjSystemParams.get_api_base_url(self.api_base_url)
-        url = f"{base_url}/order/costestimateV2"
-        response = self._post(url, params)
-        
-        return response
+        return self._post_cached(cache_key, "/order/costestimateV2", params, subject)
 
 
 
@@ -178,7 +231,7 @@ class EdjApi:
                      contact_phone=None, third_user_id=None, channel='01003', bonus_sn=None,
                      driver_id=None, dynamic_fee=None, dynamic_rate=None, fee_max=None,
                      strategyId=None, strategyServiceSign=None, carNo=None, cash_only=None,
-                     callLink=None, prePay=None, multiBizEstimate=None):
+                     callLink=None, prePay=None, multiBizEstimate=None, idempotent=False):
         """下单接口
         Args:
             phone: str, 下单用户电话(真实手机号)
@@ -206,6 +259,7 @@ class EdjApi:
             callLink: str, 催付短信链接(可选)
             prePay: int, 是否免密或者预付订单(0否,1是)(可选)
             multiBizEstimate: str, 多业务预估信息(可选)
+            idempotent: bool, third_order_id由幂等键确定时传True，网络失败时允许自动重试(不发送给上游)
         Returns:
             dict: 接口返回结果
         """
@@ -251,32 +305,47 @@ class EdjApi:
         params.update({k: v for k, v in optional_params.items() if v is not None})
 
         # 添加系统参数和签名
-        params = self._add_system_params_and_sign(params)
+        params = self._add_system_params_and_sign(params, "/order/commit")
 
         # 调用下单接口
-        base_url = EdjSystemParams.get_api_base_url(self.api_base_url)
-        url = f"{base_url}/order/commit"
-        response = self._post(url, params)
+        return self._post("/order/commit", params, idempotent=idempotent)
 
-        return response
+    def get_order_status(self, token, third_order_id):
+        """查询订单状态
+        Args:
+            token: str, 用户凭证
+            third_order_id: str, 第三方订单号(下单时传入)
+        Returns:
+            dict: 接口返回结果，data中的order_status为订单状态码(见EdjStatus.ORDER_STATUS)
+        """
+        if not all([token, third_order_id]):
+            raise ValueError("token和third_order_id为必填参数")
+
+        params = {
+            'token': token,
+            'third_order_id': third_order_id
+        }
+        params = self._add_system_params_and_sign(params, "/order/polling")
+
+        # 调用订单状态查询接口
+        return self._post("/order/polling", params)
 
-    def _add_system_params_and_sign(self, params):
+    def _add_system_params_and_sign(self, params, endpoint=None):
         """添加系统参数和签名
         Args:
             params: dict, 原始参数字典
+            endpoint: str, 接口路径，用于按接口记录签名耗时(可选)
         Returns:
             dict: 添加了系统参数和签名后的参数字典
         """
-        # 获取系统参数并合并
-        system_params = EdjSystemParams.get_system_params()
-        params.update(system_params)
-        # 获取签名
-        sig = EdjSignUtils.generate_sig(params, '0031186e-5cc6-45a6-a090-3e88ec220452')
-        params['sig'] = sig
+        start = time.perf_counter()
+        params = self.signer.sign(params)
+        if endpoint:
+            self.metrics.upstream_sign_seconds.labels(endpoint).observe(time.perf_counter() - start)
         return params
 
     def get_token_by_phone(self, phone):
-        """根据手机号获取本地存储的token
+        """根据手机号获取token，优先读取内存缓存，未命中时从本地文件加载
         Args:
             phone: str, 11位手机号
         Returns:
@@ -284,44 +353,424 @@ class EdjApi:
         """
         if not phone or len(phone) != 11:
             raise ValueError("phone必须是11位手机号")
-            
-        # 获取token文件路径
-        token_dir = os.path.join(os.path.dirname(__file__), 'tokens')
-        token_file = os.path.join(token_dir, f"{phone}.token")
-        
-        # 如果token文件存在则读取返回
-        if os.path.exists(token_file):
-            with open(token_file, 'r') as f:
-                token = f.read().strip()
-                print(f"获取到的token: {token}")
-                return token
-        return None
-
-    def _post(self, url, params):
-        """发送POST请求
+        return self.token_cache.get(phone)
+
+    def _build_url(self, path):
+        """拼接接口完整地址
+        Args:
+            path: str, 接口路径，例如: /order/commit
+        Returns:
+            str: 完整请求URL
+        """
+        base_url = EdjSystemParams.get_api_base_url(self.api_base_url)
+        return f"{base_url}{path}"
+
+    @staticmethod
+    def _client_options():
+        """HTTP连接池配置，可通过环境变量调整
+        Returns:
+            dict: 创建httpx客户端的参数
+        """
+        limits = httpx.Limits(
+            max_connections=int(os.getenv('EDJ_HTTP_MAX_CONNECTIONS', EdjApi.DEFAULT_MAX_CONNECTIONS)),
+            max_keepalive_connections=int(os.getenv('EDJ_HTTP_MAX_KEEPALIVE', EdjApi.DEFAULT_MAX_KEEPALIVE)),
+            keepalive_expiry=float(os.getenv('EDJ_HTTP_KEEPALIVE_EXPIRY', EdjApi.DEFAULT_KEEPALIVE_EXPIRY))
+        )
+        # HTTP/2依赖h2包，且只在https上经ALPN协商，上游不支持时自动回落到HTTP/1.1
+        http2 = os.getenv('EDJ_HTTP2', '1') not in ('0', 'false', 'False')
+        if http2:
+            try:
+                import h2  # noqa: F401
+            except ImportError:
+                http2 = False
+        return {'limits': limits, 'http2': http2, 'timeout': EdjApi.DEFAULT_TIMEOUT}
+
+    def _get_client(self):
+        """获取共享的同步HTTP客户端(长连接复用)"""
+        if self._client is None:
+            self._client = httpx.Client(**self._client_options())
+        return self._client
+
+    def close(self):
+        """关闭连接池"""
+        if self._client is not None:
+            self._client.close()
+            self._client = None
+
+    def _post(self, endpoint, params, idempotent=None, subject=None):
+        """发送POST请求，按接口策略设置超时、重试和熔断，并记录耗时和返回码指标
         Args:
-            url: str, 请求URL
+            endpoint: str, 接口路径(不含API_BASE_URL)，例如: /order/commit，用于查找接口策略
             params: dict, 请求参数
+            idempotent: bool, 调用方声明本次请求可安全重复(非幂等接口才需要)
+            subject: str, 用户级限流的主体，不传则取参数中的phone/third_user_id/token(同步版本不限流)
         Returns:
             dict: 响应结果
         """
+        url = self._build_url(endpoint)
+        inflight = self.metrics.upstream_inflight.labels(endpoint)
+        inflight.inc()
+        start = time.perf_counter()
         try:
-            response = requests.post(url, data=params, timeout=30)
-            response.raise_for_status()
-            return response.json()
-        except requests.exceptions.RequestException as e:
-            return {
-                'code': '-1',
-                'message': f'请求失败: {str(e)}',
-                'data': None
-            }
-        except json.JSONDecodeError as e:
-            return {
-                'code': '-2',
-                'message': f'响应解析失败: {str(e)}',
-                'data': None
-            }
+            response = self._send(endpoint, url, params, idempotent)
+        finally:
+            inflight.dec()
+        self.metrics.record_response(endpoint, response)
+        if self.service_area is not None:
+            self.service_area.observe(endpoint, params, response)
+        if self.audit_log is not None:
+            self.audit_log.record(endpoint, params, response, time.perf_counter() - start)
+        return response
+
+    def _send(self, endpoint, url, params, idempotent):
+        """按重试策略发送请求，参数同_post"""
+        policy = self.resilience.policy(endpoint)
+        breaker = self.resilience.breaker(endpoint)
+        network = self.metrics.upstream_network_seconds.labels(endpoint)
+        attempts = policy.attempts(idempotent)
+        for attempt in range(attempts):
+            if not breaker.allow():
+                return self._error_response('-3', f'上游接口熔断中: {endpoint}')
+            start = time.perf_counter()
+            try:
+                response = self._get_client().post(url, data=params, timeout=policy.timeout)
+                response.raise_for_status()
+            except httpx.HTTPError as e:
+                network.observe(time.perf_counter() - start)
+                if not self._should_retry(endpoint, breaker, e, attempt, attempts):
+                    return self._error_response('-1', f'请求失败: {str(e)}')
+                time.sleep(policy.backoff(attempt))
+                continue
+            except BaseException:
+                # 请求中断时既不算成功也不算失败，但要释放探测名额，否则熔断器一直停在半开状态
+                breaker.release_probe()
+                raise
+            network.observe(time.perf_counter() - start)
+            breaker.record_success()
+            return self._decode(endpoint, response)
+
+    def _should_retry(self, endpoint, breaker, error, attempt, attempts):
+        """记录一次失败的请求，返回是否继续重试"""
+        retryable = self.resilience.is_retryable(error)
+        log_event(logger, logging.WARNING, 'upstream_error', endpoint=endpoint,
+                  attempt=attempt + 1, retryable=retryable, error=str(error))
+        if not retryable:
+            # 上游有响应(如4xx)，不计入熔断
+            breaker.record_success()
+            return False
+        breaker.record_failure()
+        if attempt + 1 >= attempts:
+            return False
+        self.resilience.retries += 1
+        self.metrics.upstream_retries.labels(endpoint).inc()
+        return True
+
+    def _decode(self, endpoint, response):
+        """解析响应JSON(安装orjson时使用orjson)并按接口包装为结果模型，记录解析耗时"""
+        start = time.perf_counter()
+        try:
+            result = wrap_result(endpoint, loads(response.content))
+        except JSONDecodeError as e:
+            log_event(logger, logging.WARNING, 'upstream_decode_error', endpoint=endpoint,
+                      status=response.status_code, error=str(e))
+            return self._error_response('-2', f'响应解析失败: {str(e)}')
+        self.metrics.upstream_decode_seconds.labels(endpoint).observe(time.perf_counter() - start)
+        return result
+
+    def _post_cached(self, cache_key, endpoint, params, subject=None):
+        """带预估缓存的POST请求，cache_key为None时等同于_post
+        Returns:
+            dict: 响应结果，启用缓存时带from_cache标记
+        """
+        if cache_key is None:
+            return self._post(endpoint, params, subject=subject)
+        cached = self.estimate_cache.get(cache_key)
+        if cached is not None:
+            return cached
+        response = self._post(endpoint, params, subject=subject)
+        self.estimate_cache.put(cache_key, response.copy())
+        response['from_cache'] = False
+        return response
+
+    def precheck_routes(self, routes, order=False):
+        """预估或下单前在本地校验路线(坐标、起终点距离、已知未开通或无空闲司机的区域)
+        Args:
+            routes: list, [(start_latitude, start_longitude, end_latitude, end_longitude), ...]
+            order: bool, 是否为下单
+        Returns:
+            list: 与routes一一对应，不通过的为错误返回(返回码与上游一致，带local_check标记)，
+                通过或未启用预校验时为None
+        """
+        if self.service_area is None:
+            return [None] * len(routes)
+        return [None if rejection is None else self._local_rejection(*rejection)
+                for rejection in self.service_area.check_routes(routes, order)]
+
+    def precheck_route(self, start_latitude, start_longitude, end_latitude, end_longitude, order=False):
+        """校验单条路线，参数同precheck_routes中的一项
+        Returns:
+            dict: 不通过时的错误返回，通过返回None
+        """
+        return self.precheck_routes([(start_latitude, start_longitude, end_latitude, end_longitude)],
+                                    order)[0]
+
+    def precheck_city(self, city_name):
+        """拉取城市价格表前校验城市是否最近返回过未开通
+        Returns:
+            dict: 未开通时的错误返回，否则返回None
+        """
+        if self.service_area is None:
+            return None
+        rejection = self.service_area.check_city(city_name)
+        return None if rejection is None else self._local_rejection(*rejection)
+
+    @classmethod
+    def _local_rejection(cls, code, message):
+        """本地预校验不通过的返回，不计入上游指标"""
+        response = cls._error_response(code, message)
+        response['local_check'] = True
+        return response
+
+    @staticmethod
+    def _error_response(code, message):
+        """构造本地错误返回，格式与接口返回一致"""
+        return ApiResult({
+            'code': code,
+            'message': message,
+            'data': None
+        })
+
+
+class _Flight:
+    """进行中的合并请求及等待它的调用数"""
+    __slots__ = ('task', 'waiters')
+
+    def __init__(self, task):
+        self.task = task
+        self.waiters = 0
+
+
+class AsyncEdjApi(EdjApi):
+    """EdjApi的异步版本
+
+    方法与EdjApi一一对应，区别在于需要await调用：各接口方法沿用父类的
+    参数构建逻辑，_post改为协程后直接返回可await对象。所有请求共用一个
+    httpx.AsyncClient，长连接复用，单进程内可同时挂起大量上游请求。
+    get_token_by_phone仍为同步方法。
+
+    策略中coalesce为True的只读接口(预估、城市价格表)，业务参数相同(不含timestamp、sig)的
+    并发调用共用一次上游请求，都拿到同一结果的副本，合并的调用数记入edj_upstream_coalesced_total。
+
+    调用方(工具调用)被取消时，进行中的HTTP请求随之中止，不继续占用连接池和限流排队位置；
+    合并的请求在所有调用方都取消后才中止。
+    """
+
+    # 计算合并键时忽略的参数(每次请求都不同)
+    COALESCE_IGNORED = frozenset(['timestamp', 'sig'])
+
+    def __init__(self, appkey=None, secret=None, api_base_url=None, token_cache=None,
+                 estimate_cache=None, resilience=None, metrics=None, ver=None, from_channel=None,
+                 rate_limiter=None, service_area=None, audit_log=None):
+        """参数同EdjApi，另外:
+        Args:
+            rate_limiter: RateLimiter, 上游调用限流，不传则按环境变量EDJ_RATE_LIMIT*创建(可关闭)
+        """
+        super().__init__(appkey, secret, api_base_url, token_cache, estimate_cache, resilience,
+                         metrics, ver, from_channel, service_area, audit_log)
+        self.rate_limiter = rate_limiter or RateLimiter.from_env()
+        self._async_client = None
+        self._coalescing = {}
+
+    async def get_authen_token(self, phone=None, third_user_id=None, user_os=None, mac=None,
+                               randomkey=None):
+        """获取用户认证token，参数与返回值同EdjApi.get_authen_token"""
+        path, params = self._prepare_authen_token(phone, third_user_id, user_os, mac, randomkey)
+        response = await self._post(path, params)
+        self._store_authen_token(phone, response, params['randomkey'], reused_key=randomkey is not None)
+        return response
+
+    async def get_authen_tokens(self, phones, max_concurrency=20):
+        """批量获取token，用于密钥轮换或故障恢复后为大量用户重新认证
+        每个请求使用各自的randomkey并发请求认证接口(仍受限流器约束)，全部返回后一次批量解密并写入存储
+        Args:
+            phones: list, 11位手机号列表
+            max_concurrency: int, 同时进行的认证请求数
+        Returns:
+            dict: {phone: 认证接口返回结果}，解密失败的返回码为'-2'
+        """
+        phones = list(dict.fromkeys(phones))
+        if any(not phone or len(phone) != 11 for phone in phones):
+            raise ValueError("phone必须是11位手机号")
+        semaphore = asyncio.Semaphore(max(1, max_concurrency))
+
+        async def fetch(phone):
+            path, params = self._prepare_authen_token(phone)
+            async with semaphore:
+                return await self._post(path, params), params['randomkey']
+
+        fetched = await asyncio.gather(*(fetch(phone) for phone in phones))
+        results = {}
+        succeeded = []
+        for phone, (response, randomkey) in zip(phones, fetched):
+            results[phone] = response
+            if response['code'] == '0':
+                succeeded.append((phone, response['data']['encrypt_authentoken'], randomkey))
+        tokens = token_decryptor.decrypt_many([(encrypted, key) for _, encrypted, key in succeeded])
+        for (phone, _, _), token in zip(succeeded, tokens):
+            if token is None:
+                results[phone] = self._error_response('-2', 'token解密失败')
+                log_event(logger, logging.WARNING, 'authen_token_failed', phone=phone, code='-2')
+                continue
+            self.token_cache.save(phone, token)
+        log_event(logger, logging.INFO, 'tokens_saved', count=len(phones),
+                  saved=sum(1 for token in tokens if token is not None))
+        return results
+
+    async def refresh_authen_token(self, phone, stale_token=None, proactive=False):
+        """刷新token，同一手机号的并发刷新只请求一次上游
+        Args:
+            phone: str, 11位手机号
+            stale_token: str, 已判定过期的token(可选)，缓存中已是新token时不再请求上游
+            proactive: bool, 是否为过期前的提前刷新(stale_token尚未过期，不计入有效期学习)
+        Returns:
+            dict: 认证接口返回结果，code为'0'时可通过get_token_by_phone取到新token
+        """
+        if not phone or len(phone) != 11:
+            raise ValueError("phone必须是11位手机号")
+        response = await self.token_cache.refresh(
+            phone, lambda: self.get_authen_token(phone), stale_token, expired=not proactive)
+        if response is None:
+            return {'code': '0', 'message': 'token已由并发请求刷新', 'data': None}
+        return response
+
+    def _get_async_client(self):
+        """获取共享的异步HTTP客户端，首次使用时在当前事件循环中创建"""
+        if self._async_client is None:
+            self._async_client = httpx.AsyncClient(**self._client_options())
+        return self._async_client
+
+    async def aclose(self):
+        """关闭异步连接池"""
+        if self._async_client is not None:
+            await self._async_client.aclose()
+            self._async_client = None
+
+    async def _post(self, endpoint, params, idempotent=None, subject=None):
+        """异步发送POST请求，超时、重试、熔断和指标逻辑同EdjApi._post
+        Args:
+            endpoint: str, 接口路径(不含API_BASE_URL)，例如: /order/commit
+            params: dict, 请求参数
+            idempotent: bool, 调用方声明本次请求可安全重复(非幂等接口才需要)
+            subject: str, 用户级限流的主体，不传则取参数中的phone/third_user_id/token
+        Returns:
+            dict: 响应结果
+        """
+        url = self._build_url(endpoint)
+        if not self.resilience.policy(endpoint).coalesce:
+            return await self._post_upstream(endpoint, url, params, idempotent, subject)
+
+        key = self._coalesce_key(endpoint, params)
+        flight = self._coalescing.get(key)
+        if flight is None:
+            flight = _Flight(asyncio.ensure_future(
+                self._post_upstream(endpoint, url, params, idempotent, subject)))
+            self._coalescing[key] = flight
+            flight.task.add_done_callback(lambda _: self._coalescing.pop(key, None)
+                                          if self._coalescing.get(key) is flight else None)
+        else:
+            self.metrics.upstream_coalesced.labels(endpoint).inc()
+        # 单个调用方取消时不影响共用的请求，所有调用方都取消后中止请求、释放连接；
+        # 各调用方拿到副本，可以各自添加from_cache等字段
+        flight.waiters += 1
+        try:
+            return (await asyncio.shield(flight.task)).copy()
+        finally:
+            flight.waiters -= 1
+            if flight.waiters == 0 and not flight.task.done():
+                # 先移出合并表，取消完成前到达的调用方发起新的请求，而不是加入已取消的请求
+                if self._coalescing.get(key) is flight:
+                    del self._coalescing[key]
+                flight.task.cancel()
+
+    @classmethod
+    def _coalesce_key(cls, endpoint, params):
+        """合并键: 接口路径和规范化后的业务参数，数值统一为6位小数，空值忽略"""
+        items = []
+        for name, value in params.items():
+            if name in cls.COALESCE_IGNORED or value is None or value == '':
+                continue
+            if isinstance(value, (int, float)) and not isinstance(value, bool):
+                value = f"{value:.6f}"
+            else:
+                value = str(value).strip()
+            items.append((name, value))
+        items.sort()
+        return endpoint, tuple(items)
+
+    async def _post_upstream(self, endpoint, url, params, idempotent, subject=None):
+        """限流后请求上游，参数同_post"""
+        if self.rate_limiter is not None:
+            # 按appkey、接口和用户限流，超过排队时间的请求不发往上游
+            subject = subject or params.get('phone') or params.get('third_user_id') or params.get('token')
+            if not await self.rate_limiter.acquire(self.appkey, endpoint, subject):
+                response = self._error_response('-4', f'请求过于频繁，已被限流: {endpoint}')
+                self.metrics.record_response(endpoint, response)
+                return response
+        inflight = self.metrics.upstream_inflight.labels(endpoint)
+        inflight.inc()
+        start = time.perf_counter()
+        try:
+            response = await self._send(endpoint, url, params, idempotent)
+        finally:
+            inflight.dec()
+        self.metrics.record_response(endpoint, response)
+        if self.service_area is not None:
+            self.service_area.observe(endpoint, params, response)
+        if self.audit_log is not None:
+            # 队列满时最多等待audit_log.max_wait，之后丢弃记录，不阻塞调用方
+            await self.audit_log.arecord(endpoint, params, response, time.perf_counter() - start)
+        return response
+
+    async def _send(self, endpoint, url, params, idempotent):
+        """按重试策略异步发送请求，参数同_post"""
+        policy = self.resilience.policy(endpoint)
+        breaker = self.resilience.breaker(endpoint)
+        network = self.metrics.upstream_network_seconds.labels(endpoint)
+        attempts = policy.attempts(idempotent)
+        for attempt in range(attempts):
+            if not breaker.allow():
+                return self._error_response('-3', f'上游接口熔断中: {endpoint}')
+            start = time.perf_counter()
+            try:
+                response = await self._get_async_client().post(url, data=params, timeout=policy.timeout)
+                response.raise_for_status()
+            except httpx.HTTPError as e:
+                network.observe(time.perf_counter() - start)
+                if not self._should_retry(endpoint, breaker, e, attempt, attempts):
+                    return self._error_response('-1', f'请求失败: {str(e)}')
+                await asyncio.sleep(policy.backoff(attempt))
+                continue
+            except BaseException:
+                # 请求被取消(合并请求的调用方都已离开、批量或矩阵超时)时释放探测名额，
+                # 否则熔断器一直停在半开状态
+                breaker.release_probe()
+                raise
+            network.observe(time.perf_counter() - start)
+            breaker.record_success()
+            return self._decode(endpoint, response)
+
+    async def _post_cached(self, cache_key, endpoint, params, subject=None):
+        """带预估缓存的异步POST请求，逻辑同EdjApi._post_cached"""
+        if cache_key is None:
+            return await self._post(endpoint, params, subject=subject)
+        cached = self.estimate_cache.get(cache_key)
+        if cached is not None:
+            return cached
+        response = await self._post(endpoint, params, subject=subject)
+        self.estimate_cache.put(cache_key, response.copy())
+        response['from_cache'] = False
+        return response
 
 
 # 导出类供外部使用
-__all__ = ['EdjApi']
+__all__ = ['EdjApi', 'AsyncEdjApi']
@@ -0,0 +1,388 @@
+"""上游调用审计日志
+
+每次上游请求(接口、脱敏后的参数、返回码、耗时、订单号等)追加写入本地日志，用于对账和
+计费争议处理:
+- 请求路径上只把记录放入有界队列，由后台线程批量序列化、写入并fsync
+- 日志按段写入，段文件超过segment_bytes后关闭并压缩为.gz，新开一段
+- 队列满(磁盘慢)时异步调用最多等待max_wait秒，仍写不进去则丢弃该记录并计数，不会无限阻塞工具调用
+
+按订单重建时间线: python -m edjserver.EdjAudit [--dir 目录] [--order 第三方订单号]
+"""
+import argparse
+import asyncio
+import glob
+import gzip
+import os
+import queue
+import shutil
+import threading
+import time
+
+from .EdjJson import dumps, loads
+from .EdjLog import redact
+from .EdjStatus import get_order_status_desc
+from .EdjTokenStore import state_directory
+
+# 审计记录中不保存的系统参数(每次请求都不同或无意义)
+OMITTED_PARAMS = frozenset(['sig', 'timestamp'])
+# 从返回数据中摘录的字段
+RESULT_FIELDS = ('order_id', 'order_status', 'fee')
+
+_STOP = object()
+
+
+def default_directory():
+    """默认日志目录: 状态目录(见state_directory)下的audit，不写入代码目录"""
+    return state_directory('audit')
+
+
+class AuditLog:
+    """追加式审计日志，后台线程批量写入"""
+
+    DEFAULT_SEGMENT_BYTES = 64 * 1024 * 1024
+    DEFAULT_MAX_PENDING = 10000
+    DEFAULT_MAX_WAIT = 0.1
+    BATCH_SIZE = 1000
+
+    def __init__(self, directory=None, segment_bytes=None, max_pending=None, max_wait=None):
+        """
+        Args:
+            directory: str, 日志目录，默认见default_directory
+            segment_bytes: int, 单个段文件的大小上限，默认64MB
+            max_pending: int, 等待写入的记录数上限，默认10000
+            max_wait: float, 队列满时异步调用最多等待的秒数，默认0.1
+        """
+        self.directory = directory or default_directory()
+        self.segment_bytes = segment_bytes or self.DEFAULT_SEGMENT_BYTES
+        self.max_wait = self.DEFAULT_MAX_WAIT if max_wait is None else max_wait
+        self._queue = queue.Queue(max_pending or self.DEFAULT_MAX_PENDING)
+        self._thread = None
+        self._start_lock = threading.Lock()
+        self._file = None
+        self._path = None
+        self._size = 0
+        self._seq = 0
+        self.written = 0
+        self.dropped = 0
+        self.backpressured = 0
+        self.segments = 0
+        self.write_errors = 0
+
+    @classmethod
+    def from_env(cls):
+        """按环境变量创建
+        EDJ_AUDIT_LOG: 日志目录，设为0关闭，默认见default_directory
+        EDJ_AUDIT_SEGMENT_MB: 段文件大小上限(MB)
+        EDJ_AUDIT_MAX_PENDING: 等待写入的记录数上限
+        EDJ_AUDIT_MAX_WAIT: 队列满时最多等待的秒数
+        Returns:
+            AuditLog或None(已关闭)
+        """
+        spec = os.getenv('EDJ_AUDIT_LOG', '')
+        if spec in ('0', 'false', 'False'):
+            return None
+        segment_mb = os.getenv('EDJ_AUDIT_SEGMENT_MB')
+        max_pending = os.getenv('EDJ_AUDIT_MAX_PENDING')
+        max_wait = os.getenv('EDJ_AUDIT_MAX_WAIT')
+        return cls(spec or None,
+                   segment_bytes=int(float(segment_mb) * 1024 * 1024) if segment_mb else None,
+                   max_pending=int(max_pending) if max_pending else None,
+                   max_wait=float(max_wait) if max_wait else None)
+
+    @staticmethod
+    def _entry(endpoint, params, response, latency):
+        """组装记录，脱敏和序列化在写入线程中进行"""
+        return (time.time(), endpoint, params, response, latency)
+
+    def record(self, endpoint, params, response, latency):
+        """记录一次上游调用(同步调用方使用)，队列满时最多阻塞max_wait秒
+        Args:
+            endpoint: str, 接口路径
+            params: dict, 请求参数(含系统参数)
+            response: dict, 接口返回结果
+            latency: float, 耗时(秒)
+        Returns:
+            bool: 是否已放入写入队列
+        """
+        entry = self._entry(endpoint, params, response, latency)
+        self._start()
+        try:
+            self._queue.put_nowait(entry)
+            return True
+        except queue.Full:
+            self.backpressured += 1
+        try:
+            self._queue.put(entry, timeout=self.max_wait)
+            return True
+        except queue.Full:
+            self.dropped += 1
+            return False
+
+    async def arecord(self, endpoint, params, response, latency):
+        """记录一次上游调用(异步调用方使用)，参数同record
+        队列满时让出事件循环等待写入线程腾出空间，最多等待max_wait秒，不阻塞其他请求
+        """
+        entry = self._entry(endpoint, params, response, latency)
+        self._start()
+        try:
+            self._queue.put_nowait(entry)
+            return True
+        except queue.Full:
+            self.backpressured += 1
+        deadline = time.monotonic() + self.max_wait
+        while time.monotonic() < deadline:
+            await asyncio.sleep(0.005)
+            try:
+                self._queue.put_nowait(entry)
+                return True
+            except queue.Full:
+                continue
+        self.dropped += 1
+        return False
+
+    def _start(self):
+        if self._thread is not None:
+            return
+        with self._start_lock:
+            if self._thread is None:
+                os.makedirs(self.directory, exist_ok=True)
+                thread = threading.Thread(target=self._run, name='edj-audit-writer', daemon=True)
+                thread.start()
+                self._thread = thread
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            while len(batch) < self.BATCH_SIZE:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            stop = any(entry is _STOP for entry in batch)
+            lines = [self._format(entry).encode('utf-8') for entry in batch if entry is not _STOP]
+            if lines:
+                try:
+                    self._write(lines)
+                    self.written += len(lines)
+                except OSError:
+                    self.write_errors += 1
+                    self.dropped += len(lines)
+            if stop:
+                self._close_segment()
+                return
+
+    @staticmethod
+    def _format(entry):
+        ts, endpoint, params, response, latency = entry
+        record = {'ts': round(ts, 3), 'endpoint': endpoint, 'latency_ms': round(latency * 1000, 1)}
+        if isinstance(response, dict):
+            record['code'] = response.get('code')
+            if response.get('code') != '0':
+                record['message'] = response.get('message')
+            data = response.get('data')
+            if isinstance(data, dict):
+                for field in RESULT_FIELDS:
+                    if data.get(field) is not None:
+                        record[field] = data[field]
+        if params.get('third_order_id'):
+            record['third_order_id'] = params['third_order_id']
+        record['params'] = redact({k: v for k, v in params.items() if k not in OMITTED_PARAMS})
+        return dumps(record) + '\n'
+
+    def _write(self, lines):
+        """写入一批记录，超过段大小时在记录边界处切换到新段，每段写完fsync一次"""
+        start = 0
+        while start < len(lines):
+            if self._file is None:
+                self._seq += 1
+                name = f"audit-{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}-{self._seq:04d}.log"
+                self._path = os.path.join(self.directory, name)
+                self._file = open(self._path, 'ab')
+                self._size = 0
+                self.segments += 1
+            end = start
+            size = self._size
+            while end < len(lines) and size < self.segment_bytes:
+                size += len(lines[end])
+                end += 1
+            self._file.write(b''.join(lines[start:end]))
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            self._size = size
+            start = end
+            if self._size >= self.segment_bytes:
+                self._close_segment()
+
+    def _close_segment(self):
+        """关闭当前段并压缩"""
+        if self._file is None:
+            return
+        self._file.close()
+        self._file = None
+        try:
+            with open(self._path, 'rb') as src, gzip.open(self._path + '.gz.tmp', 'wb') as dst:
+                shutil.copyfileobj(src, dst)
+            os.replace(self._path + '.gz.tmp', self._path + '.gz')
+            os.remove(self._path)
+        except OSError:
+            # 压缩失败时保留未压缩的段，读取时同样支持
+            self.write_errors += 1
+
+    def close(self, timeout=5.0):
+        """写完队列中的记录，关闭并压缩当前段"""
+        thread = self._thread
+        if thread is None:
+            return
+        try:
+            self._queue.put(_STOP, timeout=timeout)
+        except queue.Full:
+            return
+        thread.join(timeout)
+        self._thread = None
+
+    def stats(self):
+        return {'pending': self._queue.qsize(), 'written': self.written, 'dropped': self.dropped,
+                'backpressured': self.backpressured, 'segments': self.segments,
+                'write_errors': self.write_errors}
+
+
+def read_records(directory=None):
+    """按段文件名(开始时间)顺序读取审计记录，支持压缩和未压缩的段
+    Args:
+        directory: str, 日志目录，默认见default_directory
+    Yields:
+        dict: 审计记录
+    """
+    directory = directory or default_directory()
+    paths = glob.glob(os.path.join(directory, 'audit-*.log')) + \
+        glob.glob(os.path.join(directory, 'audit-*.log.gz'))
+    for path in sorted(paths):
+        opener = gzip.open if path.endswith('.gz') else open
+        try:
+            with opener(path, 'rb') as f:
+                for line in f:
+                    try:
+                        yield loads(line)
+                    except ValueError:
+                        # 进程崩溃时可能留下写了一半的最后一行
+                        continue
+        except (OSError, EOFError):
+            continue
+
+
+def order_timelines(records, third_order_id=None):
+    """从审计记录重建订单时间线
+    Args:
+        records: 可迭代的审计记录(见read_records)
+        third_order_id: str, 只重建该订单，不传则重建所有订单
+    Returns:
+        dict: {third_order_id: 时间线}，时间线包含下单结果、状态变化(连续相同的状态只保留首次)、
+            上游调用次数和失败次数
+    """
+    timelines = {}
+    for record in sorted((r for r in records if r.get('third_order_id')), key=lambda r: r.get('ts', 0)):
+        order_id = record['third_order_id']
+        if third_order_id is not None and order_id != third_order_id:
+            continue
+        timeline = timelines.get(order_id)
+        if timeline is None:
+            timeline = timelines[order_id] = {
+                'third_order_id': order_id, 'phone': record.get('params', {}).get('phone'),
+                'commits': [], 'statuses': [], 'final_status': None, 'calls': 0, 'errors': 0}
+        timeline['calls'] += 1
+        if record.get('code') != '0':
+            timeline['errors'] += 1
+        if record.get('endpoint') == '/order/commit':
+            timeline['phone'] = timeline['phone'] or record.get('params', {}).get('phone')
+            timeline['commits'].append({'ts': record['ts'], 'code': record.get('code'),
+                                        'message': record.get('message'), 'order_id': record.get('order_id')})
+        status = record.get('order_status')
+        if status is not None and status != timeline['final_status']:
+            timeline['statuses'].append({'ts': record['ts'], 'status': status,
+                                         'status_desc': get_order_status_desc(_to_int(status))})
+            timeline['final_status'] = status
+    return timelines
+
+
+def _to_int(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return value
+
+
+def test_audit_log():
+    """测试批量写入、分段压缩、背压和时间线重建"""
+    import tempfile
+
+    directory = tempfile.mkdtemp(prefix='edj_audit_')
+    audit = AuditLog(directory, segment_bytes=4096)
+    phone = '13800138000'
+    for n in range(40):
+        audit.record('/order/costestimateV2', {'token': 'secret-token', 'phone': phone, 'sig': 'x',
+                                               'start_latitude': 40.0 + n},
+                     {'code': '0', 'data': {'fee': 39.0 + n}}, 0.012)
+    audit.record('/order/commit', {'phone': phone, 'token': 't', 'third_order_id': 'T1'},
+                 {'code': '0', 'data': {'order_id': '9001'}}, 0.05)
+    for status in (102, 102, 180, 301, 301, 304):
+        audit.record('/order/polling', {'token': 't', 'third_order_id': 'T1'},
+                     {'code': '0', 'data': {'order_status': status}}, 0.01)
+    audit.record('/order/polling', {'token': 't', 'third_order_id': 'T1'}, {'code': '-1', 'message': 'x'}, 1.0)
+    audit.close()
+
+    segments = sorted(os.listdir(directory))
+    assert len(segments) > 1 and all(name.endswith('.log.gz') for name in segments), segments
+    records = list(read_records(directory))
+    assert len(records) == 48 and audit.written == 48 and audit.dropped == 0
+    assert records[0]['params']['token'] == '***' and records[0]['params']['phone'] == '138****8000'
+    assert 'sig' not in records[0]['params'] and records[0]['fee'] == 39.0
+
+    timeline = order_timelines(records, 'T1')['T1']
+    assert [s['status'] for s in timeline['statuses']] == [102, 180, 301, 304]
+    assert timeline['commits'][0]['order_id'] == '9001' and timeline['phone'] == '138****8000'
+    assert timeline['calls'] == 8 and timeline['errors'] == 1
+
+    # 写入线程跟不上时，异步调用最多等待max_wait后丢弃，不会一直阻塞
+    slow = AuditLog(tempfile.mkdtemp(prefix='edj_audit_'), max_pending=5, max_wait=0.05)
+    gate = threading.Event()
+    slow._write = lambda lines: gate.wait()
+    slow.record('/order/polling', {}, {'code': '0'}, 0.01)
+    while slow._queue.qsize():
+        time.sleep(0.001)
+
+    async def flood():
+        start = time.monotonic()
+        results = [await slow.arecord('/order/polling', {}, {'code': '0'}, 0.01) for _ in range(10)]
+        return results, time.monotonic() - start
+
+    results, elapsed = asyncio.run(flood())
+    assert results == [True] * 5 + [False] * 5, results
+    assert slow.dropped == 5 and slow.backpressured == 5
+    assert elapsed < 0.05 * 10 + 0.5
+    gate.set()
+    slow.close()
+    print('审计日志验证通过!', audit.stats())
+
+
+def main():
+    parser = argparse.ArgumentParser(description='从审计日志重建订单时间线')
+    parser.add_argument('--dir', default=None, help='审计日志目录，默认EDJ_AUDIT_LOG或EDJ_STATE_DIR/audit')
+    parser.add_argument('--order', default=None, help='只输出该第三方订单号的时间线')
+    parser.add_argument('--self-test', action='store_true', help='运行自测后退出')
+    args = parser.parse_args()
+
+    if args.self_test:
+        test_audit_log()
+        return
+    directory = args.dir
+    if directory is None and os.getenv('EDJ_AUDIT_LOG', '') not in ('', '0', 'false', 'False'):
+        directory = os.getenv('EDJ_AUDIT_LOG')
+    for timeline in order_timelines(read_records(directory), args.order).values():
+        print(dumps(timeline))
+
+
+# 导出类供外部使用
+__all__ = ['AuditLog', 'default_directory', 'order_timelines', 'read_records']
+
+if __name__ == '__main__':
+    main()
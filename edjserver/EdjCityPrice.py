@@ -0,0 +1,416 @@
+"""城市价格表与本地计费
+
+get_city_price_list返回的价格表按时段给出起步价、起步里程和超出部分的单价，CityPriceTable据此
+在本地估算费用(预览、预估矩阵超时时的近似值)，CityPriceIndex按城市缓存价格表:
+- 同一城市的并发加载只请求一次上游，后台定期刷新
+- 返回过未开通的城市由服务区域索引在本地拒绝，不再请求上游
+
+价格表条目的字段名尚未与真实返回核对，PriceRule按几组候选字段名解析。本地计费与上游预估的误差
+需要用从上游采集的真实价格表和costestimateV2返回校验(validate_fares):
+    python -m edjserver.EdjCityPrice prices.json records.jsonl
+
+fixtures目录中的synthetic_*是手写的合成样本，字段名取自上述候选，只用于自测解析和计费逻辑，
+不能说明本地计费与上游的误差。
+"""
+import asyncio
+import json
+import math
+import os
+import sys
+import time
+from datetime import datetime
+
+from .EdjGeo import haversine_km
+
+
+def _pick(item, names, default=None):
+    """按候选字段名依次取值(价格表字段名未与真实返回核对，兼容几种常见命名)"""
+    for name in names:
+        value = item.get(name)
+        if value not in (None, ''):
+            return value
+    return default
+
+
+def _to_float(value, default=0.0):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return default
+
+
+def _parse_minute(value, default):
+    """解析"07:00"格式的时间为当天分钟数"""
+    if value in (None, ''):
+        return default
+    try:
+        hour, _, minute = str(value).partition(':')
+        return int(hour) * 60 + int(minute or 0)
+    except ValueError:
+        return default
+
+
+class PriceRule:
+    """单个时段的计价规则: 起步价含base_distance公里，超出部分每unit_distance公里加收unit_price"""
+    __slots__ = ('start_minute', 'end_minute', 'base_price', 'base_distance',
+                 'unit_price', 'unit_distance')
+
+    def __init__(self, start_minute, end_minute, base_price, base_distance, unit_price, unit_distance):
+        self.start_minute = start_minute
+        self.end_minute = end_minute
+        self.base_price = base_price
+        self.base_distance = base_distance
+        self.unit_price = unit_price
+        self.unit_distance = unit_distance
+
+    @classmethod
+    def from_item(cls, item):
+        """从价格表中的一项构建规则，缺少起步价时返回None"""
+        base_price = _to_float(_pick(item, ('start_price', 'base_price', 'startPrice', 'price')), None)
+        if base_price is None:
+            return None
+        return cls(
+            _parse_minute(_pick(item, ('start_time', 'startTime', 'begin_time')), 0),
+            _parse_minute(_pick(item, ('end_time', 'endTime')), 24 * 60),
+            base_price,
+            _to_float(_pick(item, ('start_distance', 'base_distance', 'distance', 'startDistance'))),
+            _to_float(_pick(item, ('unit_price', 'next_price', 'over_price', 'extra_price', 'unitPrice'))),
+            _to_float(_pick(item, ('unit_distance', 'next_distance', 'over_distance', 'unitDistance')), 1.0) or 1.0
+        )
+
+    def covers(self, minute):
+        if self.start_minute <= self.end_minute:
+            return self.start_minute <= minute < self.end_minute
+        # 跨零点的时段，例如22:00-07:00
+        return minute >= self.start_minute or minute < self.end_minute
+
+    def fare(self, distance_km):
+        extra = max(0.0, distance_km - self.base_distance)
+        return self.base_price + math.ceil(extra / self.unit_distance) * self.unit_price
+
+    def to_dict(self):
+        return {
+            'start_time': f"{self.start_minute // 60:02d}:{self.start_minute % 60:02d}",
+            'end_time': f"{self.end_minute // 60:02d}:{self.end_minute % 60:02d}",
+            'base_price': self.base_price,
+            'base_distance': self.base_distance,
+            'unit_price': self.unit_price,
+            'unit_distance': self.unit_distance
+        }
+
+
+class CityPriceTable:
+    """单个城市的价格表及本地计费"""
+
+    # 无合作方预估距离时，用直线距离乘以该系数近似道路距离
+    ROAD_FACTOR = 1.3
+
+    def __init__(self, city_name, response, longitude=None, latitude=None, fetched_at=None):
+        """
+        Args:
+            city_name: str, 城市名
+            response: dict, get_city_price_list的接口返回结果
+            longitude: float, 拉取价格表时使用的经度(用于后台刷新)
+            latitude: float, 拉取价格表时使用的纬度(用于后台刷新)
+            fetched_at: float, 拉取时间戳
+        """
+        self.city_name = city_name
+        self.response = response
+        self.longitude = longitude
+        self.latitude = latitude
+        self.fetched_at = fetched_at or time.time()
+        self.rules = [rule for rule in map(PriceRule.from_item, self._items(response.get('data')))
+                      if rule is not None]
+
+    @staticmethod
+    def _items(data):
+        if isinstance(data, list):
+            return [item for item in data if isinstance(item, dict)]
+        if isinstance(data, dict):
+            for key in ('price_list', 'priceList', 'list', 'prices'):
+                if isinstance(data.get(key), list):
+                    return [item for item in data[key] if isinstance(item, dict)]
+        return []
+
+    def rule_at(self, departure=None):
+        """按出发时间选取计价规则"""
+        if not self.rules:
+            return None
+        departure = departure or datetime.now()
+        minute = departure.hour * 60 + departure.minute
+        for rule in self.rules:
+            if rule.covers(minute):
+                return rule
+        return self.rules[0]
+
+    def estimate(self, start_latitude, start_longitude, end_latitude, end_longitude,
+                 estimate_distance=None, departure=None):
+        """本地估算费用(不请求上游)
+        Args:
+            estimate_distance: int, 合作方预估距离(米)，不传则按直线距离乘以ROAD_FACTOR
+            departure: datetime, 出发时间，不传则为当前时间
+        Returns:
+            dict: 估算结果，价格表无可用规则时返回None
+        """
+        rule = self.rule_at(departure)
+        if rule is None:
+            return None
+        if estimate_distance is not None:
+            distance_km = estimate_distance / 1000.0
+        else:
+            distance_km = haversine_km(start_latitude, start_longitude,
+                                       end_latitude, end_longitude) * self.ROAD_FACTOR
+        return {
+            'city_name': self.city_name,
+            'distance_km': round(distance_km, 2),
+            'fee': rule.fare(distance_km),
+            'rule': rule.to_dict(),
+            'price_fetched_at': self.fetched_at
+        }
+
+
+class CityPriceIndex:
+    """城市价格表索引
+
+    - 按城市懒加载，同一城市的并发加载只请求一次上游
+    - warmup预先加载常用城市
+    - 后台任务定期刷新超过refresh_interval的价格表
+    """
+
+    DEFAULT_REFRESH_INTERVAL = 3600
+
+    def __init__(self, api, refresh_interval=None):
+        """
+        Args:
+            api: AsyncEdjApi, 用于拉取价格表
+            refresh_interval: float, 价格表刷新间隔(秒)，默认读取EDJ_PRICE_REFRESH_INTERVAL
+        """
+        self.api = api
+        self.refresh_interval = refresh_interval or float(
+            os.getenv('EDJ_PRICE_REFRESH_INTERVAL', self.DEFAULT_REFRESH_INTERVAL))
+        self._tables = {}
+        self._loading = {}
+        self._refresh_task = None
+        self.loads = 0
+        self.hits = 0
+
+    def cached(self, city_name):
+        """返回已缓存的价格表，不触发加载"""
+        return self._tables.get(city_name)
+
+    async def get(self, city_name, longitude, latitude, force=False):
+        """获取城市价格表
+        Args:
+            city_name: str, 城市名
+            longitude: float, 经度
+            latitude: float, 纬度
+            force: bool, 是否忽略缓存重新拉取
+        Returns:
+            tuple: (CityPriceTable或None, 接口返回结果)
+        """
+        table = self._tables.get(city_name)
+        if table is not None and not force:
+            self.hits += 1
+            return table, table.response
+
+        # 最近返回过未开通的城市在本地拒绝，不请求上游
+        rejected = self.api.precheck_city(city_name)
+        if rejected is not None:
+            return None, rejected
+
+        task = self._loading.get(city_name)
+        if task is None:
+            task = asyncio.ensure_future(self._load(city_name, longitude, latitude))
+            self._loading[city_name] = task
+            task.add_done_callback(lambda _: self._loading.pop(city_name, None))
+        return await asyncio.shield(task)
+
+    async def _load(self, city_name, longitude, latitude):
+        self.loads += 1
+        response = await self.api.get_city_price_list(longitude, latitude, city_name)
+        if response.get('code') != '0':
+            return None, response
+        table = CityPriceTable(city_name, response, longitude, latitude)
+        self._tables[city_name] = table
+        return table, response
+
+    async def warmup(self, cities):
+        """预加载城市价格表
+        Args:
+            cities: list, [(city_name, longitude, latitude), ...]
+        """
+        await asyncio.gather(*(self.get(name, lon, lat, force=True) for name, lon, lat in cities),
+                             return_exceptions=True)
+
+    @staticmethod
+    def warmup_cities_from_env():
+        """解析EDJ_PRICE_WARMUP_CITIES，格式: 北京:116.407526:39.904030,上海:121.473701:31.230416"""
+        cities = []
+        for item in os.getenv('EDJ_PRICE_WARMUP_CITIES', '').split(','):
+            parts = item.strip().split(':')
+            if len(parts) == 3:
+                cities.append((parts[0], float(parts[1]), float(parts[2])))
+        return cities
+
+    def start_refresh(self):
+        """在当前事件循环中启动后台预热和定时刷新(重复调用无副作用)"""
+        if self._refresh_task is None or self._refresh_task.done():
+            self._refresh_task = asyncio.ensure_future(self._refresh_loop())
+
+    async def _refresh_loop(self):
+        await self.warmup(self.warmup_cities_from_env())
+        while True:
+            await asyncio.sleep(max(1.0, self.refresh_interval / 4))
+            now = time.time()
+            stale = [(t.city_name, t.longitude, t.latitude) for t in list(self._tables.values())
+                     if now - t.fetched_at >= self.refresh_interval]
+            if stale:
+                await self.warmup(stale)
+
+    def stats(self):
+        return {'cities': len(self._tables), 'loads': self.loads, 'hits': self.hits}
+
+
+def _upstream_fee(response):
+    """从costestimateV2返回结果中取预估费用，字段与EstimateResult.fee一致(data.fee)"""
+    data = response.get('data')
+    if not isinstance(data, dict):
+        return None
+    return _to_float(data.get('fee'), None)
+
+
+def validate_fares(tables, records):
+    """用上游costestimateV2的返回校验本地计费
+    Args:
+        tables: dict, {city_name: CityPriceTable}
+        records: list, 每项包含 city_name、start_latitude、start_longitude、end_latitude、
+            end_longitude、response(costestimateV2返回结果)，可选 estimate_distance(米)、
+            departure("%Y-%m-%d %H:%M:%S")
+    Returns:
+        dict: 样本数、平均绝对误差、平均相对误差、最大绝对误差
+    """
+    errors = []
+    ratios = []
+    skipped = 0
+    for record in records:
+        table = tables.get(record.get('city_name'))
+        expected = _upstream_fee(record.get('response') or {})
+        if table is None or expected is None:
+            skipped += 1
+            continue
+        departure = record.get('departure')
+        local = table.estimate(
+            float(record['start_latitude']), float(record['start_longitude']),
+            float(record['end_latitude']), float(record['end_longitude']),
+            estimate_distance=record.get('estimate_distance'),
+            departure=datetime.strptime(departure, "%Y-%m-%d %H:%M:%S") if departure else None
+        )
+        if local is None:
+            skipped += 1
+            continue
+        error = abs(local['fee'] - expected)
+        errors.append(error)
+        if expected:
+            ratios.append(error / expected)
+    return {
+        'samples': len(errors),
+        'skipped': skipped,
+        'mean_abs_error': sum(errors) / len(errors) if errors else None,
+        'mean_abs_pct_error': sum(ratios) / len(ratios) if ratios else None,
+        'max_abs_error': max(errors) if errors else None
+    }
+
+
+FIXTURE_DIR = os.path.join(os.path.dirname(__file__), 'fixtures')
+
+
+def load_fixtures(prices_path, records_path):
+    """读取价格表和预估样本
+    Args:
+        prices_path: str, JSON文件，{城市名: get_city_price_list返回结果}
+        records_path: str, JSONL文件，每行一条预估样本(格式见validate_fares)
+    Returns:
+        tuple: ({city_name: CityPriceTable}, 预估样本列表)
+    """
+    with open(prices_path, encoding='utf-8') as f:
+        tables = {city: CityPriceTable(city, response) for city, response in json.load(f).items()}
+    with open(records_path, encoding='utf-8') as f:
+        records = [json.loads(line) for line in f if line.strip()]
+    return tables, records
+
+
+def test_city_price():
+    """用合成样本测试价格表字段解析、跨零点时段、计费误差统计和并发加载只请求一次
+
+    合成样本的费用按价格表手算，只验证解析和计费逻辑自洽，不代表与上游的误差
+    """
+    tables, records = load_fixtures(os.path.join(FIXTURE_DIR, 'synthetic_city_price_list.json'),
+                                    os.path.join(FIXTURE_DIR, 'synthetic_costestimate.jsonl'))
+
+    # 候选字段名中的驼峰/下划线命名和两种data结构(priceList/列表)都能解析
+    day, night = tables['北京'].rules
+    assert (day.start_minute, day.end_minute, day.base_price, day.unit_distance) == (420, 1320, 39.0, 5.0)
+    assert (night.start_minute, night.end_minute, night.base_price, night.unit_price) == (1320, 420, 59.0, 20.0)
+    (rule,) = tables['上海'].rules
+    assert (rule.start_minute, rule.end_minute, rule.base_distance, rule.unit_price) == (0, 1440, 8.0, 15.0)
+
+    # 跨零点的夜间时段: 22:00-07:00(不含07:00)
+    table = tables['北京']
+    for hour, minute, expected in ((21, 59, day), (22, 0, night), (23, 30, night), (3, 0, night),
+                                   (6, 59, night), (7, 0, day)):
+        assert table.rule_at(datetime(2026, 3, 2, hour, minute)) is expected, (hour, minute)
+
+    # 带合作方预估距离的样本与手算费用一致；按直线距离估算的样本误差不超过一个计费单位
+    report = validate_fares(tables, records)
+    assert report['samples'] == 6 and report['skipped'] == 2, report
+    assert report['max_abs_error'] <= 15.0 and report['mean_abs_error'] <= 2.5, report
+    assert report['mean_abs_pct_error'] < 0.02, report
+    exact = [r for r in records if r.get('estimate_distance') and r['city_name'] in tables]
+    assert validate_fares(tables, exact)['max_abs_error'] == 0
+
+    class FakeApi:
+        calls = 0
+
+        def precheck_city(self, city_name):
+            return None
+
+        async def get_city_price_list(self, longitude, latitude, city_name):
+            FakeApi.calls += 1
+            await asyncio.sleep(0.05)
+            return tables[city_name].response
+
+    async def run():
+        index = CityPriceIndex(FakeApi(), refresh_interval=3600)
+        results = await asyncio.gather(*(index.get('北京', 116.407526, 39.904030) for _ in range(10)))
+        assert FakeApi.calls == 1 and index.loads == 1
+        assert all(table is results[0][0] for table, _ in results) and not index._loading
+        table, _ = await index.get('北京', 116.407526, 39.904030)
+        assert table is results[0][0] and index.hits == 1 and FakeApi.calls == 1
+        await index.get('北京', 116.407526, 39.904030, force=True)
+        assert FakeApi.calls == 2
+
+    asyncio.run(run())
+    print('城市价格表验证通过!', report)
+
+
+def main(argv):
+    """命令行校验: python -m edjserver.EdjCityPrice prices.json records.jsonl
+
+    prices.json为{城市名: get_city_price_list返回结果}，records.jsonl每行一条上游预估样本；
+    --self-test 使用fixtures目录中的合成样本运行自测
+    """
+    if argv == ['--self-test']:
+        test_city_price()
+        return 0
+    if len(argv) != 2:
+        print(main.__doc__)
+        return 2
+    print(json.dumps(validate_fares(*load_fixtures(*argv)), ensure_ascii=False, indent=2))
+    return 0
+
+
+# 导出类供外部使用
+__all__ = ['PriceRule', 'CityPriceTable', 'CityPriceIndex', 'load_fixtures', 'validate_fares']
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
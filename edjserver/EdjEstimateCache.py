@@ -0,0 +1,143 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+
+_BASE32 = '0123456789bcdefghjkmnpqrstuvwxyz'
+
+
+def geohash_encode(latitude, longitude, precision):
+    """计算经纬度的geohash
+    Args:
+        latitude: float, 纬度
+        longitude: float, 经度
+        precision: int, geohash长度，7约为150米网格，8约为40米x20米网格
+    Returns:
+        str: geohash字符串
+    """
+    lat_lo, lat_hi = -90.0, 90.0
+    lon_lo, lon_hi = -180.0, 180.0
+    chars = []
+    bits = 0
+    bit_count = 0
+    even = True
+    while len(chars) < precision:
+        if even:
+            mid = (lon_lo + lon_hi) / 2
+            if longitude >= mid:
+                bits = (bits << 1) | 1
+                lon_lo = mid
+            else:
+                bits <<= 1
+                lon_hi = mid
+        else:
+            mid = (lat_lo + lat_hi) / 2
+            if latitude >= mid:
+                bits = (bits << 1) | 1
+                lat_lo = mid
+            else:
+                bits <<= 1
+                lat_hi = mid
+        even = not even
+        bit_count += 1
+        if bit_count == 5:
+            chars.append(_BASE32[bits])
+            bits = 0
+            bit_count = 0
+    return ''.join(chars)
+
+
+class EdjEstimateCache:
+    """预估费用短时缓存
+
+    起终点坐标按geohash网格量化后与token、渠道、优惠券/权益参数一起作为键，
+    挪动几米重新预估时直接返回缓存结果。只缓存成功(code为'0')的响应，
+    超过ttl的条目视为失效，条目数超过max_size时淘汰最久未使用的。
+    动态调价变化快，ttl和网格精度需按部署情况调整。
+    """
+
+    DEFAULT_PRECISION = 7
+    DEFAULT_MAX_SIZE = 10000
+
+    # 参与缓存键的业务参数(坐标以外)
+    KEY_FIELDS = ('token', 'channel', 'long_distance_adjust_fee', 'bonus_sn', 'strategyId',
+                  'is_use_bonus', 'estimate_distance', 'estimate_duration')
+
+    def __init__(self, ttl, precision=None, max_size=None):
+        """
+        Args:
+            ttl: float, 缓存有效期(秒)
+            precision: int, geohash精度，默认7
+            max_size: int, 最多缓存条目数，默认10000
+        """
+        self.ttl = ttl
+        self.precision = precision or self.DEFAULT_PRECISION
+        self.max_size = max_size or self.DEFAULT_MAX_SIZE
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @classmethod
+    def from_env(cls):
+        """按环境变量创建缓存，EDJ_ESTIMATE_CACHE_TTL未设置或为0时返回None(不启用)"""
+        ttl = float(os.getenv('EDJ_ESTIMATE_CACHE_TTL', '0') or 0)
+        if ttl <= 0:
+            return None
+        precision = int(os.getenv('EDJ_ESTIMATE_CACHE_PRECISION', cls.DEFAULT_PRECISION))
+        max_size = int(os.getenv('EDJ_ESTIMATE_CACHE_SIZE', cls.DEFAULT_MAX_SIZE))
+        return cls(ttl, precision, max_size)
+
+    def make_key(self, params):
+        """根据业务参数生成缓存键
+        Args:
+            params: dict, get_cost_estimate_v2的业务参数(未签名)
+        Returns:
+            tuple: 缓存键
+        """
+        start = geohash_encode(float(params['start_latitude']), float(params['start_longitude']),
+                               self.precision)
+        end = geohash_encode(float(params['end_latitude']), float(params['end_longitude']),
+                             self.precision)
+        return (start, end) + tuple(params.get(field) for field in self.KEY_FIELDS)
+
+    def get(self, key):
+        """获取缓存的响应，返回带from_cache标记的副本，未命中返回None"""
+        now = time.monotonic()
+        with self._lock:
+            item = self._entries.get(key)
+            if item is not None:
+                expires_at, response = item
+                if expires_at > now:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    cached = response.copy()
+                    cached['from_cache'] = True
+                    return cached
+                del self._entries[key]
+            self.misses += 1
+        return None
+
+    def put(self, key, response):
+        """缓存成功的响应"""
+        if response.get('code') != '0':
+            return
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, response)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        """缓存统计信息"""
+        with self._lock:
+            size = len(self._entries)
+        return {'size': size, 'hits': self.hits, 'misses': self.misses}
+
+
+# 导出类供外部使用
+__all__ = ['EdjEstimateCache', 'geohash_encode']
@@ -0,0 +1,428 @@
+"""地理计算和服务区域预校验
+
+预估和下单前在本地检查坐标，注定失败的请求不再发往上游:
+- 坐标不是有效数值、超出经纬度范围、经纬度颠倒、起终点几乎重合；配置了服务范围(EDJ_GEO_BOUNDS)时
+  范围外的坐标返回本地返回码OUT_OF_BOUNDS_CODE(不是上游的code 12，上游未给出过该结论)
+- 服务区域网格索引: 由城市价格表拉取结果(code 0为开通、code 12为未开通)和预估/下单
+  接口返回的code 12(城市未开通)、code 11(附近暂无空闲司机)逐步建立，命中未开通网格的
+  请求直接返回相同的返回码。网格在closed_ttl内收到closed_threshold次code 12才记为未开通，
+  同一网格的预估或下单成功时立即恢复；未开通记录在closed_ttl后失效，无司机记录只保留no_driver_ttl
+"""
+import math
+import os
+import threading
+import time
+
+EARTH_RADIUS_KM = 6371.0088
+
+# 中国境内的大致经纬度边界: (最小纬度, 最大纬度, 最小经度, 最大经度)，可作为ServiceArea的bounds
+SERVICE_BOUNDS = (18.0, 54.0, 73.0, 135.0)
+
+# 坐标不在配置的服务范围内时的本地返回码
+OUT_OF_BOUNDS_CODE = '-5'
+
+
+def haversine_km(start_latitude, start_longitude, end_latitude, end_longitude):
+    """计算两点间球面距离
+    Args:
+        start_latitude: float, 起点纬度
+        start_longitude: float, 起点经度
+        end_latitude: float, 终点纬度
+        end_longitude: float, 终点经度
+    Returns:
+        float: 距离(公里)
+    """
+    lat1 = math.radians(start_latitude)
+    lat2 = math.radians(end_latitude)
+    dlat = lat2 - lat1
+    dlon = math.radians(end_longitude - start_longitude)
+    a = math.sin(dlat / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin(dlon / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(math.sqrt(a))
+
+
+def haversine_many(routes):
+    """批量计算起终点球面距离，结果与haversine_km一致
+    Args:
+        routes: list, [(start_latitude, start_longitude, end_latitude, end_longitude), ...]
+    Returns:
+        list: 距离(公里)
+    """
+    radians, sin, cos, asin, sqrt = math.radians, math.sin, math.cos, math.asin, math.sqrt
+    diameter = 2 * EARTH_RADIUS_KM
+    distances = []
+    for lat1, lon1, lat2, lon2 in routes:
+        lat1 = radians(lat1)
+        lat2 = radians(lat2)
+        a = sin((lat2 - lat1) / 2) ** 2 + cos(lat1) * cos(lat2) * sin(radians(lon2 - lon1) / 2) ** 2
+        distances.append(diameter * asin(sqrt(a)))
+    return distances
+
+
+def _in_bounds(latitude, longitude, bounds):
+    min_lat, max_lat, min_lon, max_lon = bounds
+    return min_lat <= latitude <= max_lat and min_lon <= longitude <= max_lon
+
+
+def check_point(latitude, longitude, name='坐标', bounds=None):
+    """检查单个坐标
+    Args:
+        latitude: float, 纬度
+        longitude: float, 经度
+        name: str, 错误信息中的坐标名称，例如: 起点
+        bounds: tuple, 服务范围(最小纬度, 最大纬度, 最小经度, 最大经度)，不传则不检查
+    Returns:
+        tuple: 不通过时返回(返回码, 错误信息)，通过返回None
+    """
+    try:
+        latitude = float(latitude)
+        longitude = float(longitude)
+    except (TypeError, ValueError):
+        return '8', f"{name}经纬度不是有效数值"
+    if not (math.isfinite(latitude) and math.isfinite(longitude)):
+        return '8', f"{name}经纬度不是有效数值"
+    if not (-90 <= latitude <= 90 and -180 <= longitude <= 180):
+        if -90 <= longitude <= 90 and -180 <= latitude <= 180:
+            return '8', f"{name}经纬度可能颠倒(纬度{latitude}，经度{longitude})"
+        return '8', f"{name}经纬度超出范围"
+    if bounds is not None and not _in_bounds(latitude, longitude, bounds):
+        if _in_bounds(longitude, latitude, bounds):
+            return '8', f"{name}经纬度可能颠倒(纬度{latitude}，经度{longitude})"
+        return OUT_OF_BOUNDS_CODE, f"{name}不在服务范围内"
+    return None
+
+
+class ServiceArea:
+    """服务区域预校验和网格索引
+
+    网格按经纬度划分(默认0.1度，约11公里)。城市价格表拉取成功时，把拉取坐标周围
+    served_radius_km内的网格记为该城市；预估或下单在closed_ttl内返回closed_threshold次code 12时
+    把起点所在网格记为未开通(索引由各租户共用，单次异常返回不影响其他请求)，该网格的预估或下单
+    返回成功时清除；价格表返回code 12时把城市名记为未开通。code 11(附近暂无空闲司机)按更细的网格
+    (默认0.01度，约1公里)短时记录，只用于拦截下单。
+    """
+
+    DEFAULT_CELL_DEGREES = 0.1
+    DEFAULT_DRIVER_CELL_DEGREES = 0.01
+    DEFAULT_SERVED_RADIUS_KM = 50.0
+    DEFAULT_CLOSED_TTL = 600
+    DEFAULT_CLOSED_THRESHOLD = 3
+    DEFAULT_NO_DRIVER_TTL = 30
+    DEFAULT_MIN_TRIP_METERS = 50
+    # 未达到阈值的网格计数最多保留的条数，超过时清理过期条目
+    MAX_PENDING_CELLS = 10000
+
+    # 返回起点位置相关结果的接口(按start_latitude/start_longitude记录)
+    ROUTE_ENDPOINTS = ('/order/costestimateV2', '/order/commit')
+
+    def __init__(self, closed_ttl=None, no_driver_ttl=None, min_trip_meters=None,
+                 cell_degrees=None, served_radius_km=None, bounds=None, closed_threshold=None):
+        """
+        Args:
+            closed_ttl: float, 未开通记录的有效期(秒)，默认10分钟，同时是累计code 12次数的时间窗口
+            no_driver_ttl: float, 无空闲司机记录的有效期(秒)，默认30秒，0表示不记录
+            min_trip_meters: float, 起终点最小直线距离(米)，默认50
+            cell_degrees: float, 网格边长(度)，默认0.1
+            served_radius_km: float, 价格表拉取坐标周围记为开通的半径(公里)，默认50
+            bounds: tuple, 服务范围(最小纬度, 最大纬度, 最小经度, 最大经度)，默认不限制
+            closed_threshold: int, 网格记为未开通所需的code 12次数，默认3
+        """
+        self.closed_ttl = self.DEFAULT_CLOSED_TTL if closed_ttl is None else closed_ttl
+        self.closed_threshold = int(closed_threshold or self.DEFAULT_CLOSED_THRESHOLD)
+        self.no_driver_ttl = self.DEFAULT_NO_DRIVER_TTL if no_driver_ttl is None else no_driver_ttl
+        self.min_trip_km = (self.DEFAULT_MIN_TRIP_METERS if min_trip_meters is None
+                            else min_trip_meters) / 1000.0
+        self.cell_degrees = cell_degrees or self.DEFAULT_CELL_DEGREES
+        self.served_radius_km = served_radius_km or self.DEFAULT_SERVED_RADIUS_KM
+        self.bounds = tuple(bounds) if bounds else None
+        self._served = {}
+        self._closed = {}
+        # 尚未达到阈值的网格: {cell: (code 12次数, 首次返回时间)}
+        self._closed_hits = {}
+        self._closed_cities = {}
+        self._no_driver = {}
+        self._lock = threading.Lock()
+        self.checks = 0
+        self.rejected = {}
+
+    @classmethod
+    def from_env(cls):
+        """按环境变量创建，EDJ_GEO_CHECK=0时返回None(不启用)"""
+        if os.getenv('EDJ_GEO_CHECK', '1') == '0':
+            return None
+
+        def number(name):
+            value = os.getenv(name, '')
+            return float(value) if value else None
+
+        # 服务范围格式: 最小纬度,最大纬度,最小经度,最大经度，例如 18,54,73,135
+        bounds = os.getenv('EDJ_GEO_BOUNDS', '')
+        bounds = tuple(float(value) for value in bounds.split(',')) if bounds else None
+        if bounds is not None and len(bounds) != 4:
+            raise ValueError("EDJ_GEO_BOUNDS格式应为: 最小纬度,最大纬度,最小经度,最大经度")
+        return cls(closed_ttl=number('EDJ_GEO_CLOSED_TTL'), no_driver_ttl=number('EDJ_GEO_NO_DRIVER_TTL'),
+                   min_trip_meters=number('EDJ_GEO_MIN_TRIP_METERS'), bounds=bounds,
+                   closed_threshold=number('EDJ_GEO_CLOSED_THRESHOLD'))
+
+    def _cell(self, latitude, longitude, size=None):
+        size = size or self.cell_degrees
+        return math.floor(latitude / size), math.floor(longitude / size)
+
+    def check_route(self, start_latitude, start_longitude, end_latitude, end_longitude, order=False):
+        """检查一条路线
+        Args:
+            start_latitude: float, 起点纬度
+            start_longitude: float, 起点经度
+            end_latitude: float, 终点纬度
+            end_longitude: float, 终点经度
+            order: bool, 是否为下单(额外检查起点附近是否刚返回过无空闲司机)
+        Returns:
+            tuple: 不通过时返回(返回码, 错误信息)，通过返回None
+        """
+        return self.check_routes([(start_latitude, start_longitude, end_latitude, end_longitude)],
+                                 order)[0]
+
+    def check_routes(self, routes, order=False):
+        """批量检查路线，先逐点检查坐标，再一次计算所有路线的距离并查询网格索引
+        Args:
+            routes: list, [(start_latitude, start_longitude, end_latitude, end_longitude), ...]
+            order: bool, 同check_route
+        Returns:
+            list: 与routes一一对应，每项为(返回码, 错误信息)或None
+        """
+        results = [None] * len(routes)
+        valid = []
+        for index, (start_lat, start_lon, end_lat, end_lon) in enumerate(routes):
+            rejection = (check_point(start_lat, start_lon, '起点', self.bounds)
+                         or check_point(end_lat, end_lon, '终点', self.bounds))
+            if rejection is None:
+                valid.append((index, (float(start_lat), float(start_lon), float(end_lat), float(end_lon))))
+            else:
+                results[index] = rejection
+        distances = haversine_many([route for _, route in valid])
+        now = time.monotonic()
+        with self._lock:
+            for (index, (start_lat, start_lon, _, _)), distance in zip(valid, distances):
+                if distance < self.min_trip_km:
+                    results[index] = ('8', f"起终点距离过近({distance * 1000:.0f}米)")
+                    continue
+                results[index] = self._lookup(start_lat, start_lon, order, now)
+            self.checks += len(routes)
+            for rejection in results:
+                if rejection is not None:
+                    self.rejected[rejection[0]] = self.rejected.get(rejection[0], 0) + 1
+        return results
+
+    def _lookup(self, latitude, longitude, order, now):
+        """查询网格索引(需持有锁)"""
+        cell = self._cell(latitude, longitude)
+        expires_at = self._closed.get(cell)
+        if expires_at is not None:
+            if expires_at > now:
+                return '12', '该城市未开通'
+            del self._closed[cell]
+        if order and self._no_driver:
+            driver_cell = self._cell(latitude, longitude, self.DEFAULT_DRIVER_CELL_DEGREES)
+            expires_at = self._no_driver.get(driver_cell)
+            if expires_at is not None:
+                if expires_at > now:
+                    return '11', '附近暂无空闲司机'
+                del self._no_driver[driver_cell]
+        return None
+
+    def check_city(self, city_name):
+        """城市名最近是否返回过未开通
+        Returns:
+            tuple: 未开通时返回('12', 错误信息)，否则返回None
+        """
+        with self._lock:
+            expires_at = self._closed_cities.get(city_name)
+            if expires_at is None:
+                return None
+            if expires_at <= time.monotonic():
+                del self._closed_cities[city_name]
+                return None
+            self.rejected['12'] = self.rejected.get('12', 0) + 1
+        return '12', f"{city_name}未开通"
+
+    def city_at(self, latitude, longitude):
+        """坐标所在网格对应的开通城市，未知时返回None"""
+        with self._lock:
+            return self._served.get(self._cell(latitude, longitude))
+
+    def mark_served(self, latitude, longitude, city_name):
+        """记录城市价格表拉取成功，拉取坐标周围的网格记为该城市，并清除城市和拉取坐标所在网格的未开通记录"""
+        size = self.cell_degrees
+        lat_steps = math.ceil(self.served_radius_km / 111.0 / size)
+        lon_steps = math.ceil(self.served_radius_km / (111.0 * max(math.cos(math.radians(latitude)), 0.01))
+                              / size)
+        center_lat, center_lon = self._cell(latitude, longitude)
+        with self._lock:
+            for dlat in range(-lat_steps, lat_steps + 1):
+                for dlon in range(-lon_steps, lon_steps + 1):
+                    cell = (center_lat + dlat, center_lon + dlon)
+                    cell_lat = (cell[0] + 0.5) * size
+                    cell_lon = (cell[1] + 0.5) * size
+                    if haversine_km(latitude, longitude, cell_lat, cell_lon) <= self.served_radius_km:
+                        self._served[cell] = city_name
+            self._closed.pop((center_lat, center_lon), None)
+            self._closed_cities.pop(city_name, None)
+
+    def mark_closed(self, latitude, longitude):
+        """记录坐标所在网格返回一次未开通，closed_ttl内累计closed_threshold次后记为未开通
+        Returns:
+            bool: 本次是否记为未开通
+        """
+        cell = self._cell(latitude, longitude)
+        now = time.monotonic()
+        with self._lock:
+            count, first_seen = self._closed_hits.get(cell, (0, now))
+            if now - first_seen >= self.closed_ttl:
+                count, first_seen = 0, now
+            count += 1
+            if count < self.closed_threshold:
+                if len(self._closed_hits) >= self.MAX_PENDING_CELLS:
+                    self._closed_hits = {key: value for key, value in self._closed_hits.items()
+                                         if now - value[1] < self.closed_ttl}
+                self._closed_hits[cell] = (count, first_seen)
+                return False
+            self._closed_hits.pop(cell, None)
+            self._closed[cell] = now + self.closed_ttl
+            return True
+
+    def mark_open(self, latitude, longitude):
+        """坐标所在网格的预估或下单成功，清除未开通记录和累计次数"""
+        cell = self._cell(latitude, longitude)
+        with self._lock:
+            self._closed.pop(cell, None)
+            self._closed_hits.pop(cell, None)
+
+    def mark_city_closed(self, city_name):
+        """记录城市名未开通"""
+        with self._lock:
+            self._closed_cities[city_name] = time.monotonic() + self.closed_ttl
+
+    def mark_no_driver(self, latitude, longitude):
+        """记录坐标附近暂无空闲司机"""
+        if self.no_driver_ttl <= 0:
+            return
+        cell = self._cell(latitude, longitude, self.DEFAULT_DRIVER_CELL_DEGREES)
+        with self._lock:
+            self._no_driver[cell] = time.monotonic() + self.no_driver_ttl
+
+    def observe(self, endpoint, params, response):
+        """根据上游返回结果更新索引
+        Args:
+            endpoint: str, 接口路径
+            params: dict, 请求参数
+            response: dict, 接口返回结果
+        """
+        code = response.get('code') if isinstance(response, dict) else None
+        if code not in ('0', '11', '12'):
+            return
+        try:
+            if endpoint == '/city/price/list':
+                if code == '0':
+                    self.mark_served(float(params['latitude']), float(params['longitude']),
+                                     params['city_name'])
+                elif code == '12':
+                    self.mark_city_closed(params['city_name'])
+            elif endpoint in self.ROUTE_ENDPOINTS:
+                latitude = float(params['start_latitude'])
+                longitude = float(params['start_longitude'])
+                if code == '12':
+                    self.mark_closed(latitude, longitude)
+                elif code == '0':
+                    if self._closed or self._closed_hits:
+                        self.mark_open(latitude, longitude)
+                elif code == '11':
+                    self.mark_no_driver(latitude, longitude)
+        except (KeyError, TypeError, ValueError):
+            return
+
+    def stats(self):
+        with self._lock:
+            return {'served_cells': len(self._served), 'served_cities': len(set(self._served.values())),
+                    'closed_cells': len(self._closed), 'closed_cities': len(self._closed_cities),
+                    'no_driver_cells': len(self._no_driver), 'checks': self.checks,
+                    'rejected': sum(self.rejected.values())}
+
+
+def test_service_area():
+    """测试坐标检查和服务区域索引"""
+    area = ServiceArea()
+    beijing = (40.018682, 116.476169, 39.908692, 116.397477)
+    assert area.check_route(*beijing) is None
+    # 经纬度颠倒、超出范围、非数值、起终点重合
+    assert area.check_route(116.476169, 40.018682, 39.908692, 116.397477)[0] == '8'
+    assert '颠倒' in area.check_route(40.018682, 116.476169, 116.397477, 39.908692)[1]
+    assert area.check_route(40.0, 200.0, 39.9, 116.3)[0] == '8'
+    assert area.check_route('abc', 116.4, 39.9, 116.3)[0] == '8'
+    assert area.check_route(float('nan'), 116.4, 39.9, 116.3)[0] == '8'
+    assert area.check_route(39.9, 116.4, 39.9001, 116.4001)[0] == '8'
+    # 默认不限制服务范围；配置后范围外返回本地返回码，不冒充上游的code 12
+    paris = (48.8566, 2.3522, 48.80, 2.30)
+    assert area.check_route(*paris) is None
+    bounded = ServiceArea(bounds=SERVICE_BOUNDS)
+    assert bounded.check_route(*paris)[0] == OUT_OF_BOUNDS_CODE and bounded.check_route(*beijing) is None
+    assert bounded.check_route(116.476169, 40.018682, 116.397477, 39.908692)[0] == '8'
+
+    # 批量距离与逐条计算一致
+    routes = [beijing, (31.2304, 121.4737, 31.1443, 121.8083), (22.5431, 114.0579, 22.5, 113.9)]
+    for distance, route in zip(haversine_many(routes), routes):
+        assert abs(distance - haversine_km(*route)) < 1e-9
+
+    # 价格表拉取成功时记录开通城市，返回code 12时记录未开通
+    area.observe('/city/price/list', {'latitude': 39.904030, 'longitude': 116.407526, 'city_name': '北京'},
+                 {'code': '0'})
+    assert area.city_at(40.018682, 116.476169) == '北京'
+    assert area.city_at(31.2304, 121.4737) is None
+    area.observe('/city/price/list', {'latitude': 29.65, 'longitude': 91.13, 'city_name': '拉萨'},
+                 {'code': '12'})
+    assert area.check_city('拉萨')[0] == '12' and area.check_city('北京') is None
+
+    # 预估多次返回code 12后，同一网格的请求在本地拒绝，其他网格不受影响
+    lhasa = (29.65, 91.13, 29.60, 91.10)
+    lhasa_params = {'start_latitude': 29.65, 'start_longitude': 91.13}
+    for _ in range(area.closed_threshold - 1):
+        area.observe('/order/costestimateV2', lhasa_params, {'code': '12'})
+        assert area.check_route(*lhasa) is None
+    area.observe('/order/costestimateV2', lhasa_params, {'code': '12'})
+    assert area.check_route(*lhasa)[0] == '12'
+    assert area.check_route(*beijing) is None
+
+    # 同一网格的预估成功时立即恢复，累计次数清零
+    area.observe('/order/costestimateV2', {'start_latitude': 29.66, 'start_longitude': 91.14}, {'code': '0'})
+    assert area.check_route(*lhasa) is None
+    area.observe('/order/costestimateV2', lhasa_params, {'code': '12'})
+    assert area.check_route(*lhasa) is None and area.stats()['closed_cells'] == 0
+
+    # 累计次数只在closed_ttl内有效
+    area.closed_ttl = 0
+    for _ in range(area.closed_threshold):
+        area.mark_closed(29.65, 91.13)
+    assert area.check_route(*lhasa) is None
+    area.closed_ttl = ServiceArea.DEFAULT_CLOSED_TTL
+    for _ in range(area.closed_threshold):
+        area.mark_closed(29.65, 91.13)
+    assert area.check_route(*lhasa)[0] == '12'
+
+    # 下单返回code 11后短时拦截附近的下单，不影响预估
+    area.observe('/order/commit', {'start_latitude': 40.018682, 'start_longitude': 116.476169}, {'code': '11'})
+    assert area.check_route(*beijing, order=True)[0] == '11'
+    assert area.check_route(*beijing) is None
+    area._no_driver = {cell: 0 for cell in area._no_driver}
+    assert area.check_route(*beijing, order=True) is None
+
+    # 城市价格表重新拉取成功后清除未开通记录
+    area.observe('/city/price/list', {'latitude': 29.65, 'longitude': 91.13, 'city_name': '拉萨'},
+                 {'code': '0'})
+    assert area.check_city('拉萨') is None and area.check_route(*lhasa) is None
+    print('服务区域预校验验证通过!', area.stats())
+
+
+# 导出函数供外部使用
+__all__ = ['haversine_km', 'haversine_many', 'check_point', 'ServiceArea', 'EARTH_RADIUS_KM',
+           'SERVICE_BOUNDS', 'OUT_OF_BOUNDS_CODE']
+
+if __name__ == '__main__':
+    test_service_area()
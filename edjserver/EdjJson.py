@@ -0,0 +1,54 @@
+"""JSON编解码
+
+安装了orjson时用orjson解析上游响应、序列化工具返回值；否则解析使用标准库json，
+序列化使用pydantic_core(FastMCP默认的序列化方式)。两种方式输出一致(紧凑格式，中文不转义)。
+设置EDJ_JSON=std可强制不使用orjson，便于对比或排查问题。
+"""
+import json
+import os
+
+import pydantic_core
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+if os.getenv('EDJ_JSON', '').lower() == 'std':
+    orjson = None
+
+# 当前使用的实现，用于基准测试输出
+BACKEND = 'orjson' if orjson is not None else 'json'
+
+# orjson.JSONDecodeError是json.JSONDecodeError的子类，调用方统一捕获这一个即可
+JSONDecodeError = json.JSONDecodeError
+
+
+def loads(data):
+    """解析JSON
+    Args:
+        data: bytes或str, JSON文本
+    Returns:
+        解析结果
+    Raises:
+        JSONDecodeError: 不是合法的JSON
+    """
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def dumps(obj):
+    """序列化为紧凑的JSON字符串，无法序列化的对象转为str(与FastMCP默认行为一致)
+    Args:
+        obj: 待序列化对象
+    Returns:
+        str: JSON文本
+    """
+    if orjson is not None:
+        return orjson.dumps(obj, default=str, option=orjson.OPT_NON_STR_KEYS).decode()
+    return pydantic_core.to_json(obj, fallback=str).decode()
+
+
+# 导出供外部使用
+__all__ = ['BACKEND', 'JSONDecodeError', 'dumps', 'loads']
@@ -0,0 +1,98 @@
+import json
+import logging
+import os
+import sys
+import time
+
+# 日志中不输出原值的字段
+SECRET_KEYS = frozenset(['token', 'authentoken', 'encrypt_authentoken', 'sig', 'secret',
+                         'randomkey', 'stale_token', 'appkey'])
+# 脱敏输出的手机号字段
+PHONE_KEYS = frozenset(['phone', 'contact_phone'])
+
+
+def mask_phone(phone):
+    """手机号脱敏，例如: 13800138000 -> 138****8000"""
+    phone = str(phone)
+    if len(phone) != 11:
+        return '***'
+    return f"{phone[:3]}****{phone[7:]}"
+
+
+def redact(value, key=None):
+    """递归脱敏日志字段中的token、签名和手机号"""
+    if key in SECRET_KEYS and value not in (None, ''):
+        return '***'
+    if key in PHONE_KEYS and value not in (None, ''):
+        return mask_phone(value)
+    if isinstance(value, dict):
+        return {k: redact(v, k) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [redact(v) for v in value]
+    return value
+
+
+def log_event(logger, level, event, **fields):
+    """输出一条结构化日志，字段在格式化时脱敏
+    Args:
+        logger: logging.Logger
+        level: int, 日志级别，例如: logging.INFO
+        event: str, 事件名，例如: upstream_error
+        **fields: 附加字段
+    """
+    if logger.isEnabledFor(level):
+        logger.log(level, event, extra={'edj_fields': fields})
+
+
+class JsonFormatter(logging.Formatter):
+    """每条日志输出为一行JSON"""
+
+    def format(self, record):
+        entry = {
+            'ts': round(record.created, 3),
+            'level': record.levelname.lower(),
+            'logger': record.name,
+            'event': record.getMessage()
+        }
+        fields = getattr(record, 'edj_fields', None)
+        if fields:
+            entry.update(redact(fields))
+        if record.exc_info:
+            entry['exc'] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class TextFormatter(logging.Formatter):
+    """便于本地阅读的key=value格式"""
+
+    def format(self, record):
+        parts = [time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(record.created)),
+                 record.levelname, record.name, record.getMessage()]
+        fields = getattr(record, 'edj_fields', None)
+        if fields:
+            parts.extend(f"{k}={v}" for k, v in redact(fields).items())
+        line = ' '.join(str(p) for p in parts)
+        if record.exc_info:
+            line += '\n' + self.formatException(record.exc_info)
+        return line
+
+
+def configure_logging(level=None, fmt=None):
+    """配置edjserver和服务入口的日志输出(写stderr，stdout留给stdio传输)
+    Args:
+        level: str, 日志级别，默认读取EDJ_LOG_LEVEL，未设置为INFO
+        fmt: str, json或text，默认读取EDJ_LOG_FORMAT，未设置为json
+    """
+    level = (level or os.getenv('EDJ_LOG_LEVEL') or 'INFO').upper()
+    fmt = (fmt or os.getenv('EDJ_LOG_FORMAT') or 'json').lower()
+    handler = logging.StreamHandler(sys.stderr)
+    handler.setFormatter(TextFormatter() if fmt == 'text' else JsonFormatter())
+    for name in ('edjserver', 'edaijiamcp'):
+        logger = logging.getLogger(name)
+        logger.handlers[:] = [handler]
+        logger.setLevel(level)
+        logger.propagate = False
+
+
+# 导出类供外部使用
+__all__ = ['JsonFormatter', 'TextFormatter', 'configure_logging', 'log_event', 'mask_phone', 'redact']
@@ -0,0 +1,240 @@
+"""M×N路线预估矩阵
+
+调度规划需要一组起点到一组终点的费用矩阵(例如酒店到娱乐场所)。EstimateMatrix负责:
+- 去重: 坐标相同(6位小数)的单元格只请求一次，symmetric为True时A->B与B->A共用一次请求，
+  起终点重合的单元格不请求
+- 调度: 按速率预算(每秒请求数和突发数)和并发上限依次发出请求，不触发上游的用户级限流
+- 流式返回: 某一行的所有单元格都有结果时回调，调用方可以先把完成的行发给客户端
+- 截止时间: 超时未完成的单元格取消请求，使用本地估算(如缓存的城市价格表)填充
+
+结果保存在array('d')中(缺失为NaN)，输出为行优先的一维列表加shape，与NumPy数组的布局一致。
+"""
+import asyncio
+import math
+import time
+from array import array
+
+from .EdjModels import EstimateResult
+
+# 单元格结果来源
+SOURCE_PENDING = '.'
+SOURCE_UPSTREAM = 'u'
+SOURCE_APPROX = 'a'
+SOURCE_FAILED = 'x'
+
+
+class EstimateMatrix:
+    """预估矩阵的去重计划和结果"""
+
+    def __init__(self, origins, destinations, symmetric=False):
+        """
+        Args:
+            origins: list, 起点[(latitude, longitude), ...]
+            destinations: list, 终点[(latitude, longitude), ...]
+            symmetric: bool, 是否认为A->B与B->A费用相同(共用一次请求)
+        """
+        self.shape = (len(origins), len(destinations))
+        rows, cols = self.shape
+        self.fees = array('d', [math.nan]) * (rows * cols)
+        self.sources = bytearray(SOURCE_PENDING.encode()) * (rows * cols)
+        self.errors = {}
+        # 去重后的请求 {(起点, 终点): [单元格下标]}，按行优先的首次出现顺序排列
+        self._cells = {}
+        self._row_pending = [cols] * rows
+        self.completed_rows = 0
+        for i, origin in enumerate(origins):
+            for j, destination in enumerate(destinations):
+                key = self.pair_key(origin, destination, symmetric)
+                self._cells.setdefault(key, []).append(i * cols + j)
+
+    @staticmethod
+    def pair_key(origin, destination, symmetric=False):
+        """单元格的去重键: 6位小数的(起点, 终点)，对称时按坐标排序"""
+        start = (round(float(origin[0]), 6), round(float(origin[1]), 6))
+        end = (round(float(destination[0]), 6), round(float(destination[1]), 6))
+        if symmetric and end < start:
+            start, end = end, start
+        return start, end
+
+    @property
+    def requests(self):
+        """去重后的请求数(含起终点重合、无需请求的)"""
+        return len(self._cells)
+
+    def pending(self):
+        """尚无结果的请求键"""
+        return [key for key, cells in self._cells.items()
+                if self.sources[cells[0]] == ord(SOURCE_PENDING)]
+
+    def fill(self, key, fee, source, error=None):
+        """写入一个请求键的结果
+        Args:
+            key: tuple, pair_key返回的键
+            fee: float, 费用，没有结果时为None
+            source: str, 结果来源(SOURCE_*)
+            error: dict, 失败时的{'code', 'message'}
+        Returns:
+            list: 因此全部完成的行号
+        """
+        completed = []
+        cols = self.shape[1]
+        for cell in self._cells[key]:
+            if self.sources[cell] != ord(SOURCE_PENDING):
+                continue
+            self.fees[cell] = math.nan if fee is None else fee
+            self.sources[cell] = ord(source)
+            if error is not None:
+                self.errors[cell] = error
+            row = cell // cols
+            self._row_pending[row] -= 1
+            if self._row_pending[row] == 0:
+                completed.append(row)
+        self.completed_rows += len(completed)
+        return completed
+
+    def row(self, i):
+        """第i行的费用，没有结果的为None"""
+        cols = self.shape[1]
+        return [None if math.isnan(fee) else fee for fee in self.fees[i * cols:(i + 1) * cols]]
+
+    async def run(self, estimate, rate=None, burst=1, max_concurrency=10, timeout=None,
+                  approximate=None, on_rows=None):
+        """请求所有尚无结果的单元格
+        Args:
+            estimate: 协程函数(start_latitude, start_longitude, end_latitude, end_longitude)，
+                返回预估接口结果
+            rate: float, 每秒最多发出的请求数，不传则不限速
+            burst: int, 开始时可立即发出的请求数
+            max_concurrency: int, 同时进行的请求数
+            timeout: float, 截止时间(秒)，到时取消未完成的请求
+            approximate: 函数(start_latitude, start_longitude, end_latitude, end_longitude)，
+                返回本地估算费用或None，用于填充超时未完成的单元格
+            on_rows: 协程函数(行号列表)，有行全部完成时调用
+        """
+        semaphore = asyncio.Semaphore(max(1, max_concurrency))
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        burst = max(1, int(burst))
+
+        async def request(seq, key):
+            if rate and seq >= burst:
+                await asyncio.sleep(max(0.0, started + (seq - burst + 1) / rate - loop.time()))
+            async with semaphore:
+                response = await estimate(*key[0], *key[1])
+            if response.get('code') == '0':
+                rows = self.fill(key, EstimateResult(response).fee, SOURCE_UPSTREAM)
+            else:
+                rows = self.fill(key, None, SOURCE_FAILED,
+                                 {'code': response.get('code'), 'message': response.get('message')})
+            if rows and on_rows is not None:
+                await on_rows(rows)
+
+        rows = []
+        tasks = {}
+        for key in self.pending():
+            if key[0] == key[1]:
+                # 起终点重合，不请求上游
+                rows += self.fill(key, None, SOURCE_FAILED, {'code': '8', 'message': '起终点相同'})
+            else:
+                tasks[asyncio.ensure_future(request(len(tasks), key))] = key
+        if rows and on_rows is not None:
+            await on_rows(rows)
+        if not tasks:
+            return
+        try:
+            done, pending = await asyncio.wait(tasks, timeout=timeout)
+        finally:
+            # 调用方取消或超时时取消未完成的请求，释放连接池
+            for task in tasks:
+                task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+        rows = []
+        for task, key in tasks.items():
+            if task in done and task.exception() is not None:
+                rows += self.fill(key, None, SOURCE_FAILED,
+                                  {'code': '-1', 'message': f"预估费用失败: {task.exception()}"})
+            elif task in pending:
+                fee = approximate(*key[0], *key[1]) if approximate is not None else None
+                if fee is not None:
+                    rows += self.fill(key, fee, SOURCE_APPROX)
+                else:
+                    rows += self.fill(key, None, SOURCE_FAILED, {'code': '-5', 'message': '预估超时'})
+        if rows and on_rows is not None:
+            await on_rows(rows)
+
+    def to_dict(self):
+        """输出结果
+        Returns:
+            dict: shape为[M, N]；fees为行优先的一维费用列表(第i行第j列为fees[i * N + j]，
+                没有结果的为None)；sources为等长字符串，u上游、a本地估算、x失败；
+                errors为失败单元格的[行, 列, 返回码, 信息]
+        """
+        cols = self.shape[1]
+        return {
+            'shape': list(self.shape),
+            'fees': [None if math.isnan(fee) else fee for fee in self.fees],
+            'sources': self.sources.decode(),
+            'requests': self.requests,
+            'errors': [[cell // cols, cell % cols, error['code'], error['message']]
+                       for cell, error in sorted(self.errors.items())]
+        }
+
+
+def test_estimate_matrix():
+    """测试去重、限速、逐行回调和超时估算"""
+    calls = []
+
+    async def estimate(start_lat, start_lon, end_lat, end_lon):
+        calls.append(time.monotonic())
+        # 终点在上海(纬度小于35)的请求很慢，用于验证超时
+        await asyncio.sleep(1.0 if end_lat < 35 else 0.01)
+        return {'code': '0', 'message': '成功', 'data': {'fee': round(abs(end_lat - start_lat) * 100, 2)}}
+
+    hotels = [(39.90, 116.40), (39.95, 116.45), (39.90, 116.40)]
+    venues = [(39.93, 116.43), (39.95, 116.45), (31.23, 121.47)]
+
+    async def run():
+        # 重复的起点、A->B与B->A、起终点重合都只计一次
+        matrix = EstimateMatrix(hotels, hotels, symmetric=True)
+        assert matrix.requests == 3
+        await matrix.run(estimate)
+        assert len(calls) == 1 and matrix.to_dict()['sources'] == 'xuxuxuxux'
+
+        calls.clear()
+        completed = []
+
+        async def on_rows(rows):
+            completed.extend(rows)
+
+        matrix = EstimateMatrix(hotels, venues)
+        assert matrix.requests == 6
+        await matrix.run(estimate, rate=20, burst=2, timeout=0.5, on_rows=on_rows,
+                         approximate=lambda *route: 999.0 if route[2] < 35 else None)
+        result = matrix.to_dict()
+        assert result['shape'] == [3, 3] and result['sources'] == 'uuauxauua', result
+        assert result['fees'][0] == 3.0 and result['fees'][2] == 999.0 and result['fees'][6:] == result['fees'][:3]
+        assert result['errors'] == [[1, 1, '8', '起终点相同']]
+        # 每行都有慢请求，截止时间到达、本地估算补齐后各行完成
+        assert sorted(completed) == [0, 1, 2] and matrix.completed_rows == 3
+        # 限速: 前2个立即发出，之后每0.05秒一个
+        assert len(calls) == 5 and calls[-1] - calls[0] >= 0.14
+
+        # 行完成即回调，不等待其他行
+        completed.clear()
+        matrix = EstimateMatrix(hotels[:1], venues)
+        task = asyncio.ensure_future(matrix.run(estimate, on_rows=on_rows))
+        await asyncio.sleep(0.2)
+        assert completed == [] and matrix.to_dict()['sources'] == 'uu.'
+        await task
+        assert completed == [0]
+
+    asyncio.run(run())
+    print('预估矩阵验证通过!')
+
+
+# 导出类供外部使用
+__all__ = ['EstimateMatrix', 'SOURCE_APPROX', 'SOURCE_FAILED', 'SOURCE_PENDING', 'SOURCE_UPSTREAM']
+
+if __name__ == '__main__':
+    test_estimate_matrix()
@@ -0,0 +1,219 @@
+import bisect
+
+from .EdjStatus import API_RESPONSE_CODE
+
+
+class _Counter:
+    __slots__ = ('value',)
+
+    def __init__(self):
+        self.value = 0.0
+
+    def inc(self, amount=1):
+        self.value += amount
+
+
+class _Gauge:
+    __slots__ = ('value',)
+
+    def __init__(self):
+        self.value = 0.0
+
+    def inc(self, amount=1):
+        self.value += amount
+
+    def dec(self, amount=1):
+        self.value -= amount
+
+    def set(self, value):
+        self.value = value
+
+
+class _Histogram:
+    __slots__ = ('buckets', 'counts', 'sum', 'count')
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class Metric:
+    """一个指标族，按标签值区分子指标
+
+    更新只在事件循环线程(或持有GIL的单次赋值)中进行，不加锁；
+    多线程并发更新时计数可能有极小误差，对监控用途可以接受。
+    """
+
+    def __init__(self, name, kind, documentation, labelnames=(), buckets=None):
+        self.name = name
+        self.kind = kind
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = buckets
+        self._children = {}
+
+    def labels(self, *values):
+        """获取标签值对应的子指标(首次使用时创建)"""
+        child = self._children.get(values)
+        if child is None:
+            if self.kind == 'counter':
+                child = _Counter()
+            elif self.kind == 'gauge':
+                child = _Gauge()
+            else:
+                child = _Histogram(self.buckets)
+            child = self._children.setdefault(values, child)
+        return child
+
+    def render(self, lines):
+        lines.append(f"# HELP {self.name} {self.documentation}")
+        lines.append(f"# TYPE {self.name} {self.kind}")
+        for values, child in list(self._children.items()):
+            labels = dict(zip(self.labelnames, values))
+            if self.kind != 'histogram':
+                lines.append(f"{self.name}{_format_labels(labels)} {_format_value(child.value)}")
+                continue
+            cumulative = 0
+            for bound, count in zip(self.buckets, child.counts):
+                cumulative += count
+                lines.append(f"{self.name}_bucket{_format_labels(labels, le=_format_value(bound))} {cumulative}")
+            lines.append(f"{self.name}_bucket{_format_labels(labels, le='+Inf')} {child.count}")
+            lines.append(f"{self.name}_sum{_format_labels(labels)} {_format_value(child.sum)}")
+            lines.append(f"{self.name}_count{_format_labels(labels)} {child.count}")
+
+
+def _format_labels(labels, **extra):
+    labels = dict(labels, **extra)
+    if not labels:
+        return ''
+    pairs = ','.join('{}="{}"'.format(
+        k, str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+        for k, v in labels.items())
+    return '{' + pairs + '}'
+
+
+def _format_value(value):
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+class EdjMetrics:
+    """进程内指标注册表，以Prometheus文本格式导出
+
+    上游调用的签名、网络、JSON解析耗时按接口记录直方图，返回码按
+    EdjStatus.API_RESPONSE_CODE映射为说明文字计数；缓存、熔断器等组件的
+    统计通过add_stats在导出时读取，不在热路径上额外计数。
+    """
+
+    # 耗时直方图分桶(秒)
+    DEFAULT_BUCKETS = (0.0001, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+                       0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+    # 本地构造的错误返回码(见EdjApi._error_response)
+    LOCAL_ERRORS = {'-1': 'request_failed', '-2': 'decode_failed', '-3': 'circuit_open',
+                    '-4': 'rate_limited'}
+
+    def __init__(self):
+        self._metrics = []
+        self._stats = []
+        self.upstream_sign_seconds = self.histogram(
+            'edj_upstream_sign_seconds', '请求参数签名耗时', ('endpoint',))
+        self.upstream_network_seconds = self.histogram(
+            'edj_upstream_network_seconds', '上游HTTP请求耗时(单次尝试)', ('endpoint',))
+        self.upstream_decode_seconds = self.histogram(
+            'edj_upstream_decode_seconds', '响应JSON解析耗时', ('endpoint',))
+        self.upstream_responses = self.counter(
+            'edj_upstream_responses_total', '上游返回码计数', ('endpoint', 'code', 'desc'))
+        self.upstream_errors = self.counter(
+            'edj_upstream_errors_total', '未拿到上游业务返回的调用(网络失败、解析失败、熔断、限流)',
+            ('endpoint', 'kind'))
+        self.upstream_retries = self.counter(
+            'edj_upstream_retries_total', '上游请求重试次数', ('endpoint',))
+        self.upstream_coalesced = self.counter(
+            'edj_upstream_coalesced_total', '与进行中的相同请求合并、未单独请求上游的调用数', ('endpoint',))
+        self.upstream_inflight = self.gauge(
+            'edj_upstream_inflight', '进行中的上游调用数', ('endpoint',))
+        self.token_lifetime = self.gauge(
+            'edj_token_lifetime_seconds', '根据上游过期响应估计的token有效期', ('tenant',))
+        self._response_labels = {}
+
+    def counter(self, name, documentation, labelnames=()):
+        return self._register(Metric(name, 'counter', documentation, labelnames))
+
+    def gauge(self, name, documentation, labelnames=()):
+        return self._register(Metric(name, 'gauge', documentation, labelnames))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=None):
+        return self._register(Metric(name, 'histogram', documentation, labelnames,
+                                     tuple(buckets or self.DEFAULT_BUCKETS)))
+
+    def _register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def add_stats(self, prefix, stats, counters=()):
+        """导出组件的stats()结果
+        Args:
+            prefix: str, 指标名前缀，例如: edj_token_cache
+            stats: 无参函数，返回{名称: 数值}，非数值项忽略
+            counters: 单调递增的字段名，导出为counter(名称加_total后缀)，其余为gauge
+        """
+        self._stats.append((prefix, stats, frozenset(counters)))
+
+    def record_response(self, endpoint, response):
+        """按返回码计数一次上游调用结果
+        Args:
+            endpoint: str, 接口路径
+            response: dict, 接口返回结果(含本地构造的错误返回)
+        """
+        code = str(response.get('code')) if isinstance(response, dict) else None
+        kind = self.LOCAL_ERRORS.get(code)
+        if kind is not None:
+            self.upstream_errors.labels(endpoint, kind).inc()
+            return
+        key = (endpoint, code)
+        labels = self._response_labels.get(key)
+        if labels is None:
+            try:
+                desc = API_RESPONSE_CODE.get(int(code), '未知返回码')
+            except (TypeError, ValueError):
+                desc = '未知返回码'
+            labels = self._response_labels.setdefault(key, (endpoint, code, desc))
+        self.upstream_responses.labels(*labels).inc()
+
+    def render(self):
+        """生成Prometheus文本格式(text/plain; version=0.0.4)"""
+        lines = []
+        for metric in self._metrics:
+            metric.render(lines)
+        for prefix, stats, counters in self._stats:
+            try:
+                values = stats()
+            except Exception:
+                continue
+            for key, value in values.items():
+                if isinstance(value, bool) or not isinstance(value, (int, float)):
+                    continue
+                if key in counters:
+                    name, kind = f"{prefix}_{key}_total", 'counter'
+                else:
+                    name, kind = f"{prefix}_{key}", 'gauge'
+                lines.append(f"# TYPE {name} {kind}")
+                lines.append(f"{name} {_format_value(value)}")
+        return '\n'.join(lines) + '\n'
+
+
+# 进程级共享的指标注册表
+metrics = EdjMetrics()
+
+
+# 导出类供外部使用
+__all__ = ['EdjMetrics', 'Metric', 'metrics']
@@ -0,0 +1,545 @@
+"""e代驾开放平台本地模拟服务
+
+用于本地测试和基准测试，覆盖getAuthenToken、city/price/list、costestimateV2、
+order/commit和order/polling接口，可配置延迟、错误率和token过期。
+
+用法:
+    python -m edjserver.EdjMockServer --port 18080 --latency 0.05 --error-rate 0.01
+    python -m edjserver.EdjMockServer --self-test
+"""
+import argparse
+import asyncio
+import base64
+import os
+import random
+import secrets
+import socket
+import threading
+import time
+
+from Crypto.Cipher import AES
+from Crypto.Util.Padding import pad
+from starlette.applications import Starlette
+from starlette.responses import JSONResponse
+from starlette.routing import Route
+
+from .EdjGeo import haversine_km
+from .EdjSignUtils import Signer
+from .EdjSystemParams import EdjSystemParams
+
+
+class MockConfig:
+    """模拟服务的故障注入配置，运行中可通过POST /__config修改"""
+
+    def __init__(self, latency=0.0, jitter=0.0, error_rate=0.0, expire_rate=0.0,
+                 token_ttl=None, verify_sig=True, status_step=2.0):
+        """
+        Args:
+            latency: float, 每个请求的基础延迟(秒)
+            jitter: float, 在基础延迟上随机增加0~jitter秒
+            error_rate: float, 返回HTTP 503的概率
+            expire_rate: float, 业务接口随机返回token过期的概率
+            token_ttl: float, token有效期(秒)，不传则不过期
+            verify_sig: bool, 是否校验签名
+            status_step: float, 订单状态每隔多少秒推进一步
+        """
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.expire_rate = expire_rate
+        self.token_ttl = token_ttl
+        self.verify_sig = verify_sig
+        self.status_step = status_step
+
+    def update(self, values):
+        for key, value in values.items():
+            if hasattr(self, key):
+                setattr(self, key, value)
+
+
+class MockEdjServer:
+    """模拟服务状态: token、订单和按接口统计的调用次数"""
+
+    PRICE_RULES = [
+        {'start_time': '07:00', 'end_time': '22:00', 'start_price': '39', 'start_distance': '10',
+         'unit_price': '20', 'unit_distance': '5'},
+        {'start_time': '22:00', 'end_time': '07:00', 'start_price': '59', 'start_distance': '10',
+         'unit_price': '20', 'unit_distance': '5'},
+    ]
+    OPEN_CITIES = ('北京', '上海', '广州', '深圳', '杭州', '成都')
+    STATUS_FLOW = (102, 180, 301, 302, 303, 304)
+
+    def __init__(self, config=None, secret=None, partners=None):
+        """
+        Args:
+            config: MockConfig, 延迟和故障注入配置
+            secret: str, 默认appkey的SECRET
+            partners: dict, 其他合作方 {appkey: secret}，按请求中的appkey校验签名
+        """
+        self.config = config or MockConfig()
+        self.signer = Signer(secret or EdjSystemParams.DEFAULT_SECRET,
+                             appkey=EdjSystemParams.DEFAULT_APPKEY,
+                             ver=EdjSystemParams.DEFAULT_VER,
+                             from_channel=EdjSystemParams.DEFAULT_FROM_CHANNEL)
+        self.signers = {EdjSystemParams.DEFAULT_APPKEY: self.signer}
+        for appkey, partner_secret in (partners or {}).items():
+            self.signers[appkey] = Signer(partner_secret, appkey=appkey, ver=EdjSystemParams.DEFAULT_VER,
+                                          from_channel=EdjSystemParams.DEFAULT_FROM_CHANNEL)
+        self.tokens = {}
+        self.orders = {}
+        self.calls = {}
+        self.app = Starlette(routes=[
+            Route('/customer/getAuthenToken', self._wrap(self.authen_token), methods=['POST']),
+            Route('/city/price/list', self._wrap(self.city_price_list), methods=['POST']),
+            Route('/order/costestimateV2', self._wrap(self.cost_estimate), methods=['POST']),
+            Route('/order/commit', self._wrap(self.commit_order), methods=['POST']),
+            Route('/order/polling', self._wrap(self.order_polling), methods=['POST']),
+            Route('/__stats', self.stats, methods=['GET']),
+            Route('/__config', self.update_config, methods=['POST']),
+        ])
+
+    @property
+    def total_calls(self):
+        return sum(self.calls.values())
+
+    def reset_stats(self):
+        self.calls.clear()
+
+    def _wrap(self, handler):
+        async def endpoint(request):
+            path = request.url.path
+            self.calls[path] = self.calls.get(path, 0) + 1
+            config = self.config
+            delay = config.latency + random.random() * config.jitter
+            if delay:
+                await asyncio.sleep(delay)
+            if config.error_rate and random.random() < config.error_rate:
+                return JSONResponse({'code': '9', 'message': '接口请求失败'}, status_code=503)
+            params = dict(await request.form())
+            if config.verify_sig:
+                signer = self.signers.get(params.get('appkey'))
+                if signer is None:
+                    return self._result('5', 'appkey未在配置中心配置')
+                if params.get('sig') != signer.generate_sig(params):
+                    return self._result('7', 'sig错误，接口签名失败')
+            return handler(params)
+        return endpoint
+
+    @staticmethod
+    def _result(code, message='成功', data=None):
+        return JSONResponse({'code': code, 'message': message, 'data': data})
+
+    def _token_valid(self, token):
+        record = self.tokens.get(token)
+        if record is None:
+            return False
+        if self.config.token_ttl is not None and time.time() - record[1] > self.config.token_ttl:
+            return False
+        return not (self.config.expire_rate and random.random() < self.config.expire_rate)
+
+    def authen_token(self, params):
+        phone = params.get('phone') or params.get('third_user_id')
+        randomkey = params.get('randomkey', '')
+        if not phone or len(randomkey) != 16:
+            return self._result('8', '业务参数缺失或非法')
+        token = secrets.token_hex(32)
+        self.tokens[token] = (phone, time.time())
+        cipher = AES.new(randomkey.encode(), AES.MODE_ECB)
+        encrypted = base64.b64encode(cipher.encrypt(pad(token.encode(), AES.block_size))).decode()
+        return self._result('0', data={'encrypt_authentoken': encrypted})
+
+    def city_price_list(self, params):
+        if params.get('city_name') not in self.OPEN_CITIES:
+            return self._result('12', '该城市未开通，获取城市价格表失败')
+        return self._result('0', data=self.PRICE_RULES)
+
+    def cost_estimate(self, params):
+        if not self._token_valid(params.get('token')):
+            return self._result('10', '授权token已过期，请重新获取')
+        distance = haversine_km(float(params['start_latitude']), float(params['start_longitude']),
+                                float(params['end_latitude']), float(params['end_longitude'])) * 1.3
+        fee = 39 + max(0, -(-(distance - 10) // 5)) * 20
+        return self._result('0', data={'fee': fee, 'distance': round(distance, 2)})
+
+    def commit_order(self, params):
+        if not self._token_valid(params.get('token')):
+            return self._result('1', 'token校验失败')
+        third_order_id = params.get('third_order_id')
+        if third_order_id not in self.orders:
+            self.orders[third_order_id] = time.time()
+        return self._result('0', data={'third_order_id': third_order_id,
+                                       'order_id': str(abs(hash(third_order_id)))})
+
+    def order_polling(self, params):
+        if not self._token_valid(params.get('token')):
+            return self._result('10', '授权token已过期，请重新获取')
+        created = self.orders.get(params.get('third_order_id'))
+        if created is None:
+            return self._result('8', '订单不存在')
+        # 每status_step秒推进一个状态
+        step = min(int((time.time() - created) / self.config.status_step), len(self.STATUS_FLOW) - 1)
+        return self._result('0', data={'order_status': self.STATUS_FLOW[step]})
+
+    async def stats(self, request):
+        return JSONResponse({'calls': self.calls, 'total': self.total_calls,
+                             'tokens': len(self.tokens), 'orders': len(self.orders)})
+
+    async def update_config(self, request):
+        self.config.update(await request.json())
+        return JSONResponse(vars(self.config))
+
+    def start_in_thread(self, host='127.0.0.1', port=0):
+        """在后台线程中启动服务
+        Returns:
+            str: 服务基础URL
+        """
+        import uvicorn
+        if not port:
+            with socket.socket() as sock:
+                sock.bind((host, 0))
+                port = sock.getsockname()[1]
+        server = uvicorn.Server(uvicorn.Config(self.app, host=host, port=port, log_level='warning'))
+        thread = threading.Thread(target=server.run, daemon=True)
+        thread.start()
+        while not server.started:
+            time.sleep(0.01)
+        self._server = server
+        return f"http://{host}:{port}"
+
+    def stop(self):
+        server = getattr(self, '_server', None)
+        if server is not None:
+            server.should_exit = True
+
+
+def test_api_against_mock():
+    """
+    测试AsyncEdjApi与模拟服务的交互: 认证解密(含批量)、签名校验、token过期、请求合并与取消、
+    本地预校验、重试与熔断、审计日志
+    """
+    import tempfile
+
+    from .EdjApi import AsyncEdjApi
+    from .EdjAudit import AuditLog, order_timelines, read_records
+    from .EdjCityPrice import CityPriceIndex
+    from .EdjOrderTracker import OrderTracker
+    from .EdjRateLimit import RateLimiter
+    from .EdjResilience import EdjResilience
+    from .EdjTokenCache import EdjTokenCache
+    from .EdjTokenStore import KVTokenStore
+
+    mock = MockEdjServer()
+    base_url = mock.start_in_thread()
+    audit_dir = tempfile.mkdtemp(prefix='edj_audit_')
+
+    async def run():
+        api = AsyncEdjApi(api_base_url=base_url, token_cache=EdjTokenCache(store=KVTokenStore()),
+                          resilience=EdjResilience(failure_threshold=3, reset_timeout=0.2),
+                          audit_log=AuditLog(audit_dir))
+        phone = '13800138000'
+
+        # 认证并解密token，并发刷新只请求一次
+        results = await asyncio.gather(*(api.refresh_authen_token(phone) for _ in range(20)))
+        assert all(r['code'] == '0' for r in results)
+        assert mock.calls['/customer/getAuthenToken'] == 1
+        token = api.get_token_by_phone(phone)
+        assert token in mock.tokens
+
+        result = await api.get_cost_estimate_v2(token, 40.018682, 116.476169, 39.908692, 116.397477)
+        assert result['code'] == '0'
+
+        # 批量认证: 每个请求使用不同的randomkey，返回后批量解密
+        phones = [f"1370000{n:04d}" for n in range(30)]
+        results = await api.get_authen_tokens(phones, max_concurrency=8)
+        assert all(results[p]['code'] == '0' for p in phones)
+        assert all(mock.tokens[api.get_token_by_phone(p)][0] == p for p in phones)
+
+        # token过期
+        mock.config.token_ttl = 0
+        result = await api.get_cost_estimate_v2(token, 40.018682, 116.476169, 39.908692, 116.397477)
+        assert result['code'] == '10'
+        mock.config.token_ttl = None
+
+        # 相同业务参数的并发预估和价格表请求合并为一次上游请求，不同参数不合并
+        mock.reset_stats()
+        mock.config.latency = 0.05
+        coalesced = api.metrics.upstream_coalesced
+        routes = [(39.908692, 116.397477)] * 15 + [(39.908692 + 0.01 * n, 116.397477) for n in range(1, 6)]
+        results = await asyncio.gather(*(
+            api.get_cost_estimate_v2(token, 40.018682, 116.476169, lat, lon) for lat, lon in routes))
+        assert all(r['code'] == '0' for r in results)
+        assert len({r['data']['fee'] for r in results[:15]}) == 1 and results[0] is not results[1]
+        assert mock.calls['/order/costestimateV2'] == 6
+        assert coalesced.labels('/order/costestimateV2').value == 14
+        results = await asyncio.gather(*(api.get_city_price_list(116.476169, 40.018682, '北京')
+                                         for _ in range(10)))
+        assert all(r['code'] == '0' for r in results) and mock.calls['/city/price/list'] == 1
+        assert coalesced.labels('/city/price/list').value == 9
+
+        # 调用方取消时中止上游请求；合并的请求在所有调用方都取消后才中止
+        mock.config.latency = 0.3
+        inflight = api.metrics.upstream_inflight.labels('/order/costestimateV2')
+        calls = [asyncio.ensure_future(api.get_cost_estimate_v2(token, 40.018682, 116.476169, 39.8, 116.3))
+                 for _ in range(2)]
+        await asyncio.sleep(0.1)
+        calls[0].cancel()
+        assert (await calls[1])['code'] == '0'
+        calls = [asyncio.ensure_future(api.get_cost_estimate_v2(token, 40.018682, 116.476169, 39.7, 116.3))
+                 for _ in range(2)]
+        await asyncio.sleep(0.1)
+        assert inflight.value == 1
+        for call in calls:
+            call.cancel()
+        await asyncio.gather(*calls, return_exceptions=True)
+        # 刚取消的请求不再被新的调用方合并
+        assert not api._coalescing
+        late = asyncio.ensure_future(api.get_cost_estimate_v2(token, 40.018682, 116.476169, 39.7, 116.3))
+        await asyncio.sleep(0.05)
+        assert inflight.value == 1
+        mock.config.latency = 0.0
+        assert (await late)['code'] == '0'
+        await asyncio.sleep(0.05)
+        assert inflight.value == 0 and not api._coalescing
+
+        # 预估按调用方传入的手机号计入用户级限额，刷新token后限额不重置
+        limiter = api.rate_limiter
+        api.rate_limiter = RateLimiter(subject_limits={'/order/costestimateV2': (0.01, 2)}, max_wait=0)
+        for lat in (39.61, 39.62):
+            result = await api.get_cost_estimate_v2(token, 40.018682, 116.476169, lat, 116.3, subject=phone)
+            assert result['code'] == '0'
+        assert (await api.refresh_authen_token(phone, stale_token=token))['code'] == '0'
+        token = api.get_token_by_phone(phone)
+        result = await api.get_cost_estimate_v2(token, 40.018682, 116.476169, 39.63, 116.3, subject=phone)
+        assert result['code'] == '-4', result
+        result = await api.get_cost_estimate_v2(token, 40.018682, 116.476169, 39.64, 116.3)
+        assert result['code'] == '0'
+        api.rate_limiter = limiter
+
+        # 本地预校验: 返回过未开通的城市不再请求价格表，经纬度颠倒的路线不请求上游
+        mock.reset_stats()
+        price_index = CityPriceIndex(api)
+        for _ in range(3):
+            table, result = await price_index.get('拉萨', 91.13, 29.65)
+            assert table is None and result['code'] == '12'
+        assert result.get('local_check') and mock.calls['/city/price/list'] == 1
+        result = api.precheck_route(116.476169, 40.018682, 39.908692, 116.397477)
+        assert result['code'] == '8' and result['local_check']
+        assert api.precheck_route(40.018682, 116.476169, 39.908692, 116.397477) is None
+
+        # 上游503时幂等接口重试，下单不重试
+        mock.reset_stats()
+        mock.config.error_rate = 1.0
+        result = await api.get_city_price_list(116.476169, 40.018682, '北京')
+        assert result['code'] == '-1' and mock.calls['/city/price/list'] == 3
+        result = await api.commit_order(phone, token, 'a', 116.47, 40.01, 'b', 116.39, 39.90, 'T1')
+        assert result['code'] == '-1' and mock.calls['/order/commit'] == 1
+        # API_BASE_URL带路径前缀时仍按相对路径匹配策略，下单不会落到默认策略而被重试
+        prefixed = AsyncEdjApi(api_base_url='http://127.0.0.1:1/edj', token_cache=api.token_cache)
+        assert (await prefixed.get_city_price_list(116.476169, 40.018682, '北京'))['code'] == '-1'
+        assert prefixed.resilience.retries == 2
+        result = await prefixed.commit_order(phone, token, 'a', 116.47, 40.01, 'b', 116.39, 39.90, 'T5')
+        assert result['code'] == '-1' and prefixed.resilience.retries == 2
+        assert prefixed.resilience.policy('/order/unknown').attempts() == 1
+        await prefixed.aclose()
+
+        # 连续失败后熔断，冷却后恢复；半开状态的探测请求被取消时释放探测名额
+        result = await api.get_city_price_list(116.476169, 40.018682, '北京')
+        assert result['code'] == '-3', result
+        mock.config.error_rate = 0.0
+        await asyncio.sleep(0.25)
+        mock.config.latency = 1.0
+        probe = asyncio.ensure_future(api.get_city_price_list(116.476169, 40.018682, '北京'))
+        await asyncio.sleep(0.1)
+        breaker = api.resilience.breaker('/city/price/list')
+        assert breaker.state == 'half_open' and breaker._probing
+        probe.cancel()
+        await asyncio.gather(probe, return_exceptions=True)
+        await asyncio.sleep(0.05)  # 合并的上游请求在下一轮事件循环中取消
+        assert breaker.state == 'half_open' and not breaker._probing
+        mock.config.latency = 0.0
+        result = await api.get_city_price_list(116.476169, 40.018682, '北京')
+        assert result['code'] == '0', result
+
+        # 订单跟踪每次轮询后调用轮询监听(用于续期下单占用标记)，查询失败时ok为False
+        tracker = OrderTracker(api)
+        tracker.PENDING_INTERVAL = 0.05
+        polls = []
+
+        async def on_poll(order, ok):
+            polls.append((order.third_order_id, order.status, ok))
+        tracker.add_poll_listener(on_poll)
+        mock.orders['T3'] = time.time()
+        tracker.register('T3', phone)
+        tracker.register('T4', phone)  # 上游不存在的订单，查询返回code 8
+        await asyncio.sleep(0.3)
+        await tracker.stop()
+        assert ('T3', mock.STATUS_FLOW[0], True) in polls and ('T4', 102, False) in polls
+        assert [order.third_order_id for order in tracker.active_orders()] == ['T3', 'T4']
+
+        # 到不了终态的订单: 连续失败max_errors次或跟踪超过max_age后移除，并以ok=False通知一次
+        tracker = OrderTracker(api, max_age=0.4, max_errors=2)
+        tracker.PENDING_INTERVAL = 0.05
+        evicted = []
+
+        async def on_evict(order, ok):
+            if order.evicted:
+                evicted.append((order.third_order_id, ok, order.errors))
+        tracker.add_poll_listener(on_evict)
+        # 换一个手机号，上面的轮询已用完该token的用户级限额
+        tracker.register('T3', phones[0])
+        tracker.register('T4', phones[0])
+        waiting = asyncio.ensure_future(tracker.wait_change('T4', timeout=5))
+        await asyncio.sleep(0.3)
+        assert evicted == [('T4', False, 2)] and await waiting is None and tracker.get('T4') is None
+        for _ in range(30):  # 查询受用户级限流，T3的下一次调度时间不固定
+            await asyncio.sleep(0.1)
+            if len(evicted) == 2:
+                break
+        assert [e[0] for e in evicted] == ['T4', 'T3'] and tracker.stats()['tracked'] == 0
+        assert tracker.stats()['evicted'] == 2
+        await tracker.stop()
+
+        # 每个订单单独查询，上游卡住的查询按poll_timeout超时，不推迟其他订单
+        class StalledApi:
+            def get_token_by_phone(self, phone):
+                return 'token'
+
+            async def get_order_status(self, token, third_order_id):
+                if third_order_id == 'SLOW':
+                    await asyncio.sleep(10)
+                return {'code': '0', 'data': {'order_status': 180}}
+
+        tracker = OrderTracker(StalledApi(), poll_timeout=0.3)
+        tracker.PENDING_INTERVAL = 0.05
+        tracker.register('SLOW', phone)
+        fast = tracker.register('FAST', phone)
+        await asyncio.sleep(0.2)
+        assert fast.status == 180 and fast.polls >= 2 and tracker.stats()['polling'] >= 1
+        await asyncio.sleep(0.2)
+        assert tracker.get('SLOW').errors == 1
+        await tracker.stop()
+        assert tracker.stats()['polling'] == 0
+
+        # 审计日志: 下单和轮询记录可重建订单时间线，token和手机号已脱敏
+        result = await api.commit_order(phone, token, 'a', 116.47, 40.01, 'b', 116.39, 39.90, 'T2')
+        assert result['code'] == '0', result
+        for _ in range(2):
+            assert (await api.get_order_status(token, 'T2'))['code'] == '0'
+        await api.aclose()
+        api.audit_log.close()
+        records = list(read_records(audit_dir))
+        assert len(records) == api.audit_log.written and api.audit_log.dropped == 0
+        assert all(token not in str(record) and phone not in str(record) for record in records)
+        timelines = order_timelines(records)
+        assert timelines['T1']['commits'][0]['code'] == '-1' and timelines['T1']['errors'] == 1
+        timeline = timelines['T2']
+        assert timeline['commits'][0]['order_id'] and timeline['calls'] == 3 and timeline['errors'] == 0
+        assert [s['status'] for s in timeline['statuses']] == [mock.STATUS_FLOW[0]]
+
+        await run_tools()
+
+    async def run_tools():
+        """通过FastMCP客户端调用工具，检查进度通知递增、每项结果以日志通知发送"""
+        import edaijiamcp
+        from fastmcp import Client
+
+        from .EdjModels import ApiResult, JsonToolResult, wrap_result
+        from .EdjOrderJournal import OrderJournal
+
+        # 非JSON对象的响应统一为'-2'；JsonToolResult经过基类初始化，结构化内容仍直接引用payload
+        result = wrap_result('/order/commit', ['unexpected'])
+        assert type(result) is ApiResult and result.code == '-2' and result.data == ['unexpected']
+        payload = {'code': '0', 'data': {'fee': 12.5}}
+        tool_result = JsonToolResult(payload)
+        assert tool_result.structured_content is payload
+        assert tool_result.to_mcp_result()[0][0].text == '{"code":"0","data":{"fee":12.5}}'
+
+        selected = edaijiamcp.tenants.get()
+        selected.api.api_base_url = base_url
+        selected.api.token_cache = EdjTokenCache(store=KVTokenStore())
+        selected.api.audit_log = None
+        selected.order_tracker.PENDING_INTERVAL = 0.1
+        edaijiamcp.order_journal = OrderJournal(os.path.join(tempfile.mkdtemp(prefix='edj_journal_'), 'orders.log'))
+        mock.config.status_step = 0.2
+        progress, logs = [], []
+
+        async def progress_handler(value, total, message):
+            progress.append((value, total, message))
+
+        async def log_handler(message):
+            logs.append((message.logger, message.data))
+
+        def reported(logger_name):
+            values = [value for value, _, _ in progress]
+            assert values == sorted(set(values)) and values[0] == 1, progress
+            items = [data for name, data in logs if name == logger_name]
+            progress.clear()
+            logs.clear()
+            return values, items
+
+        async with Client(edaijiamcp.mcp, progress_handler=progress_handler, log_handler=log_handler) as client:
+            routes = [{'start_longitude': 116.476169, 'start_latitude': 40.018682, 'end_longitude': 116.39,
+                       'end_latitude': 39.90 - 0.01 * i, 'phone': '13900000101'} for i in range(5)]
+            result = await client.call_tool('estimate_cost_batch', {'routes': routes})
+            assert result.structured_content['succeeded'] == 5
+            assert all(total == 5 for _, total, _ in progress)
+            values, items = reported('estimate_cost_batch')
+            assert values == [1, 2, 3, 4, 5]
+            assert sorted(item['index'] for item in items) == [0, 1, 2, 3, 4]
+
+            points = [{'longitude': 116.40 + 0.02 * i, 'latitude': 39.90 + 0.02 * i} for i in range(2)]
+            result = await client.call_tool('estimate_matrix', {
+                'origins': points, 'destinations': [{'longitude': 116.30, 'latitude': 39.80}] + points[:1],
+                'phone': '13900000102'})
+            assert result.structured_content['shape'] == [2, 2]
+            values, items = reported('estimate_matrix')
+            assert values == [1, 2] and sorted(item['row'] for item in items) == [0, 1]
+
+            result = await client.call_tool('call_driver', {
+                'start_address': 'a', 'start_longitude': 116.476169, 'start_latitude': 40.018682,
+                'end_address': 'b', 'end_longitude': 116.397477, 'end_latitude': 39.908692,
+                'phone': '13900000103', 'wait_seconds': 5})
+            assert result.structured_content['order_status']['status'] not in (102, 180)
+            messages = [message for _, _, message in progress]
+            values, items = reported('call_driver')
+            assert values[:2] == [1, 2] and len(values) >= 4 and messages[:2] == ['已获取token', '下单成功']
+            assert items[0]['order_result']['code'] == '0' and items[-1]['status'] == 301
+        await edaijiamcp.shutdown()
+
+    try:
+        asyncio.run(run())
+    finally:
+        mock.stop()
+    print('模拟服务交互验证通过!')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='e代驾开放平台本地模拟服务')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=18080)
+    parser.add_argument('--latency', type=float, default=0.0, help='基础延迟(秒)')
+    parser.add_argument('--jitter', type=float, default=0.0, help='随机附加延迟上限(秒)')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='返回503的概率')
+    parser.add_argument('--expire-rate', type=float, default=0.0, help='随机返回token过期的概率')
+    parser.add_argument('--token-ttl', type=float, default=None, help='token有效期(秒)')
+    parser.add_argument('--partner', action='append', default=[], metavar='APPKEY:SECRET',
+                        help='额外接受的合作方appkey及其SECRET，可重复指定')
+    parser.add_argument('--self-test', action='store_true', help='运行自测后退出')
+    args = parser.parse_args()
+
+    if args.self_test:
+        test_api_against_mock()
+        return
+
+    import uvicorn
+    config = MockConfig(args.latency, args.jitter, args.error_rate, args.expire_rate, args.token_ttl)
+    partners = dict(item.split(':', 1) for item in args.partner)
+    uvicorn.run(MockEdjServer(config, partners=partners).app, host=args.host, port=args.port,
+                log_level='warning')
+
+
+# 导出类供外部使用
+__all__ = ['MockConfig', 'MockEdjServer']
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,145 @@
+"""上游响应和工具返回值的模型
+
+上游响应解析后按接口包装为ApiResult的子类。ApiResult继承dict且__slots__为空，
+不增加实例字典，按键访问、JSON序列化、预估缓存和幂等日志等现有用法保持不变，
+另外提供常用字段的类型化访问。
+
+工具函数返回JsonToolResult时，文本内容只序列化一次，结构化内容直接引用返回的dict，
+不再经过FastMCP默认的序列化和两次to_jsonable_python深拷贝。
+"""
+from fastmcp.tools.tool import ToolResult
+from mcp.types import TextContent
+
+from .EdjJson import dumps
+
+
+def _to_float(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+class ApiResult(dict):
+    """接口返回结果 {'code': str, 'message': str, 'data': ...}"""
+    __slots__ = ()
+
+    @property
+    def code(self):
+        return self.get('code')
+
+    @property
+    def message(self):
+        return self.get('message')
+
+    @property
+    def data(self):
+        return self.get('data')
+
+    @property
+    def ok(self):
+        return self.get('code') == '0'
+
+    def copy(self):
+        """浅拷贝，保持模型类型"""
+        return type(self)(self)
+
+
+class TokenResult(ApiResult):
+    """/customer/getAuthenToken 的返回结果"""
+    __slots__ = ()
+
+    @property
+    def encrypt_authentoken(self):
+        data = self.get('data')
+        return data.get('encrypt_authentoken') if isinstance(data, dict) else None
+
+
+class EstimateResult(ApiResult):
+    """/order/costestimateV2 的返回结果"""
+    __slots__ = ()
+
+    @property
+    def fee(self):
+        data = self.get('data')
+        return _to_float(data.get('fee')) if isinstance(data, dict) else None
+
+    @property
+    def from_cache(self):
+        return bool(self.get('from_cache'))
+
+
+class PriceListResult(ApiResult):
+    """/city/price/list 的返回结果"""
+    __slots__ = ()
+
+    @property
+    def price_items(self):
+        """价格表条目，data不是列表时返回空列表"""
+        data = self.get('data')
+        return data if isinstance(data, list) else []
+
+
+class OrderResult(ApiResult):
+    """/order/commit 和 /order/polling 的返回结果"""
+    __slots__ = ()
+
+    @property
+    def order_id(self):
+        data = self.get('data')
+        return data.get('order_id') if isinstance(data, dict) else None
+
+    @property
+    def order_status(self):
+        data = self.get('data')
+        return data.get('order_status') if isinstance(data, dict) else None
+
+
+# 接口路径对应的结果模型，未列出的接口使用ApiResult
+RESULT_MODELS = {
+    '/customer/getAuthenToken': TokenResult,
+    '/order/costestimateV2': EstimateResult,
+    '/city/price/list': PriceListResult,
+    '/order/commit': OrderResult,
+    '/order/polling': OrderResult,
+}
+
+
+def wrap_result(endpoint, result):
+    """按接口包装解析后的响应，响应不是JSON对象时返回code为'-2'的ApiResult，原值放在data中
+    Args:
+        endpoint: str, 接口路径
+        result: 解析后的响应
+    Returns:
+        ApiResult: 对应接口的结果模型
+    """
+    if not isinstance(result, dict):
+        return ApiResult({
+            'code': '-2',
+            'message': f'响应格式错误: 期望JSON对象，实际为{type(result).__name__}',
+            'data': result
+        })
+    return RESULT_MODELS.get(endpoint, ApiResult)(result)
+
+
+class JsonToolResult(ToolResult):
+    """工具返回值，payload中只能包含JSON原生类型(dict/list/str/数值/bool/None及其子类)"""
+
+    def __init__(self, payload):
+        """
+        Args:
+            payload: dict, 工具返回的数据，同时作为文本内容和结构化内容
+        Raises:
+            ValueError: payload不是dict
+        """
+        if not isinstance(payload, dict):
+            raise ValueError(f'payload必须是dict，实际为{type(payload).__name__}')
+        # 只把文本内容交给基类初始化；结构化内容传给基类会再做一次to_jsonable_python深拷贝，
+        # payload已经是JSON原生类型，初始化后直接引用
+        super().__init__(content=TextContent(type='text', text=dumps(payload)))
+        self.structured_content = payload
+
+
+# 导出类供外部使用
+__all__ = ['ApiResult', 'EstimateResult', 'JsonToolResult', 'OrderResult', 'PriceListResult',
+           'RESULT_MODELS', 'TokenResult', 'wrap_result']
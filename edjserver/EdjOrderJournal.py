@@ -0,0 +1,424 @@
+import asyncio
+import json
+import os
+import threading
+import time
+
+from .EdjTokenStore import connect_sqlite, state_directory
+
+
+def result_state(result):
+    """根据下单接口返回码确定幂等记录状态
+    Returns:
+        str: done成功；unknown网络失败或响应无法解析，订单可能已创建；failed上游明确拒绝或未发出
+    """
+    code = result.get('code')
+    if code == '0':
+        return 'done'
+    if code in ('-1', '-2'):
+        return 'unknown'
+    return 'failed'
+
+
+def next_attempt(record, retention):
+    """根据幂等键的最新记录计算下一次下单的尝试序号: 没有记录时为1，上次失败或记录已过期时
+    为上次序号加1(重新下单使用新的订单号)，否则为记录中的序号(将重放该记录)"""
+    if record is None:
+        return 1
+    attempt = record.get('attempt') or 1
+    if record['state'] == 'failed' or record['ts'] < time.time() - retention:
+        return attempt + 1
+    return attempt
+
+
+class OrderJournal:
+    """下单幂等日志
+
+    以追加写的JSON行文件记录每个幂等键的下单过程：
+    - inflight: 即将请求上游(落盘后才发起请求)
+    - done: 下单成功，重放时直接返回记录的结果
+    - failed: 上游明确拒绝(code非0)，订单未创建，同一键可以重新下单
+    - unknown: 请求发出后网络失败或被取消，上游是否创建订单无法确定
+    failed的键重新下单时attempt加1，调用方据此生成新的订单号。
+    内存中保存每个键的最新记录，查询为O(1)。多个并发写入合并为一次write+fsync。
+    文件中的过期记录(任何状态，包括崩溃遗留的inflight/unknown)和被覆盖的记录超过阈值时重写文件进行压缩。
+    """
+
+    DEFAULT_RETENTION = 24 * 3600
+    SYNC_DELAY = 0.002
+    COMPACT_MIN_RECORDS = 10000
+
+    def __init__(self, path=None, retention=None):
+        """
+        Args:
+            path: str, 日志文件路径，默认为状态目录下的journal/orders.log(见state_directory，
+                环境变量配置见create_order_journal)
+            retention: float, 记录的保留时间(秒)，超过后在压缩时丢弃，该键可以重新下单
+        """
+        self.path = path or state_directory('journal', 'orders.log')
+        self.retention = retention or self.DEFAULT_RETENTION
+        self._index = None
+        self._file = None
+        self._records = 0
+        self._buffer = []
+        self._sync_future = None
+        self._write_lock = asyncio.Lock()
+        self._running = {}
+        self.replays = 0
+
+    def get(self, key):
+        """查询幂等键的最新记录，不存在返回None"""
+        self._open()
+        return self._index.get(key)
+
+    async def next_attempt(self, key):
+        """该键下一次下单的尝试序号(见next_attempt)"""
+        self._open()
+        return next_attempt(self._index.get(key), self.retention)
+
+    async def run(self, key, commit, third_order_id=None, attempt=1):
+        """按幂等键执行下单
+        Args:
+            key: str, 幂等键
+            commit: 无参协程函数，返回(third_order_id, 接口返回结果)
+            third_order_id: str, 本次下单使用的订单号，记录在inflight记录中便于事后查询
+            attempt: int, 尝试序号(见next_attempt)，记录在日志中
+        Returns:
+            tuple: (记录dict, 是否为重放结果)
+        """
+        self._open()
+        # 同一进程内同一键的并发调用共享一次执行
+        task = self._running.get(key)
+        if task is not None:
+            self.replays += 1
+            return await asyncio.shield(task), True
+        record = self._index.get(key)
+        if record is not None and record['state'] != 'failed' and record['ts'] >= time.time() - self.retention:
+            self.replays += 1
+            return record, True
+
+        task = asyncio.ensure_future(self._run(key, commit, third_order_id, attempt))
+        self._running[key] = task
+        task.add_done_callback(lambda _: self._running.pop(key, None))
+        return await asyncio.shield(task), False
+
+    async def _run(self, key, commit, third_order_id, attempt):
+        await self._append({'key': key, 'state': 'inflight', 'ts': time.time(),
+                            'third_order_id': third_order_id, 'attempt': attempt})
+        try:
+            third_order_id, result = await commit()
+        except BaseException:
+            # 请求可能已发出，结果未知，保留记录由重放方查询订单状态
+            await self._append({'key': key, 'state': 'unknown', 'ts': time.time()})
+            raise
+        record = {'key': key, 'state': result_state(result), 'ts': time.time(),
+                  'third_order_id': third_order_id, 'attempt': attempt, 'result': result}
+        await self._append(record)
+        return record
+
+    def _open(self):
+        if self._index is not None:
+            return
+        self._index = {}
+        if os.path.exists(self.path):
+            with open(self.path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        # 崩溃时可能留下写了一半的最后一行
+                        continue
+                    self._index[record['key']] = record
+                    self._records += 1
+        else:
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        self._file = open(self.path, 'a', encoding='utf-8')
+
+    async def _append(self, record):
+        """写入记录并等待落盘，同一时间窗口内的写入共用一次fsync"""
+        previous = self._index.get(record['key'])
+        if record['state'] == 'unknown' and previous is not None:
+            record = dict(previous, state='unknown', ts=record['ts'])
+        self._index[record['key']] = record
+        self._buffer.append(json.dumps(record, ensure_ascii=False) + '\n')
+        if self._sync_future is None:
+            self._sync_future = asyncio.ensure_future(self._sync())
+        await asyncio.shield(self._sync_future)
+
+    async def _sync(self):
+        await asyncio.sleep(self.SYNC_DELAY)
+        lines, self._buffer = self._buffer, []
+        self._sync_future = None
+        # 写入和压缩串行执行，避免多个线程同时操作文件
+        async with self._write_lock:
+            await asyncio.to_thread(self._write, lines)
+            self._records += len(lines)
+            if self._records >= self.COMPACT_MIN_RECORDS and self._records > 2 * len(self._index):
+                live, expired = self._live_records()
+                await asyncio.to_thread(self._rewrite, live)
+                for key, record in expired.items():
+                    # 压缩期间被更新过的键保留
+                    if self._index.get(key) is record:
+                        del self._index[key]
+
+    def _write(self, lines):
+        self._file.write(''.join(lines))
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def _live_records(self):
+        cutoff = time.time() - self.retention
+        live = {}
+        expired = {}
+        for key, record in self._index.items():
+            # inflight/unknown同样过期(进程在下单过程中崩溃时会遗留)，本进程正在执行的键除外
+            if record['ts'] < cutoff and key not in self._running:
+                expired[key] = record
+            else:
+                live[key] = record
+        return live, expired
+
+    def _rewrite(self, live):
+        tmp_path = self.path + '.compact'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            for record in live.values():
+                f.write(json.dumps(record, ensure_ascii=False) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+        self._file.close()
+        os.replace(tmp_path, self.path)
+        self._file = open(self.path, 'a', encoding='utf-8')
+        self._records = len(live)
+
+    def compact(self):
+        """重写日志，只保留每个键的最新记录并丢弃过期记录(不可与异步写入同时调用)"""
+        self._open()
+        live, expired = self._live_records()
+        self._rewrite(live)
+        for key in expired:
+            del self._index[key]
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+            self._index = None
+
+    def stats(self):
+        self._open()
+        return {'keys': len(self._index), 'records': self._records, 'replays': self.replays}
+
+
+class SqliteOrderJournal:
+    """基于SQLite的下单幂等日志，多个worker进程共享
+
+    记录状态与OrderJournal相同。每个幂等键在BEGIN IMMEDIATE事务中认领，
+    同一时刻只有一个进程向上游提交；其他进程遇到inflight记录时轮询等待结果，
+    超过wait_timeout仍未完成的按结果未知返回。synchronous=FULL，每次提交落盘。
+    超过retention的记录(任何状态)定期删除。
+    """
+
+    DEFAULT_RETENTION = OrderJournal.DEFAULT_RETENTION
+    WAIT_TIMEOUT = 20.0
+    POLL_INTERVAL = 0.1
+    PURGE_EVERY = 1000
+
+    def __init__(self, db_path, retention=None, wait_timeout=None):
+        """
+        Args:
+            db_path: str, 数据库文件路径
+            retention: float, 记录的保留时间(秒)
+            wait_timeout: float, 等待其他进程完成同一幂等键下单的最长时间(秒)
+        """
+        self.path = db_path
+        self.retention = retention or self.DEFAULT_RETENTION
+        self.wait_timeout = wait_timeout or self.WAIT_TIMEOUT
+        self._lock = threading.Lock()
+        self._running = {}
+        self._claims = 0
+        self.replays = 0
+        self._conn = connect_sqlite(db_path, synchronous='FULL')
+        self._conn.execute(
+            'CREATE TABLE IF NOT EXISTS orders (key TEXT PRIMARY KEY, state TEXT, ts REAL, '
+            'third_order_id TEXT, result TEXT, attempt INTEGER DEFAULT 1) WITHOUT ROWID')
+        columns = [row[1] for row in self._conn.execute('PRAGMA table_info(orders)')]
+        if 'attempt' not in columns:
+            # 早期版本创建的表没有attempt列
+            self._conn.execute('ALTER TABLE orders ADD COLUMN attempt INTEGER DEFAULT 1')
+
+    def get(self, key):
+        """查询幂等键的最新记录，不存在返回None"""
+        with self._lock:
+            row = self._conn.execute(
+                'SELECT key, state, ts, third_order_id, result, attempt FROM orders WHERE key = ?',
+                (key,)).fetchone()
+        return self._record(row)
+
+    async def next_attempt(self, key):
+        """该键下一次下单的尝试序号，同OrderJournal.next_attempt"""
+        return next_attempt(await asyncio.to_thread(self.get, key), self.retention)
+
+    @staticmethod
+    def _record(row):
+        if row is None:
+            return None
+        record = {'key': row[0], 'state': row[1], 'ts': row[2], 'third_order_id': row[3],
+                  'attempt': row[5] or 1}
+        if row[4] is not None:
+            record['result'] = json.loads(row[4])
+        return record
+
+    async def run(self, key, commit, third_order_id=None, attempt=1):
+        """按幂等键执行下单，参数和返回值同OrderJournal.run"""
+        task = self._running.get(key)
+        if task is not None:
+            self.replays += 1
+            record, _ = await asyncio.shield(task)
+            return record, True
+        task = asyncio.ensure_future(self._run(key, commit, third_order_id, attempt))
+        self._running[key] = task
+        task.add_done_callback(lambda _: self._running.pop(key, None))
+        record, replayed = await asyncio.shield(task)
+        if replayed:
+            self.replays += 1
+        return record, replayed
+
+    async def _run(self, key, commit, third_order_id, attempt):
+        existing = await asyncio.to_thread(self._claim, key, third_order_id, attempt)
+        if existing is not None:
+            return await self._wait(existing), True
+        try:
+            third_order_id, result = await commit()
+        except BaseException:
+            await asyncio.to_thread(self._update, key, 'unknown', third_order_id, None)
+            raise
+        record = {'key': key, 'state': result_state(result), 'ts': time.time(),
+                  'third_order_id': third_order_id, 'attempt': attempt, 'result': result}
+        await asyncio.to_thread(self._update, key, record['state'], third_order_id, result)
+        return record, False
+
+    def _claim(self, key, third_order_id, attempt):
+        """认领幂等键，成功返回None，已有有效记录时返回该记录"""
+        with self._lock:
+            self._conn.execute('BEGIN IMMEDIATE')
+            try:
+                row = self._conn.execute(
+                    'SELECT key, state, ts, third_order_id, result, attempt FROM orders WHERE key = ?',
+                    (key,)).fetchone()
+                if row is not None and row[1] != 'failed' and row[2] >= time.time() - self.retention:
+                    self._conn.execute('COMMIT')
+                    return self._record(row)
+                self._conn.execute(
+                    'INSERT OR REPLACE INTO orders (key, state, ts, third_order_id, result, attempt) '
+                    'VALUES (?, ?, ?, ?, NULL, ?)', (key, 'inflight', time.time(), third_order_id, attempt))
+                self._claims += 1
+                if self._claims % self.PURGE_EVERY == 0:
+                    self._conn.execute('DELETE FROM orders WHERE ts < ?', (time.time() - self.retention,))
+                self._conn.execute('COMMIT')
+            except BaseException:
+                self._conn.execute('ROLLBACK')
+                raise
+        return None
+
+    def _update(self, key, state, third_order_id, result):
+        payload = None if result is None else json.dumps(result, ensure_ascii=False)
+        with self._lock:
+            if payload is None:
+                # 结果未知时保留已有的返回结果字段
+                self._conn.execute('UPDATE orders SET state = ?, ts = ? WHERE key = ?',
+                                   (state, time.time(), key))
+            else:
+                self._conn.execute(
+                    'UPDATE orders SET state = ?, ts = ?, third_order_id = ?, result = ? WHERE key = ?',
+                    (state, time.time(), third_order_id, payload, key))
+
+    async def _wait(self, record):
+        """其他进程正在下单时等待其结果"""
+        deadline = time.monotonic() + self.wait_timeout
+        while record['state'] == 'inflight' and time.monotonic() < deadline:
+            await asyncio.sleep(self.POLL_INTERVAL)
+            record = await asyncio.to_thread(self.get, record['key']) or record
+        return record
+
+    def compact(self):
+        """删除过期记录(包括崩溃遗留的inflight/unknown)"""
+        with self._lock:
+            self._conn.execute('DELETE FROM orders WHERE ts < ?', (time.time() - self.retention,))
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def stats(self):
+        with self._lock:
+            keys = self._conn.execute('SELECT COUNT(*) FROM orders').fetchone()[0]
+        return {'keys': keys, 'replays': self.replays}
+
+
+def create_order_journal(spec=None):
+    """根据配置创建幂等日志
+    Args:
+        spec: str, 不传则读取环境变量EDJ_ORDER_JOURNAL，格式:
+            文件路径            追加写日志文件(单进程，默认EDJ_STATE_DIR/journal/orders.log)
+            sqlite:文件路径     SQLite数据库(多个worker进程共享)
+    Returns:
+        OrderJournal或SqliteOrderJournal
+    """
+    spec = spec or os.getenv('EDJ_ORDER_JOURNAL') or ''
+    if spec.startswith('sqlite:'):
+        return SqliteOrderJournal(spec[len('sqlite:'):])
+    return OrderJournal(spec or None)
+
+
+def test_order_journal():
+    """测试两种后端: 重放、失败后重新下单的尝试序号、崩溃遗留的inflight记录过期"""
+    import tempfile
+
+    async def run(journal):
+        calls = []
+
+        def commit(third_order_id, code):
+            async def submit():
+                calls.append(third_order_id)
+                return third_order_id, {'code': code}
+            return submit
+
+        assert await journal.next_attempt('k1') == 1
+        record, replayed = await journal.run('k1', commit('A', '1'), 'A', 1)
+        assert record['state'] == 'failed' and not replayed
+        assert await journal.next_attempt('k1') == 2
+        record, replayed = await journal.run('k1', commit('A_2', '0'), 'A_2', 2)
+        assert record['state'] == 'done' and record['attempt'] == 2
+        record, replayed = await journal.run('k1', commit('A_3', '0'), 'A_3', 3)
+        assert replayed and record['third_order_id'] == 'A_2' and calls == ['A', 'A_2']
+        assert await journal.next_attempt('k1') == 2
+
+        # 下单过程中断时记录为unknown，保留期内重放，过期后可以用新的订单号重新下单，压缩时删除
+        async def interrupted():
+            raise asyncio.CancelledError()
+        try:
+            await journal.run('k2', interrupted, 'B', 1)
+        except asyncio.CancelledError:
+            pass
+        record, replayed = await journal.run('k2', commit('B', '0'), 'B', 1)
+        assert replayed and record['state'] == 'unknown'
+        journal.retention = 0.05
+        await asyncio.sleep(0.1)
+        assert await journal.next_attempt('k2') == 2
+        journal.compact()
+        assert journal.get('k2') is None and journal.get('k1') is None
+        assert await journal.next_attempt('k2') == 1
+
+    with tempfile.TemporaryDirectory() as tmp:
+        for journal in (OrderJournal(os.path.join(tmp, 'orders.log')),
+                        SqliteOrderJournal(os.path.join(tmp, 'orders.db'))):
+            asyncio.run(run(journal))
+            journal.close()
+    print('下单幂等日志验证通过!')
+
+
+# 导出类供外部使用
+__all__ = ['OrderJournal', 'SqliteOrderJournal', 'create_order_journal', 'next_attempt', 'result_state']
+
+if __name__ == '__main__':
+    test_order_journal()
@@ -0,0 +1,320 @@
+import asyncio
+import heapq
+import itertools
+import time
+
+from .EdjStatus import (ACTIVE_STATUS, PENDING_STATUS, TERMINAL_STATUS, get_order_status_desc,
+                        get_order_status_group)
+
+
+class TrackedOrder:
+    """跟踪中的订单"""
+    __slots__ = ('third_order_id', 'phone', 'status', 'registered_at', 'updated_at',
+                 'next_poll', 'polls', 'errors', 'history', 'watchers', 'waiters', 'evicted')
+
+    def __init__(self, third_order_id, phone, status):
+        now = time.time()
+        self.third_order_id = third_order_id
+        self.phone = phone
+        self.status = status
+        self.registered_at = now
+        self.updated_at = now
+        self.next_poll = 0.0
+        self.polls = 0
+        self.errors = 0
+        self.history = [(now, status)]
+        self.watchers = []
+        # 等待下一次状态变化的future(见OrderTracker.wait_change)
+        self.waiters = []
+        # 超过最长跟踪时间或连续查询失败过多而停止跟踪
+        self.evicted = False
+
+    @property
+    def finished(self):
+        return self.status in TERMINAL_STATUS
+
+    def snapshot(self):
+        return {
+            'third_order_id': self.third_order_id,
+            'phone': self.phone,
+            'status': self.status,
+            'status_desc': get_order_status_desc(self.status),
+            'status_group': get_order_status_group(self.status),
+            'finished': self.finished,
+            'updated_at': self.updated_at,
+            'polls': self.polls,
+            'history': [{'time': t, 'status': s, 'status_desc': get_order_status_desc(s)}
+                        for t, s in self.history]
+        }
+
+
+class OrderTracker:
+    """订单状态跟踪
+
+    所有订单共用一个调度协程：按下次轮询时间放入最小堆，到期订单各自启动一个查询任务，
+    在并发上限内进行，单次查询超过poll_timeout秒按失败处理，慢查询不会推迟其他订单。
+    轮询间隔按状态分组调整：派单中(102/180)快速轮询，服务中(301-303)放慢，
+    到达终态(304/403/404/506)后停止并在retention秒后移除。始终到不了终态的订单
+    (如501司机报单、查询一直失败)在跟踪超过max_age秒或连续失败max_errors次后移除，
+    跟踪集合不会无限增长。
+    状态变化时依次调用监听函数 listener(order, old_status, new_status)，每次轮询后调用
+    轮询监听函数 listener(order, ok)(ok表示本次是否查询到状态)，订单被移除时
+    order.evicted为True，以ok=False再调用一次。
+    """
+
+    PENDING_INTERVAL = 3.0
+    ACTIVE_INTERVAL = 15.0
+    DEFAULT_INTERVAL = 30.0
+    MAX_ERROR_BACKOFF = 120.0
+    DEFAULT_MAX_CONCURRENCY = 50
+    DEFAULT_RETENTION = 3600.0
+    DEFAULT_MAX_AGE = 12 * 3600.0
+    DEFAULT_MAX_ERRORS = 10
+    DEFAULT_POLL_TIMEOUT = 30.0
+
+    def __init__(self, api, max_concurrency=None, retention=None, max_age=None, max_errors=None,
+                 poll_timeout=None):
+        """
+        Args:
+            api: AsyncEdjApi, 用于查询订单状态和刷新token
+            max_concurrency: int, 最多同时进行的查询数
+            retention: float, 终态订单保留时间(秒)
+            max_age: float, 未到达终态的订单最长跟踪时间(秒)，从登记时算起
+            max_errors: int, 连续查询失败达到该次数后停止跟踪
+            poll_timeout: float, 单次查询(含token刷新)的超时时间(秒)
+        """
+        self.api = api
+        self.max_concurrency = max_concurrency or self.DEFAULT_MAX_CONCURRENCY
+        self.retention = retention or self.DEFAULT_RETENTION
+        self.max_age = max_age or self.DEFAULT_MAX_AGE
+        self.max_errors = max_errors or self.DEFAULT_MAX_ERRORS
+        self.poll_timeout = poll_timeout or self.DEFAULT_POLL_TIMEOUT
+        self._orders = {}
+        self._heap = []
+        self._seq = itertools.count()
+        self._wakeup = None
+        self._task = None
+        self._polling = set()
+        self._listeners = []
+        self._poll_listeners = []
+        self.polls = 0
+        self.transitions = 0
+        self.evicted = 0
+
+    def add_listener(self, listener):
+        """注册状态变化监听，listener为协程函数(order, old_status, new_status)"""
+        self._listeners.append(listener)
+
+    def add_poll_listener(self, listener):
+        """注册轮询监听，listener为协程函数(order, ok)，每次轮询后调用(用于续期与订单相关的租约)"""
+        self._poll_listeners.append(listener)
+
+    def active_orders(self):
+        """尚未到达终态的订单"""
+        return [order for order in self._orders.values() if not order.finished]
+
+    def register(self, third_order_id, phone, status=102, watcher=None):
+        """登记下单成功的订单并开始跟踪
+        Args:
+            third_order_id: str, 第三方订单号
+            phone: str, 下单手机号
+            status: int, 初始状态，默认102开始系统派单
+            watcher: 关注该订单的对象(如MCP会话)，会保存在order.watchers中供监听函数使用
+        Returns:
+            TrackedOrder: 订单跟踪对象
+        """
+        order = self._orders.get(third_order_id)
+        if order is None:
+            order = TrackedOrder(third_order_id, phone, status)
+            self._orders[third_order_id] = order
+            self._schedule(order, time.time() + self._interval(status))
+        if watcher is not None and watcher not in order.watchers:
+            order.watchers.append(watcher)
+        self.start()
+        return order
+
+    def get(self, third_order_id):
+        """获取订单跟踪对象，不存在返回None"""
+        return self._orders.get(third_order_id)
+
+    async def wait_change(self, third_order_id, timeout=None):
+        """等待订单的下一次状态变化
+        Args:
+            third_order_id: str, 第三方订单号
+            timeout: float, 最多等待的秒数
+        Returns:
+            int: 新状态，超时、订单未跟踪或已到达终态时返回None
+        """
+        order = self._orders.get(third_order_id)
+        if order is None or order.finished:
+            return None
+        future = asyncio.get_running_loop().create_future()
+        order.waiters.append(future)
+        try:
+            return await asyncio.wait_for(future, timeout)
+        except asyncio.TimeoutError:
+            return None
+        finally:
+            if future in order.waiters:
+                order.waiters.remove(future)
+
+    def start(self):
+        """在当前事件循环中启动调度协程(重复调用无副作用)"""
+        if self._task is None or self._task.done():
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.ensure_future(self._run())
+        else:
+            self._wakeup.set()
+
+    async def stop(self):
+        tasks = list(self._polling)
+        if self._task is not None:
+            tasks.append(self._task)
+            self._task = None
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._polling.clear()
+
+    def stats(self):
+        active = sum(1 for order in self._orders.values() if not order.finished)
+        return {'tracked': len(self._orders), 'active': active, 'polling': len(self._polling),
+                'polls': self.polls, 'transitions': self.transitions, 'evicted': self.evicted}
+
+    def _interval(self, status):
+        if status in PENDING_STATUS:
+            return self.PENDING_INTERVAL
+        if status in ACTIVE_STATUS:
+            return self.ACTIVE_INTERVAL
+        return self.DEFAULT_INTERVAL
+
+    def _schedule(self, order, at):
+        order.next_poll = at
+        heapq.heappush(self._heap, (at, next(self._seq), order.third_order_id))
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    async def _run(self):
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+        while True:
+            self._wakeup.clear()
+            now = time.time()
+            due = []
+            while self._heap and self._heap[0][0] <= now:
+                at, _, third_order_id = heapq.heappop(self._heap)
+                order = self._orders.get(third_order_id)
+                # 堆中可能残留已重新调度或已结束订单的旧条目
+                if order is None or order.next_poll != at:
+                    continue
+                if order.finished:
+                    if now - order.updated_at >= self.retention:
+                        del self._orders[third_order_id]
+                    else:
+                        self._schedule(order, order.updated_at + self.retention)
+                    continue
+                due.append(order)
+
+            # 每个订单单独查询，查询完成后由_poll重新调度；查询中的订单不在堆中，不会重复查询
+            for order in due:
+                if now - order.registered_at >= self.max_age:
+                    self._polling_task(self._evict(order))
+                else:
+                    self._polling_task(self._poll(order, semaphore))
+            if due:
+                continue
+
+            timeout = self._heap[0][0] - time.time() if self._heap else None
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+    def _polling_task(self, coro):
+        task = asyncio.ensure_future(coro)
+        self._polling.add(task)
+        task.add_done_callback(self._polling.discard)
+
+    async def _poll(self, order, semaphore):
+        async with semaphore:
+            try:
+                status = await asyncio.wait_for(self._fetch_status(order), self.poll_timeout)
+            except Exception:
+                status = None
+        order.polls += 1
+        self.polls += 1
+        now = time.time()
+        if status is None:
+            order.errors += 1
+            if order.errors >= self.max_errors:
+                await self._evict(order)
+                return
+            backoff = min(self.MAX_ERROR_BACKOFF, self._interval(order.status) * (2 ** order.errors))
+            self._schedule(order, now + backoff)
+            await self._notify_poll(order, False)
+            return
+
+        order.errors = 0
+        if status != order.status:
+            old_status = order.status
+            order.status = status
+            order.updated_at = now
+            order.history.append((now, status))
+            self.transitions += 1
+            for future in order.waiters:
+                if not future.done():
+                    future.set_result(status)
+            order.waiters.clear()
+            for listener in self._listeners:
+                try:
+                    await listener(order, old_status, status)
+                except Exception:
+                    pass
+        if order.finished:
+            self._schedule(order, now + self.retention)
+        else:
+            self._schedule(order, now + self._interval(order.status))
+        await self._notify_poll(order, True)
+
+    async def _evict(self, order):
+        """停止跟踪始终未到达终态的订单，等待状态变化的调用方立即返回None"""
+        if self._orders.get(order.third_order_id) is order:
+            del self._orders[order.third_order_id]
+        order.evicted = True
+        self.evicted += 1
+        for future in order.waiters:
+            if not future.done():
+                future.set_result(None)
+        order.waiters.clear()
+        await self._notify_poll(order, False)
+
+    async def _notify_poll(self, order, ok):
+        for listener in self._poll_listeners:
+            try:
+                await listener(order, ok)
+            except Exception:
+                pass
+
+    async def _fetch_status(self, order):
+        """查询一次订单状态，token过期时刷新后重试，失败返回None"""
+        token = self.api.get_token_by_phone(order.phone)
+        if not token:
+            return None
+        result = await self.api.get_order_status(token, order.third_order_id)
+        if result.get('code') == '10':
+            refreshed = await self.api.refresh_authen_token(order.phone, stale_token=token)
+            if refreshed.get('code') != '0':
+                return None
+            token = self.api.get_token_by_phone(order.phone)
+            result = await self.api.get_order_status(token, order.third_order_id)
+        if result.get('code') != '0' or not isinstance(result.get('data'), dict):
+            return None
+        data = result['data']
+        status = data.get('order_status', data.get('status'))
+        try:
+            return int(status)
+        except (TypeError, ValueError):
+            return None
+
+
+# 导出类供外部使用
+__all__ = ['OrderTracker', 'TrackedOrder']
@@ -0,0 +1,482 @@
+import asyncio
+import hashlib
+import itertools
+import os
+import threading
+import time
+
+from .EdjTokenStore import connect_sqlite
+
+
+class LocalBucketStore:
+    """进程内令牌桶存储"""
+
+    # 操作是否会阻塞(需要放到线程中执行)
+    blocking = False
+    SWEEP_MIN_KEYS = 10000
+    SWEEP_IDLE = 600.0
+
+    def __init__(self):
+        self._buckets = {}
+        self._holds = {}
+        self._sweep_at = self.SWEEP_MIN_KEYS
+
+    def take(self, buckets, now):
+        """从每个桶各取一个令牌，全部足够时才扣减
+        Args:
+            buckets: list, [(key, 每秒补充数, 桶容量)]
+            now: float, 当前时间戳
+        Returns:
+            tuple: (等待秒数, 令牌不足的桶key列表)，等待秒数为0表示已取得，否则未扣减任何桶
+        """
+        levels = []
+        wait = 0.0
+        exhausted = []
+        for key, rate, burst in buckets:
+            tokens, updated = self._buckets.get(key, (burst, now))
+            tokens = min(burst, tokens + (now - updated) * rate)
+            levels.append((key, tokens))
+            if tokens < 1:
+                wait = max(wait, (1 - tokens) / rate)
+                exhausted.append(key)
+        if exhausted:
+            return wait, exhausted
+        for key, tokens in levels:
+            self._buckets[key] = (tokens - 1, now)
+        if len(self._buckets) >= self._sweep_at:
+            self._sweep(now)
+        return 0.0, exhausted
+
+    def refund(self, buckets, now):
+        """退还take扣减的令牌(取得许可后调用方已离开时)，不超过桶容量"""
+        for key, rate, burst in buckets:
+            tokens, updated = self._buckets.get(key, (burst, now))
+            self._buckets[key] = (min(burst, tokens + max(0.0, now - updated) * rate + 1), now)
+
+    def _sweep(self, now):
+        # 长时间未使用的桶早已补满，删除后等同于新建；过期的占用标记一并删除
+        stale = [key for key, (_, updated) in self._buckets.items() if now - updated > self.SWEEP_IDLE]
+        for key in stale:
+            del self._buckets[key]
+        expired = [key for key, until in self._holds.items() if until <= now]
+        for key in expired:
+            del self._holds[key]
+        self._sweep_at = max(self.SWEEP_MIN_KEYS, 2 * len(self._buckets))
+
+    def set_hold(self, key, until):
+        self._holds[key] = until
+
+    def get_hold(self, key, now):
+        until = self._holds.get(key)
+        if until is not None and until <= now:
+            del self._holds[key]
+            return None
+        return until
+
+    def clear_hold(self, key):
+        self._holds.pop(key, None)
+
+    def close(self):
+        pass
+
+
+class SqliteBucketStore:
+    """SQLite令牌桶存储(WAL模式)，同一主机上的多个worker进程共享限额
+
+    每次取令牌在一个BEGIN IMMEDIATE事务中读取并更新相关的桶，保证多进程下原子扣减。
+    每SWEEP_INTERVAL秒删除一次空闲超过SWEEP_IDLE的桶和已过期的占用标记，表不随手机号数增长。
+    """
+
+    blocking = True
+    SWEEP_INTERVAL = 60.0
+    SWEEP_IDLE = LocalBucketStore.SWEEP_IDLE
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        self._sweep_after = 0.0
+        self._conn = connect_sqlite(db_path)
+        self._conn.execute(
+            'CREATE TABLE IF NOT EXISTS buckets ('
+            'key TEXT PRIMARY KEY, tokens REAL, updated REAL) WITHOUT ROWID')
+        self._conn.execute(
+            'CREATE TABLE IF NOT EXISTS holds (key TEXT PRIMARY KEY, until REAL) WITHOUT ROWID')
+
+    def take(self, buckets, now):
+        """同LocalBucketStore.take"""
+        with self._lock:
+            self._conn.execute('BEGIN IMMEDIATE')
+            try:
+                levels = []
+                wait = 0.0
+                exhausted = []
+                for key, rate, burst in buckets:
+                    row = self._conn.execute(
+                        'SELECT tokens, updated FROM buckets WHERE key = ?', (key,)).fetchone()
+                    tokens, updated = row if row else (burst, now)
+                    tokens = min(burst, tokens + max(0.0, now - updated) * rate)
+                    levels.append((key, tokens - 1, now))
+                    if tokens < 1:
+                        wait = max(wait, (1 - tokens) / rate)
+                        exhausted.append(key)
+                if not exhausted:
+                    self._conn.executemany(
+                        'INSERT OR REPLACE INTO buckets (key, tokens, updated) VALUES (?, ?, ?)', levels)
+                self._conn.execute('COMMIT')
+            except BaseException:
+                self._conn.execute('ROLLBACK')
+                raise
+            if now >= self._sweep_after:
+                self._sweep(now)
+        return wait, exhausted
+
+    def refund(self, buckets, now):
+        """同LocalBucketStore.refund"""
+        with self._lock:
+            self._conn.execute('BEGIN IMMEDIATE')
+            try:
+                for key, rate, burst in buckets:
+                    row = self._conn.execute(
+                        'SELECT tokens, updated FROM buckets WHERE key = ?', (key,)).fetchone()
+                    tokens, updated = row if row else (burst, now)
+                    self._conn.execute(
+                        'INSERT OR REPLACE INTO buckets (key, tokens, updated) VALUES (?, ?, ?)',
+                        (key, min(burst, tokens + max(0.0, now - updated) * rate + 1), now))
+                self._conn.execute('COMMIT')
+            except BaseException:
+                self._conn.execute('ROLLBACK')
+                raise
+
+    def _sweep(self, now):
+        """删除长时间未使用(早已补满)的桶和过期的占用标记(需持有锁)"""
+        self._sweep_after = now + self.SWEEP_INTERVAL
+        self._conn.execute('DELETE FROM buckets WHERE updated < ?', (now - self.SWEEP_IDLE,))
+        self._conn.execute('DELETE FROM holds WHERE until <= ?', (now,))
+
+    def set_hold(self, key, until):
+        with self._lock:
+            self._conn.execute('INSERT OR REPLACE INTO holds (key, until) VALUES (?, ?)', (key, until))
+
+    def get_hold(self, key, now):
+        with self._lock:
+            row = self._conn.execute('SELECT until FROM holds WHERE key = ?', (key,)).fetchone()
+        if row is None or row[0] <= now:
+            return None
+        return row[0]
+
+    def clear_hold(self, key):
+        with self._lock:
+            self._conn.execute('DELETE FROM holds WHERE key = ?', (key,))
+
+    def close(self):
+        self._conn.close()
+
+
+class _Waiter:
+    __slots__ = ('priority', 'seq', 'buckets', 'keys', 'future')
+
+    def __init__(self, priority, seq, buckets, future):
+        self.priority = priority
+        self.seq = seq
+        self.buckets = buckets
+        self.keys = frozenset(key for key, _, _ in buckets)
+        self.future = future
+
+
+class RateLimiter:
+    """上游调用限流与准入控制
+
+    每次调用需要同时从三级令牌桶各取一个令牌：appkey合计、appkey+接口、
+    appkey+接口+用户(手机号或token)。令牌不足时进入等待队列，按接口优先级
+    (下单 > 认证 > 订单查询 > 预估 > 价格表)依次放行；某个桶上有更高优先级的
+    请求在等待时，后来的请求不会插队。超过max_wait仍未取得令牌的请求被拒绝。
+
+    另外提供按手机号的占用标记(hold)，用于在本地直接拒绝已有进行中订单的手机号再次下单。
+    """
+
+    # 限额: (每秒补充数, 桶容量)
+    DEFAULT_APPKEY_LIMIT = (200.0, 400)
+    DEFAULT_ENDPOINT_LIMITS = {
+        '/customer/getAuthenToken': (20.0, 50),
+        '/city/price/list': (5.0, 20),
+        '/order/costestimateV2': (100.0, 200),
+        '/order/commit': (20.0, 40),
+        '/order/polling': (100.0, 200),
+    }
+    DEFAULT_SUBJECT_LIMITS = {
+        '/customer/getAuthenToken': (0.2, 3),
+        '/order/costestimateV2': (2.0, 10),
+        '/order/commit': (0.1, 2),
+        '/order/polling': (1.0, 5),
+    }
+    PRIORITIES = {
+        '/order/commit': 0,
+        '/customer/getAuthenToken': 1,
+        '/order/polling': 2,
+        '/order/costestimateV2': 3,
+        '/city/price/list': 4,
+    }
+    DEFAULT_MAX_WAIT = 2.0
+
+    def __init__(self, store=None, appkey_limit=None, endpoint_limits=None, subject_limits=None,
+                 max_wait=None, scale=1.0):
+        """
+        Args:
+            store: LocalBucketStore或SqliteBucketStore，默认进程内存储
+            appkey_limit: tuple, appkey所有接口合计的(每秒补充数, 桶容量)
+            endpoint_limits: dict, {接口路径: (每秒补充数, 桶容量)}，覆盖默认值
+            subject_limits: dict, {接口路径: (每秒补充数, 桶容量)}，单个用户的限额，覆盖默认值
+            max_wait: float, 排队等待上限(秒)，0表示令牌不足时立即拒绝
+            scale: float, 所有限额的倍数，便于按上游实际配额整体调整
+        """
+        self.store = store or LocalBucketStore()
+        self.appkey_limit = self._scaled(appkey_limit or self.DEFAULT_APPKEY_LIMIT, scale)
+        self.endpoint_limits = {path: self._scaled(limit, scale) for path, limit in
+                                dict(self.DEFAULT_ENDPOINT_LIMITS, **(endpoint_limits or {})).items()}
+        self.subject_limits = {path: self._scaled(limit, scale) for path, limit in
+                               dict(self.DEFAULT_SUBJECT_LIMITS, **(subject_limits or {})).items()}
+        self.max_wait = self.DEFAULT_MAX_WAIT if max_wait is None else max_wait
+        self._waiters = []
+        # 有请求排队等待令牌的桶，新请求不得绕过队列扣减
+        self._blocked = set()
+        self._seq = itertools.count()
+        self._wakeup = None
+        self._task = None
+        self.admitted = 0
+        self.queued = 0
+        self.rejected = 0
+
+    @classmethod
+    def from_env(cls):
+        """按环境变量创建限流器
+        EDJ_RATE_LIMIT: 设为0关闭限流
+        EDJ_RATE_LIMIT_STORE: local(默认)或sqlite:文件路径(多worker共享)
+        EDJ_RATE_LIMIT_MAX_WAIT: 排队等待上限(秒)
+        EDJ_RATE_LIMIT_SCALE: 所有限额的倍数
+        Returns:
+            RateLimiter或None(已关闭)
+        """
+        if os.getenv('EDJ_RATE_LIMIT', '1') in ('0', 'false', 'False'):
+            return None
+        spec = os.getenv('EDJ_RATE_LIMIT_STORE') or 'local'
+        kind, _, arg = spec.partition(':')
+        if kind == 'local':
+            store = LocalBucketStore()
+        elif kind == 'sqlite' and arg:
+            store = SqliteBucketStore(arg)
+        else:
+            raise ValueError(f"未知的限流存储配置: {spec}")
+        max_wait = os.getenv('EDJ_RATE_LIMIT_MAX_WAIT')
+        return cls(store, max_wait=float(max_wait) if max_wait else None,
+                   scale=float(os.getenv('EDJ_RATE_LIMIT_SCALE', '1')))
+
+    @staticmethod
+    def _scaled(limit, scale):
+        rate, burst = limit
+        return rate * scale, max(1.0, burst * scale)
+
+    @staticmethod
+    def _digest(subject):
+        return hashlib.md5(str(subject).encode()).hexdigest()[:16]
+
+    def _buckets(self, appkey, endpoint, subject):
+        buckets = [(f"rl|{appkey}", *self.appkey_limit)]
+        limit = self.endpoint_limits.get(endpoint)
+        if limit:
+            buckets.append((f"rl|{appkey}|{endpoint}", *limit))
+        limit = self.subject_limits.get(endpoint)
+        if limit and subject:
+            buckets.append((f"rl|{appkey}|{endpoint}|{self._digest(subject)}", *limit))
+        return buckets
+
+    async def _take(self, buckets):
+        if self.store.blocking:
+            return await asyncio.to_thread(self.store.take, buckets, time.time())
+        return self.store.take(buckets, time.time())
+
+    async def acquire(self, appkey, endpoint, subject=None, max_wait=None):
+        """取得一次上游调用的许可
+        Args:
+            appkey: str, 合作方标识
+            endpoint: str, 接口路径
+            subject: str, 用户标识(手机号或token)，不传则只检查appkey和接口限额
+            max_wait: float, 本次最多排队等待的秒数，不传使用默认值
+        Returns:
+            bool: True放行，False被限流
+        """
+        buckets = self._buckets(appkey, endpoint, subject)
+        if not self._blocked.intersection(key for key, _, _ in buckets):
+            wait, _ = await self._take(buckets)
+            if not wait:
+                self.admitted += 1
+                return True
+
+        max_wait = self.max_wait if max_wait is None else max_wait
+        if max_wait <= 0:
+            self.rejected += 1
+            return False
+        waiter = _Waiter(self.PRIORITIES.get(endpoint, len(self.PRIORITIES)), next(self._seq),
+                         buckets, asyncio.get_running_loop().create_future())
+        self._waiters.append(waiter)
+        self.queued += 1
+        self._start()
+        try:
+            await asyncio.wait((waiter.future,), timeout=max_wait)
+        finally:
+            if not waiter.future.done():
+                waiter.future.cancel()
+        if waiter.future.cancelled():
+            self.rejected += 1
+            return False
+        self.admitted += 1
+        return True
+
+    def _start(self):
+        if self._task is None or self._task.done():
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.ensure_future(self._dispatch())
+        else:
+            self._wakeup.set()
+
+    async def _dispatch(self):
+        """按优先级放行排队的请求，直到队列为空"""
+        while True:
+            blocked = set()
+            next_wait = None
+            for waiter in sorted(self._waiters, key=lambda w: (w.priority, w.seq)):
+                if waiter.future.done() or waiter.keys & blocked:
+                    continue
+                wait, exhausted = await self._take(waiter.buckets)
+                if not wait:
+                    if waiter.future.done():
+                        # 取令牌期间(线程中)等待已超时或被取消，退还令牌
+                        await self._call(self.store.refund, waiter.buckets, time.time())
+                    else:
+                        waiter.future.set_result(True)
+                    continue
+                # 令牌不足的桶留给该请求，低优先级请求不得抢先扣减
+                blocked.update(exhausted)
+                next_wait = wait if next_wait is None else min(next_wait, wait)
+            self._blocked = blocked
+            self._waiters = [w for w in self._waiters if not w.future.done()]
+            if not self._waiters:
+                self._blocked = set()
+                return
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), next_wait)
+            except asyncio.TimeoutError:
+                pass
+
+    async def hold(self, phone, ttl):
+        """标记手机号有进行中的订单
+        Args:
+            phone: str, 手机号
+            ttl: float, 标记有效期(秒)，订单结束时应调用release提前清除
+        """
+        await self._call(self.store.set_hold, f"hold|{self._digest(phone)}", time.time() + ttl)
+
+    async def release(self, phone):
+        await self._call(self.store.clear_hold, f"hold|{self._digest(phone)}")
+
+    async def held(self, phone):
+        """手机号是否有进行中的订单标记"""
+        until = await self._call(self.store.get_hold, f"hold|{self._digest(phone)}", time.time())
+        return until is not None
+
+    async def _call(self, fn, *args):
+        if self.store.blocking:
+            return await asyncio.to_thread(fn, *args)
+        return fn(*args)
+
+    def close(self):
+        self.store.close()
+
+    def stats(self):
+        return {'admitted': self.admitted, 'queued': self.queued, 'rejected': self.rejected,
+                'waiting': sum(1 for w in self._waiters if not w.future.done())}
+
+
+
+def test_rate_limiter():
+    """
+    测试令牌桶限流: 突发容量、用户级限额、按优先级排队放行、等待超时拒绝和SQLite共享存储
+    """
+    import tempfile
+
+    async def run(store):
+        limiter = RateLimiter(store, appkey_limit=(10.0, 2), subject_limits={
+            '/order/costestimateV2': (1.0, 1)}, max_wait=0.5)
+        # appkey桶容量2，取完后后续请求需要排队
+        assert await limiter.acquire('k', '/order/costestimateV2', '13800000001')
+        assert await limiter.acquire('k', '/order/costestimateV2', '13800000002')
+        assert not await limiter.acquire('k', '/order/costestimateV2', '13800000003', max_wait=0)
+
+        # 桶空时下单排在先到的预估之前放行
+        order = []
+
+        async def call(endpoint, subject):
+            if await limiter.acquire('k', endpoint, subject, max_wait=1.0):
+                order.append(endpoint)
+
+        await asyncio.gather(call('/order/costestimateV2', '13800000003'),
+                             call('/order/costestimateV2', '13800000004'),
+                             call('/order/commit', '13800000005'))
+        assert order == ['/order/commit', '/order/costestimateV2', '/order/costestimateV2'], order
+
+        # 同一用户的桶每秒补充1个，等待0.2秒仍不足时被拒绝
+        assert not await limiter.acquire('k', '/order/costestimateV2', '13800000001', max_wait=0.2)
+
+        await limiter.hold('13800000005', 60)
+        assert await limiter.held('13800000005')
+        await limiter.release('13800000005')
+        assert not await limiter.held('13800000005')
+
+    async def cancelled_waiter(store):
+        # 等待者在取令牌的线程返回前超时，分派协程退还令牌，后来的请求仍能取得
+        limiter = RateLimiter(store, appkey_limit=(1.0, 1), max_wait=0.05)
+        take = store.take
+
+        def slow_take(buckets, now):
+            time.sleep(0.1)
+            return take(buckets, now)
+        assert await limiter.acquire('k', '/order/commit')
+        # 桶将在排队后补满: 直接取令牌不足，分派协程再取时成功，但此时等待已超时
+        await asyncio.sleep(0.95)
+        store.take = slow_take
+        assert not await limiter.acquire('k', '/order/commit')
+        await asyncio.sleep(0.1)
+        store.take = take
+        assert limiter._task.done()
+        assert await limiter.acquire('k', '/order/commit', max_wait=0)
+
+    asyncio.run(run(LocalBucketStore()))
+    with tempfile.TemporaryDirectory() as tmp:
+        store = SqliteBucketStore(os.path.join(tmp, 'ratelimit.db'))
+        asyncio.run(run(store))
+        # 另一个连接(模拟其他worker)看到相同的桶和占用标记
+        other = SqliteBucketStore(store.db_path)
+        other.set_hold('hold|x', time.time() + 60)
+        assert store.get_hold('hold|x', time.time()) is not None
+
+        # 定期删除空闲的桶和过期的占用标记
+        store.set_hold('hold|old', time.time() - 1)
+        store.take([('rl|idle', 1.0, 1)], time.time() - store.SWEEP_IDLE - 1)
+        count = 'SELECT COUNT(*) FROM buckets WHERE key = ? UNION ALL SELECT COUNT(*) FROM holds WHERE key = ?'
+        assert [row[0] for row in store._conn.execute(count, ('rl|idle', 'hold|old'))] == [1, 1]
+        store._sweep_after = 0.0
+        store.take([('rl|active', 1.0, 1)], time.time())
+        assert [row[0] for row in store._conn.execute(count, ('rl|idle', 'hold|old'))] == [0, 0]
+        assert store.get_hold('hold|x', time.time()) is not None
+        store.close()
+        other.close()
+
+        asyncio.run(cancelled_waiter(SqliteBucketStore(os.path.join(tmp, 'refund.db'))))
+    print('限流验证通过!')
+
+
+# 导出类供外部使用
+__all__ = ['LocalBucketStore', 'SqliteBucketStore', 'RateLimiter']
+
+if __name__ == '__main__':
+    test_rate_limiter()
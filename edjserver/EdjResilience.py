@@ -0,0 +1,162 @@
+import random
+import threading
+import time
+
+import httpx
+
+
+class EndpointPolicy:
+    """单个接口的超时与重试策略"""
+    __slots__ = ('connect_timeout', 'read_timeout', 'max_retries', 'backoff_base',
+                 'backoff_max', 'idempotent', 'coalesce')
+
+    def __init__(self, connect_timeout=3.0, read_timeout=10.0, max_retries=2,
+                 backoff_base=0.2, backoff_max=2.0, idempotent=True, coalesce=False):
+        """
+        Args:
+            connect_timeout: float, 建立连接超时(秒)
+            read_timeout: float, 读取响应超时(秒)
+            max_retries: int, 失败后最多重试次数
+            backoff_base: float, 退避基数(秒)，第n次重试前最多等待 backoff_base * 2^n
+            backoff_max: float, 单次退避上限(秒)
+            idempotent: bool, 接口是否幂等，非幂等接口只有调用方声明幂等时才重试
+            coalesce: bool, 业务参数相同的并发调用是否合并为一次上游请求(只用于只读接口)
+        """
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.idempotent = idempotent
+        self.coalesce = coalesce
+
+    @property
+    def timeout(self):
+        return httpx.Timeout(self.read_timeout, connect=self.connect_timeout)
+
+    def attempts(self, idempotent=None):
+        """本次调用最多尝试次数
+        Args:
+            idempotent: bool, 调用方声明本次请求可安全重复(如下单时带幂等键)
+        """
+        if self.idempotent or idempotent:
+            return 1 + self.max_retries
+        return 1
+
+    def backoff(self, attempt):
+        """第attempt次重试前的等待时间(full jitter)"""
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * (2 ** attempt)))
+
+
+class CircuitBreaker:
+    """接口熔断器
+
+    连续失败failure_threshold次后打开，打开期间直接失败；reset_timeout秒后进入半开状态，
+    放行一个探测请求，成功则关闭，失败则重新打开。
+    """
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, failure_threshold=5, reset_timeout=30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self.rejected = 0
+        self._probing = False
+        self._lock = threading.Lock()
+
+    def allow(self):
+        """是否放行本次请求"""
+        with self._lock:
+            if self.state == self.CLOSED:
+                return True
+            if self.state == self.OPEN and time.monotonic() - self.opened_at >= self.reset_timeout:
+                self.state = self.HALF_OPEN
+                self._probing = False
+            if self.state == self.HALF_OPEN and not self._probing:
+                self._probing = True
+                return True
+            self.rejected += 1
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.state = self.CLOSED
+            self.failures = 0
+            self._probing = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+                self.state = self.OPEN
+                self.opened_at = time.monotonic()
+                self._probing = False
+
+    def release_probe(self):
+        """请求未完成(如被取消)时释放半开状态的探测名额，下一个请求重新探测"""
+        with self._lock:
+            self._probing = False
+
+
+class EdjResilience:
+    """按接口路径(传给EdjApi._build_url的相对路径，不含API_BASE_URL)管理超时、重试策略和熔断器"""
+
+    DEFAULT_POLICIES = {
+        '/customer/getAuthenToken': EndpointPolicy(read_timeout=10.0),
+        '/city/price/list': EndpointPolicy(read_timeout=10.0, coalesce=True),
+        '/order/costestimateV2': EndpointPolicy(read_timeout=8.0, coalesce=True),
+        '/order/polling': EndpointPolicy(read_timeout=5.0, max_retries=1),
+        # 下单不幂等，默认不重试
+        '/order/commit': EndpointPolicy(read_timeout=15.0, idempotent=False),
+    }
+    # 未登记的接口按非幂等处理，不自动重试，避免新增的写接口被重复提交
+    DEFAULT_POLICY = EndpointPolicy(idempotent=False, max_retries=0)
+
+    # 视为上游故障、可以重试的HTTP状态码
+    RETRY_STATUS = frozenset([429, 502, 503, 504])
+
+    def __init__(self, policies=None, failure_threshold=5, reset_timeout=30.0):
+        """
+        Args:
+            policies: dict, {接口路径: EndpointPolicy}，覆盖默认策略，路径如'/order/commit'
+            failure_threshold: int, 熔断器连续失败阈值
+            reset_timeout: float, 熔断器打开后多久进入半开状态(秒)
+        """
+        self.policies = dict(self.DEFAULT_POLICIES)
+        self.policies.update(policies or {})
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._breakers = {}
+        self.retries = 0
+
+    def policy(self, endpoint):
+        return self.policies.get(endpoint, self.DEFAULT_POLICY)
+
+    def breaker(self, endpoint):
+        breaker = self._breakers.get(endpoint)
+        if breaker is None:
+            breaker = self._breakers.setdefault(
+                endpoint, CircuitBreaker(self.failure_threshold, self.reset_timeout))
+        return breaker
+
+    def is_retryable(self, exc):
+        """网络错误、超时和上游过载/网关错误可以重试"""
+        if isinstance(exc, httpx.HTTPStatusError):
+            return exc.response.status_code in self.RETRY_STATUS or exc.response.status_code >= 500
+        return isinstance(exc, httpx.TransportError)
+
+    def stats(self):
+        return {
+            'retries': self.retries,
+            'breakers': {endpoint: {'state': b.state, 'failures': b.failures, 'rejected': b.rejected}
+                         for endpoint, b in self._breakers.items()}
+        }
+
+
+# 导出类供外部使用
+__all__ = ['EndpointPolicy', 'CircuitBreaker', 'EdjResilience']
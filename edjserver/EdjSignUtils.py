@@ -1,8 +1,12 @@
 import hashlib
-from typing import Dict, List
+import secrets
+import string
+import threading
+import time
+from datetime import datetime
+from operator import itemgetter
+from typing import Dict, List, Optional, Tuple
 import collections
-from Crypto.Cipher import AES
-from Crypto.Util.Padding import unpad
 import base64
 
 class EdjSignUtils:
@@ -10,6 +14,7 @@ class EdjSignUtils:
     e代驾签名工具类
     """
     DEFAULT_RANDOMKEY = "1234567890abcdef"
+    RANDOMKEY_ALPHABET = string.ascii_letters + string.digits
     
     @staticmethod
     def generate_sig(params: Dict[str, str], secret: str) -> str:
@@ -26,22 +31,24 @@ class EdjSignUtils:
         return sig
     
     @staticmethod
-    def decrypt_token(encrypt_token: str) -> str:
+    def decrypt_token(encrypt_token: str, randomkey: Optional[str] = None, cache: bool = True) -> str:
         """
         AES解密token
         :param encrypt_token: 加密的token字符串
-        :param random_key: 解密密钥(randomkey参数值)
+        :param randomkey: 解密密钥(请求时的randomkey参数值)，不传则使用DEFAULT_RANDOMKEY
+        :param cache: 是否缓存该密钥的解密对象，只使用一次的随机密钥传False
         :return: 解密后的token
         """
-        
-        # 使用randomkey作为密钥进行AES解密
-        cipher = AES.new(EdjSignUtils.DEFAULT_RANDOMKEY.encode(), AES.MODE_ECB)
-        # base64解码后进行AES解密
-        encrypted_data = base64.b64decode(encrypt_token)
-        decrypted_data = cipher.decrypt(encrypted_data)
-        # 去除填充
-        token = unpad(decrypted_data, AES.block_size).decode()
-        return token
+        return token_decryptor.decrypt(encrypt_token, randomkey or EdjSignUtils.DEFAULT_RANDOMKEY, cache)
+
+    @staticmethod
+    def generate_randomkey() -> str:
+        """
+        生成认证请求的randomkey: 16位字母数字，作为AES-128密钥，每次请求使用新的密钥
+        :return: randomkey字符串
+        """
+        alphabet = EdjSignUtils.RANDOMKEY_ALPHABET
+        return ''.join([secrets.choice(alphabet) for _ in range(16)])
 
     @staticmethod
     def sort(params: Dict[str, str]) -> List:
@@ -74,6 +81,192 @@ class EdjSignUtils:
         md5_hash.update(plain_text.encode())
         return md5_hash.hexdigest()
 
+class Signer:
+    """
+    预计算的签名上下文，按(appkey, secret, ver, from)构建一次后重复使用
+    - secret前缀的MD5状态预先计算，每次签名复制后继续update
+    - 静态系统参数预先排序并转成字符串片段，每次只处理本次请求的参数
+    生成的签名与EdjSignUtils.generate_sig完全一致
+    """
+    EXCLUDED_KEYS = frozenset(['gpsstring', 'callback', '_', 'sig'])
+
+    def __init__(self, secret: str, appkey: str, ver: str, from_channel: str):
+        """
+        :param secret: e代驾分配的SECRET
+        :param appkey: 合作方标识
+        :param ver: 接口版本号
+        :param from_channel: 业务渠道(系统参数from)
+        """
+        self.secret = secret
+        self.static_params = {'appkey': appkey, 'ver': ver, 'from': from_channel}
+        self._prefix = hashlib.md5(secret.encode())
+        self._suffix = secret.encode()
+        self._static_items = sorted(
+            (key, self._piece(key, value)) for key, value in self.static_params.items())
+        self._ts_second = None
+        self._ts_value = None
+
+    def sign(self, params: Dict[str, str], timestamp: Optional[str] = None) -> Dict[str, str]:
+        """
+        合并系统参数并签名，等价于 params.update(系统参数) 后调用generate_sig
+        :param params: 业务参数，原地添加系统参数和sig
+        :param timestamp: 系统参数timestamp，不传则取当前时间
+        :return: 添加了系统参数和签名后的参数字典
+        """
+        timestamp = timestamp or self._timestamp()
+        static_params = self.static_params
+        items = [(key, self._piece(key, value)) for key, value in params.items()
+                 if key not in static_params and key != 'timestamp']
+        items.append(('timestamp', 'timestamp' + timestamp))
+        items.sort(key=itemgetter(0))
+        # 两段已排序序列拼接后排序，timsort按两个run归并，代价为线性
+        items += self._static_items
+        items.sort(key=itemgetter(0))
+        params.update(static_params)
+        params['timestamp'] = timestamp
+        params['sig'] = self._digest(items)
+        return params
+
+    def generate_sig(self, params: Dict[str, str]) -> str:
+        """
+        对任意参数字典签名，结果与EdjSignUtils.generate_sig(params, secret)一致
+        :param params: 本次请求的所有参数
+        :return: 签名字符串
+        """
+        items = sorted(((key, self._piece(key, value)) for key, value in params.items()),
+                       key=itemgetter(0))
+        return self._digest(items)
+
+    def _digest(self, items) -> str:
+        md5_hash = self._prefix.copy()
+        md5_hash.update(''.join([piece for _, piece in items]).encode())
+        md5_hash.update(self._suffix)
+        return md5_hash.hexdigest()[:30]
+
+    @classmethod
+    def _piece(cls, key, value) -> str:
+        if key in cls.EXCLUDED_KEYS:
+            return ''
+        if value is not None and value != '':
+            return str(key) + str(value)
+        return str(key)
+
+    def _timestamp(self) -> str:
+        # 同一秒内复用格式化结果
+        now = int(time.time())
+        if now != self._ts_second:
+            self._ts_value = datetime.fromtimestamp(now).strftime("%Y-%m-%d %H:%M:%S")
+            self._ts_second = now
+        return self._ts_value
+
+
+_AES = None
+
+
+def _aes():
+    """pycryptodome导入较慢，只在需要解密时加载，缩短服务冷启动时间"""
+    global _AES
+    if _AES is None:
+        from Crypto.Cipher import AES
+        _AES = AES
+    return _AES
+
+
+class TokenDecryptor:
+    """
+    认证token解密器
+    - 按randomkey缓存AES(ECB)解密对象，同一密钥不重复创建
+    - decrypt_many按密钥分组，每组的密文拼接后一次解密(ECB各分组独立)，再按长度切分去填充
+    pycryptodome在第一次解密时才导入，不影响服务冷启动
+    """
+    BLOCK_SIZE = 16
+    DEFAULT_MAX_CIPHERS = 256
+
+    def __init__(self, max_ciphers: Optional[int] = None):
+        """
+        :param max_ciphers: 最多缓存的解密对象数，按最近使用淘汰
+        """
+        self.max_ciphers = max_ciphers or self.DEFAULT_MAX_CIPHERS
+        self._ciphers = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self.cipher_hits = 0
+        self.cipher_misses = 0
+
+    def decrypt(self, encrypt_token: str, randomkey: str, cache: bool = True) -> str:
+        """
+        解密单个token
+        :param encrypt_token: base64编码的密文
+        :param randomkey: 请求时的randomkey
+        :param cache: 是否缓存该密钥的解密对象，只使用一次的随机密钥传False
+        :return: 解密后的token
+        :raises ValueError: 密文或填充不合法
+        """
+        data = base64.b64decode(encrypt_token)
+        if not data or len(data) % self.BLOCK_SIZE:
+            raise ValueError("密文长度不是AES分组长度的整数倍")
+        return self._unpad(self._cipher(randomkey, cache).decrypt(data))
+
+    def decrypt_many(self, items: List[Tuple[str, str]]) -> List[Optional[str]]:
+        """
+        批量解密，单个密文不合法时对应位置为None，不影响其他token
+        :param items: [(base64密文, randomkey)]
+        :return: 与items顺序一致的token列表
+        """
+        results = [None] * len(items)
+        groups = {}
+        for index, (encrypt_token, randomkey) in enumerate(items):
+            try:
+                data = base64.b64decode(encrypt_token)
+            except (ValueError, TypeError):
+                continue
+            if data and not len(data) % self.BLOCK_SIZE:
+                groups.setdefault(randomkey, []).append((index, data))
+        for randomkey, group in groups.items():
+            plain = self._cipher(randomkey, cache=len(group) > 1).decrypt(b''.join([data for _, data in group]))
+            offset = 0
+            for index, data in group:
+                try:
+                    results[index] = self._unpad(plain[offset:offset + len(data)])
+                except ValueError:
+                    pass
+                offset += len(data)
+        return results
+
+    def _cipher(self, randomkey: str, cache: bool = True):
+        """获取解密对象，cache为False时(密钥只用一次)不写入缓存"""
+        with self._lock:
+            cipher = self._ciphers.get(randomkey)
+            if cipher is not None:
+                self._ciphers.move_to_end(randomkey)
+                self.cipher_hits += 1
+                return cipher
+            self.cipher_misses += 1
+        aes = _aes()
+        cipher = aes.new(randomkey.encode(), aes.MODE_ECB)
+        if cache:
+            with self._lock:
+                self._ciphers[randomkey] = cipher
+                if len(self._ciphers) > self.max_ciphers:
+                    self._ciphers.popitem(last=False)
+        return cipher
+
+    def _unpad(self, data: bytes) -> str:
+        """去除PKCS7填充并解码"""
+        pad = data[-1] if data else 0
+        if not 1 <= pad <= self.BLOCK_SIZE or data[-pad:] != bytes([pad]) * pad:
+            raise ValueError("PKCS7填充不合法")
+        return data[:-pad].decode()
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            size = len(self._ciphers)
+        return {'ciphers': size, 'cipher_hits': self.cipher_hits, 'cipher_misses': self.cipher_misses}
+
+
+# 进程级默认解密器
+token_decryptor = TokenDecryptor()
+
+
 def test_generate_sig():
     """
     测试签名生成方法
@@ -103,7 +296,67 @@ def test_generate_sig():
     print(f'生成的签名值: {sig}')
     print('签名验证通过!')
 
+def test_signer_matches_generate_sig():
+    """
+    测试Signer与generate_sig结果一致
+    """
+    import random
+    secret = '0031186e-5cc6-45a6-a090-3e88ec220452'
+    signer = Signer(secret, appkey='61000158', ver='3.4.3', from_channel='01012345')
+
+    # 固定向量
+    params = {'longitude': '116.476169', 'latitude': '40.018682', 'city_name': '北京'}
+    sig = signer.sign(params, timestamp='2019-06-15 11:57:11')['sig']
+    assert sig == '7bebf0fe6453861c9d304a83bc0eed', f'签名验证失败: 实际值={sig}'
+
+    # 随机参数: 含空值、None、数字、排除字段以及与系统参数同名的键
+    keys = ['token', 'phone', 'start_latitude', 'end_longitude', 'channel', 'bonus_sn',
+            'is_use_bonus', 'callback', 'sig', '_', 'appkey', 'ver', 'timestamp', 'Z', 'a_b']
+    values = ['', None, 0, 1, 3.14159, 116.476169, '北京', 'abc', 'x y', False]
+    rng = random.Random(20190615)
+    for _ in range(2000):
+        params = {k: rng.choice(values) for k in rng.sample(keys, rng.randint(0, len(keys)))}
+        expected_params = dict(params)
+        expected_params.update(signer.static_params)
+        expected_params['timestamp'] = '2019-06-15 11:57:11'
+        expected = EdjSignUtils.generate_sig(expected_params, secret)
+        assert signer.generate_sig(expected_params) == expected
+        assert signer.sign(params, timestamp='2019-06-15 11:57:11')['sig'] == expected
+    print('Signer签名一致性验证通过!')
+
+def test_token_decryptor():
+    """
+    测试token解密: 每次请求不同的randomkey、单个解密与批量解密结果一致，非法密文不影响其他token
+    """
+    from Crypto.Cipher import AES
+    from Crypto.Util.Padding import pad
+
+    def encrypt(token, randomkey):
+        cipher = AES.new(randomkey.encode(), AES.MODE_ECB)
+        return base64.b64encode(cipher.encrypt(pad(token.encode(), AES.block_size))).decode()
+
+    decryptor = TokenDecryptor(max_ciphers=4)
+    keys = [EdjSignUtils.generate_randomkey() for _ in range(6)]
+    assert len(set(keys)) == 6 and all(len(k) == 16 and k.isalnum() for k in keys)
+    # 长度覆盖整分组(需要一个完整填充分组)和非整分组
+    tokens = [secrets.token_hex(n) for n in (8, 16, 32, 5, 31, 32)]
+    items = [(encrypt(token, keys[n % 3]), keys[n % 3]) for n, token in enumerate(tokens)]
+    assert [decryptor.decrypt(*item) for item in items] == tokens
+    assert EdjSignUtils.decrypt_token(encrypt(tokens[0], EdjSignUtils.DEFAULT_RANDOMKEY)) == tokens[0]
+
+    items.insert(2, ('not base64!', keys[0]))
+    items.insert(4, (encrypt('x', keys[1])[:-4], keys[1]))
+    items.append((encrypt(tokens[0], keys[3]), keys[4]))
+    results = decryptor.decrypt_many(items)
+    assert results[:2] == tokens[:2] and results[2] is None and results[3] == tokens[2]
+    assert results[4] is None and results[5:-1] == tokens[3:]
+    assert results[-1] is None or results[-1] != tokens[0]
+    assert decryptor.stats()['ciphers'] <= 4
+    print('token解密验证通过!')
+
 if __name__ == '__main__':
     test_generate_sig()
+    test_signer_matches_generate_sig()
+    test_token_decryptor()
 # 导出类供外部使用
-__all__ = ['EdjSignUtils']
+__all__ = ['EdjSignUtils', 'Signer', 'TokenDecryptor', 'token_decryptor']
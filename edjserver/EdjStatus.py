@@ -40,6 +40,9 @@ COMPLETED_STATUS = [304]  # 已完成状态
 CANCELLED_STATUS = [403, 404]  # 已取消状态
 FAILED_STATUS = [501, 506]  # 失败状态
 
+# 终态，到达后不再变化
+TERMINAL_STATUS = [304, 403, 404, 506]
+
 def get_order_status_desc(status_code):
     """
     获取订单状态描述
@@ -49,6 +52,25 @@ def get_order_status_desc(status_code):
     return ORDER_STATUS.get(status_code, "未知状态")
 
 
+def get_order_status_group(status_code):
+    """
+    获取订单状态所属分组
+    :param status_code: 状态码
+    :return: pending/active/completed/cancelled/failed，未知状态返回unknown
+    """
+    if status_code in PENDING_STATUS:
+        return "pending"
+    if status_code in ACTIVE_STATUS:
+        return "active"
+    if status_code in COMPLETED_STATUS:
+        return "completed"
+    if status_code in CANCELLED_STATUS:
+        return "cancelled"
+    if status_code in FAILED_STATUS:
+        return "failed"
+    return "unknown"
+
+
 def get_api_response_desc(code):
     """
     获取API返回码描述
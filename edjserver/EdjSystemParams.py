@@ -1,10 +1,3 @@
-from typing_extensions import NoExtraItems
-import requests
-import json
-from Crypto.Cipher import AES
-import base64
-import random
-import string
 from datetime import datetime
 from .EdjSignUtils import EdjSignUtils
 
@@ -19,14 +12,18 @@ class EdjSystemParams:
     DEFAULT_FROM_CHANNEL = "01012345"  # 默认业务渠道
 
     @staticmethod
-    def get_system_params():
-        """获取完整的系统级参数"""
+    def get_system_params(appkey=None, ver=None, from_channel=None):
+        """获取完整的系统级参数
+        :param appkey: 合作方标识，如果不提供则使用默认值
+        :param ver: 接口版本号，如果不提供则使用默认值
+        :param from_channel: 业务渠道，如果不提供则使用默认值
+        """
         
         params = {
-            "appkey": EdjSystemParams.DEFAULT_APPKEY,
+            "appkey": appkey or EdjSystemParams.DEFAULT_APPKEY,
             "timestamp": EdjSystemParams.get_timestamp(),
-            "ver": EdjSystemParams.DEFAULT_VER,
-            "from": EdjSystemParams.DEFAULT_FROM_CHANNEL
+            "ver": ver or EdjSystemParams.DEFAULT_VER,
+            "from": from_channel or EdjSystemParams.DEFAULT_FROM_CHANNEL
         }
         return params
     
@@ -0,0 +1,223 @@
+"""多租户(合作方渠道)配置
+
+一个部署同时服务多个合作方渠道时，每个渠道有独立的appkey/secret、业务渠道号和上游地址。
+TenantRegistry在启动时为每个租户构建一次运行时状态(签名器、连接池、token缓存和后台刷新、
+价格表、订单跟踪)，工具调用时按租户名取用，不在请求路径上创建任何对象。
+
+配置通过环境变量EDJ_TENANTS指定，值为JSON文件路径或JSON字符串:
+    {
+        "default": "partner_a",
+        "tenants": {
+            "partner_a": {"appkey": "61000158", "secret_env": "PARTNER_A_SECRET", "from": "01012345"},
+            "partner_b": {"appkey": "61000200", "secret": "...", "api_base_url": "https://..."}
+        }
+    }
+未设置EDJ_TENANTS时，按APP_KEY、SECRET、API_BASE_URL构建单个default租户，token沿用原有存储布局。
+"""
+import json
+import os
+
+from .EdjApi import AsyncEdjApi
+from .EdjCityPrice import CityPriceIndex
+from .EdjEstimateCache import EdjEstimateCache
+from .EdjGeo import ServiceArea
+from .EdjAudit import AuditLog
+from .EdjOrderTracker import OrderTracker
+from .EdjRateLimit import RateLimiter
+from .EdjSystemParams import EdjSystemParams
+from .EdjTokenCache import EdjTokenCache, token_cache as default_token_cache
+from .EdjTokenRefresher import TokenRefresher
+from .EdjTokenStore import NamespacedTokenStore
+
+
+class TenantConfig:
+    """单个租户的静态配置"""
+    __slots__ = ('name', 'appkey', 'secret', 'api_base_url', 'ver', 'from_channel', 'token_namespace')
+
+    def __init__(self, name, appkey=None, secret=None, api_base_url=None, ver=None,
+                 from_channel=None, token_namespace=None):
+        """
+        Args:
+            name: str, 租户名，工具参数tenant按此选择
+            appkey: str, 合作方标识
+            secret: str, e代驾分配的SECRET
+            api_base_url: str, API基础URL，不传则使用默认值
+            ver: str, 接口版本号，不传则使用默认值
+            from_channel: str, 业务渠道(系统参数from)，不传则使用默认值
+            token_namespace: str, token存储命名空间，为空时不加前缀(单租户的原有布局)
+        """
+        self.name = name
+        self.appkey = appkey or EdjSystemParams.DEFAULT_APPKEY
+        self.secret = secret or EdjSystemParams.DEFAULT_SECRET
+        self.api_base_url = api_base_url
+        self.ver = ver
+        self.from_channel = from_channel
+        self.token_namespace = token_namespace
+
+    @classmethod
+    def from_dict(cls, name, data):
+        """从配置项创建，secret可通过secret_env引用环境变量，避免明文写在配置文件中"""
+        secret = data.get('secret')
+        if not secret and data.get('secret_env'):
+            secret = os.getenv(data['secret_env'])
+        if not data.get('appkey') or not secret:
+            raise ValueError(f"租户 {name} 缺少appkey或secret")
+        return cls(name, appkey=data['appkey'], secret=secret,
+                   api_base_url=data.get('api_base_url'), ver=data.get('ver'),
+                   from_channel=data.get('from'),
+                   token_namespace=data.get('token_namespace', name))
+
+
+class Tenant:
+    """一个租户的运行时状态，由TenantRegistry在启动时构建"""
+    __slots__ = ('name', 'config', 'api', 'price_index', 'order_tracker', 'token_refresher')
+
+    def __init__(self, config, api):
+        self.name = config.name
+        self.config = config
+        self.api = api
+        self.price_index = CityPriceIndex(api)
+        self.order_tracker = OrderTracker(api)
+        self.token_refresher = TokenRefresher(api, name=config.name)
+
+    def scoped(self, key):
+        """为幂等键、订单号摘要等本地键加上租户前缀(无命名空间时原样返回)"""
+        namespace = self.config.token_namespace
+        return f"{namespace}.{key}" if namespace else key
+
+
+class TenantRegistry:
+    """租户注册表，启动时为每个租户构建一次签名器、连接池和token缓存
+
+    所有租户共用一个token存储(按命名空间隔离)、一个限流器(限额按appkey区分)、预估缓存
+    (缓存键包含token，不会跨租户命中)和服务区域索引；连接池、熔断器、价格表和订单跟踪按租户独立。
+    """
+
+    DEFAULT_TENANT = 'default'
+
+    def __init__(self, configs, default=None, token_store=None, rate_limiter=None,
+                 estimate_cache=None, metrics=None, service_area=None, audit_log=None):
+        """
+        Args:
+            configs: list, TenantConfig列表
+            default: str, 未指定租户时使用的租户名，默认为第一个
+            token_store: TokenStore, 共享的token存储，默认使用进程级token缓存的存储
+            rate_limiter: RateLimiter, 共享的限流器，默认按环境变量创建
+            estimate_cache: EdjEstimateCache, 共享的预估缓存，默认按环境变量创建
+            service_area: ServiceArea, 共享的服务区域索引，默认按环境变量创建
+            audit_log: AuditLog, 共享的上游调用审计日志，默认按环境变量创建
+            metrics: EdjMetrics, 上游调用指标，默认使用进程级注册表
+        """
+        if not configs:
+            raise ValueError("至少需要配置一个租户")
+        self.token_store = token_store or default_token_cache.store
+        self.rate_limiter = rate_limiter if rate_limiter is not None else RateLimiter.from_env()
+        estimate_cache = estimate_cache if estimate_cache is not None else EdjEstimateCache.from_env()
+        # 服务区域由上游决定，各租户共用一份索引
+        self.service_area = service_area if service_area is not None else ServiceArea.from_env()
+        # 所有租户的上游调用写入同一份审计日志(记录中含appkey)
+        self.audit_log = audit_log if audit_log is not None else AuditLog.from_env()
+        self._tenants = {}
+        for config in configs:
+            if config.name in self._tenants:
+                raise ValueError(f"租户名重复: {config.name}")
+            if config.token_namespace:
+                store = NamespacedTokenStore(self.token_store, config.token_namespace)
+                token_cache = EdjTokenCache(store=store)
+            elif token_store is None:
+                token_cache = default_token_cache
+            else:
+                token_cache = EdjTokenCache(store=token_store)
+            api = AsyncEdjApi(appkey=config.appkey, secret=config.secret,
+                              api_base_url=config.api_base_url, token_cache=token_cache,
+                              estimate_cache=estimate_cache, metrics=metrics, ver=config.ver,
+                              from_channel=config.from_channel, rate_limiter=self.rate_limiter,
+                              service_area=self.service_area, audit_log=self.audit_log)
+            self._tenants[config.name] = Tenant(config, api)
+        self.default = default or configs[0].name
+        if self.default not in self._tenants:
+            raise ValueError(f"默认租户 {self.default} 未配置")
+
+    @classmethod
+    def from_env(cls, **kwargs):
+        """按环境变量EDJ_TENANTS创建，未设置时按APP_KEY/SECRET/API_BASE_URL创建单个租户
+        Args:
+            **kwargs: 其余参数同__init__
+        Returns:
+            TenantRegistry
+        """
+        spec = os.getenv('EDJ_TENANTS')
+        if not spec:
+            config = TenantConfig(cls.DEFAULT_TENANT, appkey=os.getenv('APP_KEY'),
+                                  secret=os.getenv('SECRET'), api_base_url=os.getenv('API_BASE_URL'))
+            return cls([config], **kwargs)
+        configs, default = cls.load_configs(spec)
+        return cls(configs, default=os.getenv('EDJ_DEFAULT_TENANT') or default, **kwargs)
+
+    @staticmethod
+    def load_configs(spec):
+        """解析租户配置
+        Args:
+            spec: str, JSON文件路径或JSON字符串
+        Returns:
+            tuple: (TenantConfig列表, 默认租户名或None)
+        """
+        if spec.lstrip().startswith('{'):
+            data = json.loads(spec)
+        else:
+            with open(spec, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        tenants = data.get('tenants') or {}
+        configs = [TenantConfig.from_dict(name, item) for name, item in tenants.items()]
+        return configs, data.get('default')
+
+    def get(self, name=None):
+        """按租户名获取租户，不传则返回默认租户
+        Raises:
+            ValueError: 租户未配置
+        """
+        tenant = self._tenants.get(name or self.default)
+        if tenant is None:
+            raise ValueError(f"未知的租户: {name}")
+        return tenant
+
+    def names(self):
+        return list(self._tenants)
+
+    def __iter__(self):
+        return iter(self._tenants.values())
+
+    def __len__(self):
+        return len(self._tenants)
+
+    def sum_stats(self, stats, component=None):
+        """汇总各租户组件的统计
+        Args:
+            stats: 函数，参数为Tenant，返回{名称: 数值}
+            component: 函数，参数为Tenant，返回统计所属的组件；指定时多个租户共用的组件只统计一次
+        Returns:
+            dict: 按名称相加后的统计
+        """
+        total = {}
+        seen = set()
+        for tenant in self._tenants.values():
+            if component is not None:
+                source = id(component(tenant))
+                if source in seen:
+                    continue
+                seen.add(source)
+            for key, value in stats(tenant).items():
+                if isinstance(value, (int, float)) and not isinstance(value, bool):
+                    total[key] = total.get(key, 0) + value
+        return total
+
+    async def aclose(self):
+        """停止各租户的订单跟踪和token刷新并关闭连接池，共享的存储和限流器由调用方关闭"""
+        for tenant in self._tenants.values():
+            await tenant.order_tracker.stop()
+            await tenant.token_refresher.stop()
+            await tenant.api.aclose()
+
+
+# 导出类供外部使用
+__all__ = ['Tenant', 'TenantConfig', 'TenantRegistry']
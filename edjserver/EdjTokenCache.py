@@ -0,0 +1,243 @@
+import asyncio
+import os
+import threading
+import time
+from collections import OrderedDict, deque
+
+from .EdjTokenStore import create_token_store
+
+
+class TokenEntry:
+    """缓存中的单个token及其时间信息"""
+    __slots__ = ('token', 'issued_at', 'last_used')
+
+    def __init__(self, token, issued_at, last_used=None):
+        self.token = token
+        self.issued_at = issued_at
+        self.last_used = last_used or issued_at
+
+
+class TokenLifetime:
+    """根据观察到的过期估计token有效期
+
+    上游不返回token有效期，只能在请求返回过期时得知。token过期时的年龄(当前时间减签发时间)
+    是有效期的上界，取最近若干次观察的较低分位数作为估计，偏早刷新而不是偏晚。
+    年龄小于MIN_LIFETIME的观察多半是token被其他原因作废(例如用户在别处重新登录)，忽略，
+    避免估计值被拉低后频繁刷新。
+    """
+
+    DEFAULT_SAMPLES = 50
+    QUANTILE = 0.1
+    MIN_LIFETIME = 300.0
+
+    def __init__(self, initial=None, samples=None):
+        """
+        Args:
+            initial: float, 尚无观察时使用的有效期(秒)，不传则在首次观察到过期前不做估计
+            samples: int, 保留的最近观察数
+        """
+        self.initial = initial
+        self._ages = deque(maxlen=samples or self.DEFAULT_SAMPLES)
+        self._estimate = initial
+
+    @classmethod
+    def from_env(cls):
+        """初始有效期读取环境变量EDJ_TOKEN_LIFETIME(秒)"""
+        initial = os.getenv('EDJ_TOKEN_LIFETIME')
+        return cls(float(initial) if initial else None)
+
+    def observe(self, age):
+        """记录一次token过期时的年龄(秒)
+        Returns:
+            bool: 是否计入估计
+        """
+        if age < self.MIN_LIFETIME:
+            return False
+        self._ages.append(age)
+        ages = sorted(self._ages)
+        self._estimate = ages[int((len(ages) - 1) * self.QUANTILE)]
+        return True
+
+    @property
+    def value(self):
+        """估计的有效期(秒)，尚无估计时为None"""
+        return self._estimate
+
+    @property
+    def samples(self):
+        return len(self._ages)
+
+
+class EdjTokenCache:
+    """进程内token缓存
+
+    - LRU淘汰，超过max_size时移除最久未使用的手机号
+    - 未命中时从TokenStore懒加载
+    - ttl不为空时，签发超过ttl的token视为过期，按未命中处理
+    - 同一手机号的并发刷新只发起一次上游认证请求(single-flight)
+    - 因过期而刷新时，按被替换token的年龄学习有效期(lifetime)，供后台提前刷新使用
+    """
+
+    DEFAULT_MAX_SIZE = 100000
+
+    def __init__(self, store=None, max_size=None, ttl=None, lifetime=None):
+        """
+        Args:
+            store: TokenStore, 持久化存储，不传则按EDJ_TOKEN_STORE环境变量创建
+            max_size: int, 最多缓存的手机号数量
+            ttl: float, token有效期(秒)，不传则不做本地过期判断
+            lifetime: TokenLifetime, 有效期估计，不传则按环境变量EDJ_TOKEN_LIFETIME创建
+        """
+        self.store = store or create_token_store()
+        self.max_size = max_size or self.DEFAULT_MAX_SIZE
+        self.ttl = ttl
+        self.lifetime = lifetime or TokenLifetime.from_env()
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._inflight = {}
+        self.hits = 0
+        self.misses = 0
+        self.refreshes = 0
+        self.coalesced_refreshes = 0
+        self.observed_expiries = 0
+
+    def get(self, phone):
+        """获取token，缓存未命中时从存储加载
+        Args:
+            phone: str, 11位手机号
+        Returns:
+            str: token字符串，不存在或已过期返回None
+        """
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(phone)
+            if entry is not None and not self._expired(entry, now):
+                self._entries.move_to_end(phone)
+                entry.last_used = now
+                self.hits += 1
+                return entry.token
+            self.misses += 1
+
+        entry = self._load(phone)
+        if entry is None or self._expired(entry, now):
+            return None
+        entry.last_used = now
+        with self._lock:
+            self._put_entry(phone, entry)
+        return entry.token
+
+    def save(self, phone, token, issued_at=None):
+        """持久化token并写入缓存"""
+        issued_at = issued_at or time.time()
+        self.store.put(phone, token, issued_at)
+        self.put(phone, token, issued_at)
+
+    def put(self, phone, token, issued_at=None):
+        """写入token(仅内存)"""
+        entry = TokenEntry(token, issued_at or time.time())
+        with self._lock:
+            self._put_entry(phone, entry)
+
+    def invalidate(self, phone):
+        """移除手机号对应的缓存"""
+        with self._lock:
+            self._entries.pop(phone, None)
+
+    def entry(self, phone):
+        """获取缓存条目(不计入命中统计，不触发懒加载)"""
+        with self._lock:
+            return self._entries.get(phone)
+
+    def snapshot(self):
+        """当前缓存的所有条目
+        Returns:
+            list: [(phone, TokenEntry)]
+        """
+        with self._lock:
+            return list(self._entries.items())
+
+    async def refresh(self, phone, fetch, stale_token=None, expired=True):
+        """单飞刷新token
+
+        同一手机号同时只有一个fetch在执行，其余调用等待并共享其结果。
+        如果传入stale_token而缓存(或存储)中的token已经不同，说明其他请求或其他
+        worker进程已完成刷新，直接返回None表示无需再次请求上游。
+        Args:
+            phone: str, 11位手机号
+            fetch: 无参协程函数，执行上游认证并返回接口响应
+            stale_token: str, 要替换的token(可选)
+            expired: bool, stale_token是否已被上游判定过期(计入有效期学习)；
+                后台提前刷新传False
+        Returns:
+            dict: 本次(或共享的)认证接口响应；无需刷新时返回None
+        """
+        if stale_token is not None:
+            entry = self.entry(phone)
+            if entry is None or entry.token == stale_token:
+                # 多进程共享存储时，其他进程可能已刷新并写入存储
+                stored = self._load(phone)
+                if stored is not None and stored.token != stale_token and not self._expired(stored, time.time()):
+                    self.put(phone, stored.token, stored.issued_at)
+                    entry = stored
+            if entry is not None and entry.token != stale_token:
+                self.coalesced_refreshes += 1
+                return None
+
+        task = self._inflight.get(phone)
+        if task is not None:
+            self.coalesced_refreshes += 1
+            return await asyncio.shield(task)
+
+        if stale_token is not None and expired:
+            entry = self.entry(phone)
+            if entry is not None and entry.token == stale_token:
+                self.observed_expiries += 1
+                self.lifetime.observe(time.time() - entry.issued_at)
+
+        task = asyncio.ensure_future(fetch())
+        self._inflight[phone] = task
+        self.refreshes += 1
+        try:
+            return await asyncio.shield(task)
+        finally:
+            if task.done():
+                self._inflight.pop(phone, None)
+            else:
+                task.add_done_callback(lambda _: self._inflight.pop(phone, None))
+
+    def stats(self):
+        """缓存统计信息"""
+        with self._lock:
+            size = len(self._entries)
+        return {
+            'size': size,
+            'hits': self.hits,
+            'misses': self.misses,
+            'refreshes': self.refreshes,
+            'coalesced_refreshes': self.coalesced_refreshes,
+            'inflight_refreshes': len(self._inflight),
+            'observed_expiries': self.observed_expiries
+        }
+
+    def _expired(self, entry, now):
+        return self.ttl is not None and now - entry.issued_at > self.ttl
+
+    def _put_entry(self, phone, entry):
+        self._entries[phone] = entry
+        self._entries.move_to_end(phone)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def _load(self, phone):
+        record = self.store.get(phone)
+        if record is None:
+            return None
+        token, issued_at = record
+        return TokenEntry(token, issued_at)
+
+
+# 进程级共享缓存，所有EdjApi实例默认使用
+token_cache = EdjTokenCache()
+
+# 导出类供外部使用
+__all__ = ['EdjTokenCache', 'TokenEntry', 'TokenLifetime', 'token_cache']
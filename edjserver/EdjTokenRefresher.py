@@ -0,0 +1,193 @@
+import asyncio
+import logging
+import os
+import time
+
+from .EdjLog import log_event
+
+logger = logging.getLogger(__name__)
+
+
+class TokenRefresher:
+    """后台提前刷新token
+
+    定期扫描token缓存，对最近active_window秒内使用过、且按学习到的有效期即将过期的
+    手机号提前调用认证接口，使工具调用基本不再走"返回过期 -> 认证 -> 重试"的分支。
+    有效期由EdjTokenCache.lifetime根据上游的过期响应学习，尚无估计时不做提前刷新。
+    刷新按batch_size分批，批间隔batch_interval秒，另外仍受上游限流器约束。
+    """
+
+    DEFAULT_INTERVAL = 30.0
+    DEFAULT_LEAD = 0.1
+    MIN_LEAD = 60.0
+    DEFAULT_ACTIVE_WINDOW = 1800.0
+    DEFAULT_BATCH_SIZE = 10
+    DEFAULT_BATCH_INTERVAL = 1.0
+
+    def __init__(self, api, name=None, interval=None, lead=None, active_window=None,
+                 batch_size=None, batch_interval=None, enabled=None):
+        """
+        Args:
+            api: AsyncEdjApi, 用于刷新token，token缓存取api.token_cache
+            name: str, 所属租户名，用于指标标签
+            interval: float, 扫描间隔(秒)
+            lead: float, 提前量占有效期的比例，至少MIN_LEAD秒
+            active_window: float, 只刷新该时间(秒)内使用过的手机号
+            batch_size: int, 每批刷新的手机号数
+            batch_interval: float, 批间隔(秒)
+            enabled: bool, 是否启用，默认读取EDJ_TOKEN_REFRESH(设为0关闭)
+        """
+        self.api = api
+        self.name = name or 'default'
+        self.interval = interval or self.DEFAULT_INTERVAL
+        self.lead = self.DEFAULT_LEAD if lead is None else lead
+        self.active_window = active_window or self.DEFAULT_ACTIVE_WINDOW
+        self.batch_size = batch_size or self.DEFAULT_BATCH_SIZE
+        self.batch_interval = self.DEFAULT_BATCH_INTERVAL if batch_interval is None else batch_interval
+        if enabled is None:
+            enabled = os.getenv('EDJ_TOKEN_REFRESH', '1') not in ('0', 'false', 'False')
+        self.enabled = enabled
+        self._task = None
+        self.scans = 0
+        self.refreshed = 0
+        self.failed = 0
+        self.last_due = 0
+
+    def due(self, now=None):
+        """需要提前刷新的手机号
+        Args:
+            now: float, 当前时间戳，默认time.time()
+        Returns:
+            list: [(phone, token)]，按预计过期时间排序
+        """
+        lifetime = self.api.token_cache.lifetime.value
+        if lifetime is None:
+            return []
+        now = now or time.time()
+        refresh_after = lifetime - max(self.MIN_LEAD, lifetime * self.lead)
+        active_since = now - self.active_window
+        due = [(entry.issued_at, phone, entry.token)
+               for phone, entry in self.api.token_cache.snapshot()
+               if entry.last_used >= active_since and now - entry.issued_at >= refresh_after]
+        due.sort()
+        return [(phone, token) for _, phone, token in due]
+
+    def start(self):
+        """在当前事件循环中启动扫描协程(重复调用无副作用)"""
+        if self.enabled and (self._task is None or self._task.done()):
+            self._task = asyncio.ensure_future(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def stats(self):
+        return {'scans': self.scans, 'refreshed': self.refreshed, 'failed': self.failed,
+                'due': self.last_due}
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.refresh_due()
+            except Exception as e:
+                log_event(logger, logging.WARNING, 'token_refresh_scan_failed', tenant=self.name,
+                          error=str(e))
+
+    async def refresh_due(self):
+        """扫描一次并分批刷新到期的token
+        Returns:
+            int: 本次刷新成功的数量
+        """
+        self.scans += 1
+        lifetime = self.api.token_cache.lifetime.value
+        if lifetime is not None:
+            self.api.metrics.token_lifetime.labels(self.name).set(lifetime)
+        due = self.due()
+        self.last_due = len(due)
+        refreshed = 0
+        for start in range(0, len(due), self.batch_size):
+            if start:
+                await asyncio.sleep(self.batch_interval)
+            batch = due[start:start + self.batch_size]
+            results = await asyncio.gather(
+                *(self.api.refresh_authen_token(phone, stale_token=token, proactive=True)
+                  for phone, token in batch), return_exceptions=True)
+            for result in results:
+                if isinstance(result, dict) and result.get('code') == '0':
+                    refreshed += 1
+                else:
+                    self.failed += 1
+        self.refreshed += refreshed
+        if due:
+            log_event(logger, logging.INFO, 'tokens_refreshed', tenant=self.name, due=len(due),
+                      refreshed=refreshed, lifetime=round(lifetime))
+        return refreshed
+
+
+def test_token_refresher():
+    """
+    测试有效期学习和提前刷新: 一次过期响应学到有效期后，活跃且即将过期的token
+    被提前刷新，随后的预估请求不再返回过期
+    """
+    from .EdjApi import AsyncEdjApi
+    from .EdjMockServer import MockConfig, MockEdjServer
+    from .EdjTokenCache import EdjTokenCache
+    from .EdjTokenStore import KVTokenStore
+
+    mock = MockEdjServer(MockConfig(token_ttl=1000))
+    base_url = mock.start_in_thread()
+
+    async def run():
+        api = AsyncEdjApi(api_base_url=base_url, token_cache=EdjTokenCache(store=KVTokenStore()))
+        api.rate_limiter = None
+        refresher = TokenRefresher(api, batch_size=2, batch_interval=0)
+        phones = [f"1380000000{n}" for n in range(6)]
+        for phone in phones:
+            assert (await api.refresh_authen_token(phone))['code'] == '0'
+
+        # 把签发时间调早(模拟服务和本地缓存一致)，第0个已过有效期，1-4个即将过期
+        now = time.time()
+        for n, phone in enumerate(phones):
+            token = api.get_token_by_phone(phone)
+            age = 1010 if n == 0 else 950
+            mock.tokens[token] = (phone, now - age)
+            api.token_cache.put(phone, token, now - age)
+        # 第5个很久没有使用，不提前刷新
+        api.token_cache.entry(phones[5]).last_used = now - refresher.active_window - 1
+        assert refresher.due() == []
+
+        token = api.get_token_by_phone(phones[0])
+        result = await api.get_cost_estimate_v2(token, 40.018682, 116.476169, 39.908692, 116.397477)
+        assert result['code'] == '10'
+        await api.refresh_authen_token(phones[0], stale_token=token)
+        assert 1000 <= api.token_cache.lifetime.value < 1020
+
+        assert [phone for phone, _ in refresher.due()] == phones[1:5]
+        assert await refresher.refresh_due() == 4
+        assert refresher.due() == []
+        mock.reset_stats()
+        for phone in phones[1:5]:
+            token = api.get_token_by_phone(phone)
+            result = await api.get_cost_estimate_v2(token, 40.018682, 116.476169, 39.908692, 116.397477)
+            assert result['code'] == '0', result
+        assert mock.calls.get('/customer/getAuthenToken', 0) == 0
+        await api.aclose()
+
+    try:
+        asyncio.run(run())
+    finally:
+        mock.stop()
+    print('token提前刷新验证通过!')
+
+
+# 导出类供外部使用
+__all__ = ['TokenRefresher']
+
+if __name__ == '__main__':
+    test_token_refresher()
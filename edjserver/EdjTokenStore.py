@@ -0,0 +1,328 @@
+import hashlib
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+
+
+def state_directory(*parts):
+    """运行时状态(幂等日志、共享SQLite、审计日志)的默认目录: EDJ_STATE_DIR，未设置时为
+    用户数据目录($XDG_DATA_HOME或~/.local/share)下的edaijiamcp，不写入代码目录
+    Args:
+        parts: str, 目录下的子路径
+    Returns:
+        str: 路径(不创建)
+    """
+    state_dir = os.getenv('EDJ_STATE_DIR')
+    if not state_dir:
+        data_home = os.getenv('XDG_DATA_HOME') or os.path.join(os.path.expanduser('~'), '.local', 'share')
+        state_dir = os.path.join(data_home, 'edaijiamcp')
+    return os.path.join(state_dir, *parts)
+
+
+def connect_sqlite(db_path, synchronous='NORMAL'):
+    """打开WAL模式的SQLite连接，供多个进程共享同一数据库文件
+    Args:
+        db_path: str, 数据库文件路径(目录不存在时创建)
+        synchronous: str, NORMAL或FULL(每次提交落盘)
+    Returns:
+        sqlite3.Connection, 自动提交模式，可跨线程使用(调用方自行加锁)
+    """
+    os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+    conn = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None, timeout=5.0)
+    # 多个worker同时初始化新数据库时，切换WAL模式可能不经busy等待直接返回locked，需要重试
+    for attempt in range(50):
+        try:
+            conn.execute('PRAGMA journal_mode=WAL')
+            break
+        except sqlite3.OperationalError:
+            if attempt == 49:
+                raise
+            time.sleep(0.1)
+    conn.execute(f'PRAGMA synchronous={synchronous}')
+    conn.execute('PRAGMA busy_timeout=5000')
+    return conn
+
+
+class TokenStore:
+    """token持久化存储接口
+
+    get返回(token, issued_at)，issued_at为签发时间戳(秒)，不存在返回None。
+    """
+
+    def get(self, phone):
+        raise NotImplementedError
+
+    def put(self, phone, token, issued_at=None):
+        raise NotImplementedError
+
+    def delete(self, phone):
+        raise NotImplementedError
+
+    def flush(self):
+        """将缓冲中的写入落盘，默认无缓冲"""
+
+    def close(self):
+        self.flush()
+
+
+class FlatFileTokenStore(TokenStore):
+    """单目录存储，每个手机号一个<phone>.token文件(原有布局)"""
+
+    DEFAULT_TOKEN_DIR = os.path.join(os.path.dirname(__file__), 'tokens')
+
+    def __init__(self, token_dir=None):
+        self.token_dir = token_dir or self.DEFAULT_TOKEN_DIR
+
+    def _path(self, phone):
+        return os.path.join(self.token_dir, f"{phone}.token")
+
+    def get(self, phone):
+        path = self._path(phone)
+        try:
+            with open(path, 'r') as f:
+                token = f.read().strip()
+            issued_at = os.path.getmtime(path)
+        except FileNotFoundError:
+            return None
+        if not token:
+            return None
+        return token, issued_at
+
+    def put(self, phone, token, issued_at=None):
+        path = self._path(phone)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'w') as f:
+            f.write(token)
+        if issued_at is not None:
+            os.utime(path, (issued_at, issued_at))
+
+    def delete(self, phone):
+        try:
+            os.remove(self._path(phone))
+        except FileNotFoundError:
+            pass
+
+
+class ShardedFileTokenStore(FlatFileTokenStore):
+    """按手机号哈希分片的两级目录存储
+
+    路径形如 <root>/ab/cd/<phone>.token，单目录文件数保持在较小规模。
+    写入先写临时文件再rename，读方不会看到写了一半的token。
+    """
+
+    def _path(self, phone):
+        digest = hashlib.md5(phone.encode()).hexdigest()
+        return os.path.join(self.token_dir, digest[:2], digest[2:4], f"{phone}.token")
+
+    def put(self, phone, token, issued_at=None):
+        path = self._path(phone)
+        shard_dir = os.path.dirname(path)
+        os.makedirs(shard_dir, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=shard_dir, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'w') as f:
+                f.write(token)
+            if issued_at is not None:
+                os.utime(tmp_path, (issued_at, issued_at))
+            os.replace(tmp_path, path)
+        except BaseException:
+            try:
+                os.remove(tmp_path)
+            except FileNotFoundError:
+                pass
+            raise
+
+
+class SqliteTokenStore(TokenStore):
+    """SQLite存储(WAL模式)，多个worker进程可共享同一数据库文件
+
+    写入先进入内存缓冲，累计batch_size条或距上次落盘超过flush_interval秒后
+    在一个事务中批量写入；缓冲中剩余的写入最迟flush_interval秒后由定时器落盘，
+    保证其他进程能及时读到。缓冲中的写入对本进程的读取立即可见。
+    """
+
+    DEFAULT_BATCH_SIZE = 256
+    DEFAULT_FLUSH_INTERVAL = 0.5
+
+    def __init__(self, db_path, batch_size=None, flush_interval=None):
+        self.db_path = db_path
+        self.batch_size = batch_size or self.DEFAULT_BATCH_SIZE
+        self.flush_interval = self.DEFAULT_FLUSH_INTERVAL if flush_interval is None else flush_interval
+        self._lock = threading.Lock()
+        self._pending = {}
+        self._last_flush = time.monotonic()
+        self._timer = None
+        self._conn = connect_sqlite(db_path)
+        self._conn.execute(
+            'CREATE TABLE IF NOT EXISTS tokens ('
+            'phone TEXT PRIMARY KEY, token TEXT, issued_at REAL) WITHOUT ROWID')
+
+    def get(self, phone):
+        with self._lock:
+            if phone in self._pending:
+                return self._pending[phone]
+            row = self._conn.execute(
+                'SELECT token, issued_at FROM tokens WHERE phone = ?', (phone,)).fetchone()
+        if row is None or row[0] is None:
+            return None
+        return row[0], row[1]
+
+    def put(self, phone, token, issued_at=None):
+        with self._lock:
+            self._pending[phone] = (token, issued_at or time.time())
+            if (len(self._pending) >= self.batch_size
+                    or time.monotonic() - self._last_flush >= self.flush_interval):
+                self._flush_locked()
+            elif self._timer is None:
+                self._timer = threading.Timer(self.flush_interval, self.flush)
+                self._timer.daemon = True
+                self._timer.start()
+
+    def delete(self, phone):
+        with self._lock:
+            # 以None占位，保证落盘顺序与调用顺序一致
+            self._pending[phone] = None
+            self._flush_locked()
+
+    def flush(self):
+        with self._lock:
+            self._flush_locked()
+
+    def close(self):
+        self.flush()
+        self._conn.close()
+
+    def _flush_locked(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        self._last_flush = time.monotonic()
+        if not self._pending:
+            return
+        upserts = [(phone, v[0], v[1]) for phone, v in self._pending.items() if v is not None]
+        deletes = [(phone,) for phone, v in self._pending.items() if v is None]
+        self._conn.execute('BEGIN')
+        try:
+            if upserts:
+                self._conn.executemany(
+                    'INSERT OR REPLACE INTO tokens (phone, token, issued_at) VALUES (?, ?, ?)', upserts)
+            if deletes:
+                self._conn.executemany('DELETE FROM tokens WHERE phone = ?', deletes)
+            self._conn.execute('COMMIT')
+        except BaseException:
+            self._conn.execute('ROLLBACK')
+            raise
+        self._pending.clear()
+
+
+class LocalKVClient:
+    """网络KV存储(如Redis)的本地替身，只实现get/set/delete
+
+    数据保存在进程内，仅用于单进程部署和测试；多worker部署时替换为
+    实现相同方法的网络客户端即可。
+    """
+
+    def __init__(self):
+        self._data = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            return self._data.get(key)
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = value
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+
+class KVTokenStore(TokenStore):
+    """基于KV客户端的存储，值格式为"<issued_at>\\t<token>\""""
+
+    DEFAULT_PREFIX = 'edj:token:'
+
+    def __init__(self, client=None, prefix=None):
+        self.client = client or LocalKVClient()
+        self.prefix = prefix or self.DEFAULT_PREFIX
+
+    def get(self, phone):
+        value = self.client.get(self.prefix + phone)
+        if value is None:
+            return None
+        if isinstance(value, bytes):
+            value = value.decode()
+        issued_at, _, token = value.partition('\t')
+        return token, float(issued_at)
+
+    def put(self, phone, token, issued_at=None):
+        self.client.set(self.prefix + phone, f"{issued_at or time.time()}\t{token}")
+
+    def delete(self, phone):
+        self.client.delete(self.prefix + phone)
+
+
+class NamespacedTokenStore(TokenStore):
+    """在共享存储上按命名空间隔离token，键为"<namespace>.<phone>"
+
+    多个租户共用一个底层存储时，同一手机号在各租户下的token互不覆盖。
+    底层存储由创建方负责关闭，close只落盘缓冲。
+    """
+
+    def __init__(self, store, namespace):
+        self.store = store
+        self.namespace = namespace
+
+    def _key(self, phone):
+        return f"{self.namespace}.{phone}"
+
+    def get(self, phone):
+        return self.store.get(self._key(phone))
+
+    def put(self, phone, token, issued_at=None):
+        self.store.put(self._key(phone), token, issued_at)
+
+    def delete(self, phone):
+        self.store.delete(self._key(phone))
+
+    def flush(self):
+        self.store.flush()
+
+    def close(self):
+        self.store.flush()
+
+
+def create_token_store(spec=None):
+    """根据配置创建token存储
+    Args:
+        spec: str, 存储配置，不传则读取环境变量EDJ_TOKEN_STORE，格式:
+            file[:目录]     单目录文件存储(默认，目录默认为edjserver/tokens)
+            sharded:目录    分片目录存储
+            sqlite:文件路径 SQLite存储
+            kv              本地KV替身
+    Returns:
+        TokenStore: token存储实例
+    """
+    spec = spec or os.getenv('EDJ_TOKEN_STORE') or 'file'
+    kind, _, arg = spec.partition(':')
+    if kind == 'file':
+        return FlatFileTokenStore(arg or None)
+    if kind == 'sharded':
+        return ShardedFileTokenStore(arg or None)
+    if kind == 'sqlite':
+        if not arg:
+            raise ValueError("sqlite存储需要指定数据库文件路径，例如 sqlite:/var/lib/edj/tokens.db")
+        return SqliteTokenStore(arg)
+    if kind == 'kv':
+        return KVTokenStore()
+    raise ValueError(f"未知的token存储类型: {spec}")
+
+
+# 导出类供外部使用
+__all__ = ['TokenStore', 'FlatFileTokenStore', 'ShardedFileTokenStore', 'SqliteTokenStore',
+           'LocalKVClient', 'KVTokenStore', 'NamespacedTokenStore', 'connect_sqlite',
+           'create_token_store', 'state_directory']
@@ -0,0 +1,392 @@
+"""多worker进程部署
+
+主进程绑定监听端口后启动N个worker进程共享该端口，每个worker运行一个uvicorn服务。
+SSE会话是有状态的：GET /sse建立的会话只存在于接受该连接的worker中，而客户端随后的
+POST /messages/?session_id=...可能被任意worker接受。为此每个worker额外监听一个本机
+私有端口，收到不属于自己的会话消息时转发给其他worker，并记住会话所在的worker。
+
+信号:
+    SIGTERM/SIGINT  优雅退出: worker停止接受新连接，等待进行中的请求完成(最多drain_timeout秒)
+    SIGHUP          滚动重启: 先启动新一批worker，再让旧worker优雅退出
+
+每批worker(generation)使用各自的私有端口: 旧worker退出时只停止接受公共端口的连接，私有端口
+保持监听到退出为止；新worker把旧worker的私有端口也作为转发目标，旧会话的消息仍能转发到旧worker，
+不会被新worker返回404。
+"""
+import asyncio
+import importlib
+import logging
+import multiprocessing
+import os
+import signal
+import socket
+import time
+from collections import OrderedDict
+from urllib.parse import parse_qs
+
+from .EdjLog import configure_logging, log_event
+from .EdjMetrics import metrics
+
+logger = logging.getLogger(__name__)
+
+
+def _import(path):
+    """按 模块:属性 格式导入对象"""
+    module, _, attr = path.partition(':')
+    return getattr(importlib.import_module(module), attr)
+
+
+class SessionRouter:
+    """ASGI中间件: 把其他worker持有的SSE会话消息转发过去"""
+
+    FORWARDED_HEADER = b'x-edj-forwarded'
+    MAX_OWNERS = 100000
+    LOCAL = 'local'
+
+    def __init__(self, app, peers=(), message_path=None):
+        """
+        Args:
+            app: ASGI应用
+            peers: list, 其他worker的本机私有端口
+            message_path: str, SSE消息路径，默认取fastmcp配置(/messages/)
+        """
+        if message_path is None:
+            import fastmcp
+            message_path = fastmcp.settings.message_path
+        self.app = app
+        self.peers = list(peers)
+        self.message_path = message_path
+        self._owners = OrderedDict()
+        self._client = None
+        self.forwarded = 0
+
+    async def __call__(self, scope, receive, send):
+        if (scope['type'] != 'http' or not self.peers or scope['method'] != 'POST'
+                or not scope['path'].startswith(self.message_path)
+                or any(name == self.FORWARDED_HEADER for name, _ in scope['headers'])):
+            return await self.app(scope, receive, send)
+
+        session_id = parse_qs(scope['query_string'].decode()).get('session_id', [None])[0]
+        owner = self._owners.get(session_id)
+        if owner == self.LOCAL or session_id is None:
+            return await self.app(scope, receive, send)
+
+        body = await self._read_body(receive)
+        if owner is None:
+            # 先尝试本地处理；会话不在本worker时SSE传输返回404且没有副作用
+            messages = []
+
+            async def capture(message):
+                messages.append(message)
+
+            await self.app(scope, self._replay(body), capture)
+            if not messages or messages[0].get('status') != 404:
+                self._remember(session_id, self.LOCAL)
+                for message in messages:
+                    await send(message)
+                return
+            candidates = self.peers
+        else:
+            candidates = [owner]
+
+        response = await self._forward(scope, body, session_id, candidates)
+        if response is None:
+            # 所有worker都没有该会话(已断开)，由本地返回404
+            return await self.app(scope, self._replay(body), send)
+        headers = [(k.encode('latin-1'), v.encode('latin-1')) for k, v in response.headers.items()
+                   if k.lower() not in ('content-length', 'transfer-encoding', 'connection')]
+        headers.append((b'content-length', str(len(response.content)).encode()))
+        await send({'type': 'http.response.start', 'status': response.status_code, 'headers': headers})
+        await send({'type': 'http.response.body', 'body': response.content})
+
+    async def _forward(self, scope, body, session_id, candidates):
+        """并发转发给候选worker，只有持有会话的worker会处理，返回其响应"""
+        import httpx
+        if self._client is None:
+            self._client = httpx.AsyncClient(timeout=30.0)
+        headers = [(k.decode('latin-1'), v.decode('latin-1')) for k, v in scope['headers']
+                   if k not in (b'host', b'content-length')]
+        headers.append((self.FORWARDED_HEADER.decode(), '1'))
+        path = scope['path'] + ('?' + scope['query_string'].decode() if scope['query_string'] else '')
+
+        async def post(port):
+            try:
+                return port, await self._client.post(f"http://127.0.0.1:{port}{path}",
+                                                     content=body, headers=headers)
+            except Exception:
+                return port, None
+
+        results = await asyncio.gather(*(post(port) for port in candidates))
+        for port, response in results:
+            if response is not None and response.status_code != 404:
+                self._remember(session_id, port)
+                self.forwarded += 1
+                return response
+        self._owners.pop(session_id, None)
+        return None
+
+    def _remember(self, session_id, owner):
+        self._owners[session_id] = owner
+        self._owners.move_to_end(session_id)
+        if len(self._owners) > self.MAX_OWNERS:
+            self._owners.popitem(last=False)
+
+    @staticmethod
+    async def _read_body(receive):
+        chunks = []
+        while True:
+            message = await receive()
+            if message['type'] != 'http.request':
+                break
+            chunks.append(message.get('body', b''))
+            if not message.get('more_body'):
+                break
+        return b''.join(chunks)
+
+    @staticmethod
+    def _replay(body):
+        sent = False
+
+        async def receive():
+            nonlocal sent
+            if sent:
+                # 请求体已读完，之后只会等待客户端断开
+                await asyncio.Event().wait()
+            sent = True
+            return {'type': 'http.request', 'body': body, 'more_body': False}
+        return receive
+
+
+def _worker_main(app_path, shutdown_path, sockets, peers, drain_timeout, index):
+    """worker进程入口"""
+    import uvicorn
+    os.environ['EDJ_WORKER_ID'] = str(index)
+    app = SessionRouter(_import(app_path)(), peers)
+    metrics.add_stats('edj_worker', lambda: {'id': index, 'forwarded_messages': app.forwarded},
+                      counters=('forwarded_messages',))
+    class WorkerServer(uvicorn.Server):
+        """退出时先停止接受公共端口的新连接，私有端口保持监听直到进行中的请求完成，
+        滚动重启期间新worker仍可把本worker持有的SSE会话消息转发过来"""
+
+        async def shutdown(self, sockets=None):
+            private = self.servers[1:]
+            self.servers = self.servers[:1]
+            try:
+                await super().shutdown(sockets[:1] if sockets else None)
+            finally:
+                for server in private:
+                    server.close()
+
+    config = uvicorn.Config(app, log_level='warning', lifespan='on',
+                            timeout_graceful_shutdown=drain_timeout)
+    server = WorkerServer(config)
+
+    async def serve():
+        try:
+            await server.serve(sockets=sockets)
+        finally:
+            if shutdown_path:
+                await _import(shutdown_path)()
+
+    asyncio.run(serve())
+
+
+class _Slot:
+    """一个worker位置: 异常退出后重启时私有端口保持不变，其他worker无需更新转发表；
+    滚动重启时新一批worker使用新的_Slot和私有端口"""
+    __slots__ = ('index', 'generation', 'private', 'process', 'started_at')
+
+    def __init__(self, index, private, generation=0):
+        self.index = index
+        self.generation = generation
+        self.private = private
+        self.process = None
+        self.started_at = 0.0
+
+    @property
+    def private_port(self):
+        return self.private.getsockname()[1]
+
+
+class WorkerPool:
+    """预先fork的worker进程池
+
+    主进程只负责绑定端口、启动和监控worker，不处理请求。worker异常退出时自动重启。
+    每个worker的私有端口也提供完整服务(包括/metrics)，指定private_port_base时
+    第i个worker使用private_port_base+i，滚动重启后的新一批worker与旧一批交替使用
+    private_port_base+workers+i(端口仍被占用时改为随机端口)，旧worker退出前两批端口同时可用。
+    """
+
+    DEFAULT_DRAIN_TIMEOUT = 30.0
+    RESPAWN_DELAY = 1.0
+
+    def __init__(self, app, host='127.0.0.1', port=8000, workers=None, drain_timeout=None,
+                 on_shutdown=None, private_port_base=None):
+        """
+        Args:
+            app: str, 返回ASGI应用的工厂函数，格式 模块:函数名，在每个worker中调用
+            host: str, 监听地址
+            port: int, 监听端口
+            workers: int, worker进程数，默认为CPU核数
+            drain_timeout: float, 退出时等待进行中请求的最长时间(秒)
+            on_shutdown: str, worker退出前调用的协程函数，格式 模块:函数名
+            private_port_base: int, worker私有端口起始值，不传则随机分配
+        """
+        self.app = app
+        self.host = host
+        self.port = port
+        self.workers = workers or os.cpu_count() or 1
+        self.drain_timeout = self.DEFAULT_DRAIN_TIMEOUT if drain_timeout is None else drain_timeout
+        self.on_shutdown = on_shutdown
+        self.private_port_base = private_port_base
+        self._context = multiprocessing.get_context('spawn')
+        self._socket = None
+        self._slots = []
+        self._generation = 0
+        # 滚动重启后仍在退出中的旧worker位置
+        self._retired = []
+        self._draining = []
+        self._stopping = False
+        self._restart = False
+
+    def run(self):
+        """启动worker并阻塞到收到退出信号"""
+        self._socket = self._listen(self.host, self.port)
+        self._slots = self._new_slots()
+
+        signal.signal(signal.SIGTERM, self._handle_stop)
+        signal.signal(signal.SIGINT, self._handle_stop)
+        if hasattr(signal, 'SIGHUP'):
+            signal.signal(signal.SIGHUP, self._handle_restart)
+
+        for slot in self._slots:
+            self._spawn(slot)
+        log_event(logger, logging.INFO, 'workers_started', host=self.host, port=self.port,
+                  workers=self.workers, pid=os.getpid(),
+                  private_ports=[slot.private_port for slot in self._slots])
+        try:
+            while not self._stopping:
+                time.sleep(0.2)
+                if self._restart:
+                    self._restart = False
+                    self._rolling_restart()
+                self._supervise()
+        finally:
+            self._drain([slot.process for slot in self._slots])
+            while self._draining:
+                self._reap()
+                time.sleep(0.1)
+            for slot in self._slots:
+                slot.private.close()
+            self._socket.close()
+            log_event(logger, logging.INFO, 'workers_stopped')
+
+    def _new_slots(self):
+        """为当前generation创建worker位置并绑定私有端口"""
+        slots = []
+        for index in range(self.workers):
+            port = 0
+            if self.private_port_base:
+                port = self.private_port_base + index + (self._generation % 2) * self.workers
+            try:
+                private = self._listen('127.0.0.1', port)
+            except OSError:
+                if not port:
+                    raise
+                # 上上批worker还未退出，端口仍被占用
+                log_event(logger, logging.WARNING, 'private_port_in_use', worker=index, port=port)
+                private = self._listen('127.0.0.1', 0)
+            slots.append(_Slot(index, private, self._generation))
+        return slots
+
+    @staticmethod
+    def _listen(host, port):
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        sock.bind((host, port))
+        sock.listen(2048)
+        sock.set_inheritable(True)
+        return sock
+
+    def _handle_stop(self, signum, frame):
+        self._stopping = True
+
+    def _handle_restart(self, signum, frame):
+        self._restart = True
+
+    def _spawn(self, slot):
+        # 旧一批worker退出前，其会话的消息仍转发给它们
+        peers = [other.private_port for other in self._slots if other is not slot]
+        peers.extend(old.private_port for old in self._retired)
+        slot.process = self._context.Process(
+            target=_worker_main, name=f"edj-worker-{slot.index}",
+            args=(self.app, self.on_shutdown, [self._socket, slot.private], peers,
+                  self.drain_timeout, slot.index))
+        slot.process.start()
+        slot.started_at = time.monotonic()
+
+    def _rolling_restart(self):
+        """新worker启动后旧worker才开始退出，监听端口始终有进程在接受连接
+
+        新一批worker绑定新的私有端口，旧worker的私有端口在其退出前保留，
+        SessionRouter仍可把旧会话的消息转发给持有会话的旧worker。
+        """
+        old = self._slots
+        self._retired.extend(old)
+        self._generation += 1
+        self._slots = self._new_slots()
+        for slot in self._slots:
+            self._spawn(slot)
+        self._drain([slot.process for slot in old])
+        log_event(logger, logging.INFO, 'workers_restarted', workers=self.workers,
+                  generation=self._generation, private_ports=[slot.private_port for slot in self._slots])
+
+    def _supervise(self):
+        """重启异常退出的worker，回收已结束的旧worker"""
+        for slot in self._slots:
+            if slot.process.is_alive():
+                continue
+            if time.monotonic() - slot.started_at < self.RESPAWN_DELAY:
+                continue
+            log_event(logger, logging.WARNING, 'worker_exited', worker=slot.index,
+                      exitcode=slot.process.exitcode)
+            self._spawn(slot)
+        self._reap()
+
+    def _drain(self, processes):
+        """让一批worker优雅退出(SIGTERM)，超时后强制结束"""
+        deadline = time.monotonic() + self.drain_timeout + 5.0
+        for process in processes:
+            if process.is_alive():
+                process.terminate()
+            self._draining.append((process, deadline))
+
+    def _reap(self):
+        remaining = []
+        for process, deadline in self._draining:
+            if process.is_alive():
+                if time.monotonic() < deadline:
+                    remaining.append((process, deadline))
+                    continue
+                process.kill()
+            process.join()
+        self._draining = remaining
+        # 旧worker退出后关闭其私有端口(主进程持有的副本)
+        retired = []
+        for slot in self._retired:
+            if slot.process.is_alive():
+                retired.append(slot)
+            else:
+                slot.private.close()
+        self._retired = retired
+
+
+def run_workers(app, host='127.0.0.1', port=8000, workers=None, drain_timeout=None, on_shutdown=None,
+                private_port_base=None):
+    """以多worker模式运行，参数同WorkerPool"""
+    configure_logging()
+    WorkerPool(app, host, port, workers, drain_timeout, on_shutdown, private_port_base).run()
+
+
+# 导出类供外部使用
+__all__ = ['SessionRouter', 'WorkerPool', 'run_workers']
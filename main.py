@@ -1,5 +1,49 @@
-def main():
-    print("Hello from edaijiamcp!")
+"""e代驾MCP服务入口
+
+配置优先级: 命令行参数 > 环境变量 > .env文件 > 默认值。
+
+用法:
+    python main.py                                        # 默认SSE，监听127.0.0.1:8000
+    python main.py --transport stdio                      # 由上层进程通过stdin/stdout嵌入运行
+    python main.py --transport streamable-http --host 0.0.0.0 --port 8000 --workers 4
+"""
+import argparse
+import os
+
+from dotenv import load_dotenv
+
+TRANSPORTS = ("stdio", "sse", "streamable-http")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="e代驾MCP服务")
+    parser.add_argument("--transport", choices=TRANSPORTS,
+                        help="传输方式(EDJ_TRANSPORT，默认sse)")
+    parser.add_argument("--host", help="HTTP监听地址(EDJ_HOST，默认127.0.0.1)")
+    parser.add_argument("--port", type=int, help="HTTP监听端口(EDJ_PORT，默认8000)")
+    parser.add_argument("--workers", type=int, help="worker进程数(EDJ_WORKERS，默认1)")
+    parser.add_argument("--log-level", help="日志级别(EDJ_LOG_LEVEL，默认INFO)")
+    parser.add_argument("--env-file", default=None, help="环境变量文件，默认当前目录的.env")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    # 服务模块在导入时按环境变量初始化，需先加载.env并写入命令行参数再导入
+    load_dotenv(args.env_file)
+    overrides = {
+        "EDJ_TRANSPORT": args.transport,
+        "EDJ_HOST": args.host,
+        "EDJ_PORT": args.port,
+        "EDJ_WORKERS": args.workers,
+        "EDJ_LOG_LEVEL": args.log_level,
+    }
+    for name, value in overrides.items():
+        if value is not None:
+            os.environ[name] = str(value)
+
+    import edaijiamcp
+    edaijiamcp.run()
 
 
 if __name__ == "__main__":